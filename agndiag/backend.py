@@ -0,0 +1,136 @@
+"""
+Array backends of the kernels.
+The kernels (the diagrams, the combiners of their classes and the cleaning
+kernel) are written with NumPy, the reference backend, and dispatched on
+the array namespace of their arguments. NumPy arrays (and any other array
+like, converted by the kernels) run the kernel directly. Dask arrays build
+a lazy graph that runs the NumPy kernel on each chunk of rows, so the work
+is chunked and can use several cores without converting the arrays; the
+outputs are Dask arrays with the chunks of the first Dask argument.
+Dask is imported only if Dask arrays are given.
+
+Usage:
+    x = dask.array.from_array(x, chunks=10**6)
+    diag, c_diag = diag_nii_Sabater2012(x, y, c_x, c_y)
+    diag, c_diag = dask.compute(diag, c_diag)
+"""
+__author__ = "jsm"
+import functools
+import numpy as np
+
+
+def is_dask(array):
+    """
+    True for Dask arrays (checked without importing Dask).
+    """
+    return type(array).__module__.split(".")[0] == "dask"
+
+
+def array_namespace(*arrays):
+    """
+    Namespace of the arrays: dask.array if any of them is a Dask array and
+    numpy otherwise.
+    """
+    if any(is_dask(a) for a in arrays):
+        import dask.array
+
+        return dask.array
+    return np
+
+
+def array_kernel(function=None, shared=()):
+    """
+    Decorator dispatching a NumPy kernel on the namespace of its arguments.
+    The kernel must work row by row on arrays with one element (or one row)
+    per galaxy; with Dask arguments it is applied with map_rows.
+    Input:
+      shared - names of the keyword arguments that are never split in rows
+               (e.g. one value per column)
+    Usage: @array_kernel or @array_kernel(shared=["factors"])
+    """
+    if function is None:
+        return functools.partial(array_kernel, shared=shared)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if array_namespace(*args, *kwargs.values()) is np:
+            return function(*args, **kwargs)
+        return map_rows(function, *args, shared=shared, **kwargs)
+
+    return wrapper
+
+
+def map_rows(function, *args, shared=(), **kwargs):
+    """
+    Apply a NumPy kernel lazily to each chunk of rows of its Dask array
+    arguments. The NumPy arrays (or lists) with as many rows as the Dask
+    arrays are split in the same chunks, unless they are keyword arguments
+    named in 'shared'; the other arguments are passed unchanged to every
+    chunk. The in-place arguments 'out' and 'scratch' raise ValueError.
+    The outputs (an array, a tuple or a dictionary of arrays) are Dask
+    arrays. Their types and shapes are taken from a call without rows.
+    """
+    import dask
+    import dask.array as da
+
+    for name in ["out", "scratch"]:
+        if kwargs.get(name) is not None:
+            raise ValueError("'{}' can not be used with Dask arrays".format(name))
+    names = list(kwargs)
+    values = list(args) + list(kwargs.values())
+    lazy = [i for i, value in enumerate(values) if is_dask(value)]
+    rows = values[lazy[0]].chunks[0]
+    n_rows = sum(rows)
+    for i, value in enumerate(values):
+        if i in lazy or isinstance(value, (str, dict)):
+            continue
+        if i >= len(args) and names[i - len(args)] in shared:
+            continue
+        if np.ndim(value) > 0 and len(value) == n_rows:
+            values[i] = da.from_array(np.asarray(value), chunks=-1)
+            lazy.append(i)
+    lazy.sort()
+    for i in lazy:
+        shape = values[i].shape
+        values[i] = values[i].rechunk((rows,) + tuple((s,) for s in shape[1:]))
+    empty = list(values)
+    for i in lazy:
+        empty[i] = np.empty((0,) + values[i].shape[1:], dtype=values[i].dtype)
+    meta = function(*empty[: len(args)], **dict(zip(names, empty[len(args) :])))
+    keys, leaves = _flatten(meta)
+    blocks = [values[i].to_delayed().ravel() for i in lazy]
+    parts = [[] for _ in leaves]
+    for k, n in enumerate(rows):
+        chunk = list(values)
+        for i, block in zip(lazy, blocks):
+            chunk[i] = block[k]
+        result = dask.delayed(_call_flat)(function, chunk, len(args), names)
+        for j, leaf in enumerate(leaves):
+            parts[j].append(
+                da.from_delayed(
+                    result[j], shape=(n,) + leaf.shape[1:], dtype=leaf.dtype
+                )
+            )
+    outputs = [da.concatenate(p) for p in parts]
+    if keys is None:
+        return outputs[0] if isinstance(meta, np.ndarray) else tuple(outputs)
+    return dict(zip(keys, outputs))
+
+
+def _flatten(output):
+    """
+    Keys (None if not a dictionary) and arrays of the output of a kernel.
+    """
+    if isinstance(output, dict):
+        return list(output), list(output.values())
+    if isinstance(output, tuple):
+        return None, list(output)
+    return None, [output]
+
+
+def _call_flat(function, values, n_args, names):
+    """
+    Call a kernel on a chunk and return the list of its output arrays.
+    """
+    output = function(*values[:n_args], **dict(zip(names, values[n_args:])))
+    return _flatten(output)[1]
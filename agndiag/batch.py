@@ -0,0 +1,210 @@
+"""
+Resumable batch runs of long classification jobs.
+The catalogue is processed in numbered chunks of rows. The columns derived
+from each chunk are written as a directory of .npy files that is renamed
+into place once complete, and a manifest in the job directory records the
+task, its parameters and the completed chunks. A job restarted after an
+interruption (e.g. the pre-emption of a node) skips the completed chunks.
+When every chunk is done they are merged into the final columns, which are
+identical to those of an uninterrupted run because the chunks and the
+random streams of each chunk do not depend on the interruptions. The
+manifest also records a fingerprint of the input, so a job is not resumed
+on a different catalogue.
+
+Usage:
+    columns = run_batch("gal_line_dr7_v5_2.fit", "job", chunk_size=10**6)
+    columns = run_batch("gal_line_dr7_v5_2.fit", "mc", task="probabilities")
+"""
+__author__ = "jsm"
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+from . import mpa_jhu
+from .cache import manifest_name
+from .incremental import load_classification, save_classification
+from .montecarlo import class_probabilities
+from .outofcore import count_rows, read_rows
+
+job_manifest_name = "manifest.json"
+merged_name = "merged"
+default_chunk_size = 1000000
+# Rows of the first and last blocks hashed in the fingerprint of a mapping
+fingerprint_rows = 1024
+
+
+def _classify(chunk, number, sigma=3.0, ew_method=1, use_limits=True):
+    return mpa_jhu.classify_columns(
+        chunk, sigma=sigma, ew_method=ew_method, use_limits=use_limits
+    )
+
+
+def _probabilities(
+    chunk, number, n_samples=100, use_limits=True, seed=0, sigma=3.0, ew_method=1
+):
+    out = mpa_jhu.clean_columns(chunk, sigma=sigma, ew_method=ew_method)
+    mpa_jhu.combine_sii_columns(out, out=out)
+    mpa_jhu.ratio_columns(out, out=out)
+    # Random stream of the chunk derived from the seed and the chunk number
+    return class_probabilities(
+        out, n_samples=n_samples, use_limits=use_limits, seed=[seed, number]
+    )
+
+
+# Tasks run on each chunk: function of the input columns of the chunk, the
+# number of the chunk and the parameters, returning the derived columns
+tasks = {"classify": _classify, "probabilities": _probabilities}
+
+
+def chunk_name(number):
+    return "chunk-{:06d}".format(number)
+
+
+def source_fingerprint(source):
+    """
+    Fingerprint of the input of a job: the absolute path and the size and
+    modification time of the file (or of the column files of a directory),
+    or for a mapping of arrays a hash of its first and last rows.
+    """
+    if isinstance(source, str):
+        files = [source]
+        if os.path.isdir(source):
+            files = [
+                os.path.join(source, name + ".npy") for name in mpa_jhu.input_columns
+            ]
+        stats = [os.stat(f) for f in files]
+        return {
+            "path": os.path.abspath(source),
+            "stat": [[st.st_size, st.st_mtime_ns] for st in stats],
+        }
+    n = count_rows(source)
+    digest = hashlib.sha1()
+    for start, stop in [
+        (0, min(fingerprint_rows, n)),
+        (max(n - fingerprint_rows, 0), n),
+    ]:
+        block = read_rows(source, start, stop)
+        for name in mpa_jhu.input_columns:
+            digest.update(np.ascontiguousarray(block[name]).tobytes())
+    return {"rows": n, "sha1": digest.hexdigest()}
+
+
+def read_manifest(path):
+    """
+    Manifest of the job in the directory 'path' (None if there is none).
+    """
+    try:
+        with open(os.path.join(path, job_manifest_name)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_manifest(path, manifest):
+    """
+    Replace the manifest of a job atomically.
+    """
+    tmp = os.path.join(path, job_manifest_name + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, os.path.join(path, job_manifest_name))
+
+
+def run_batch(
+    source, path, task="classify", chunk_size=default_chunk_size, **parameters
+):
+    """
+    Run a task on the chunks of a catalogue, resuming a previous run of the
+    same job.
+    Input:
+      source - input of the chunks (see outofcore.read_rows)
+      path - job directory with the manifest and the finished chunks
+      task - name of a task in 'tasks' or a function with the same signature
+      chunk_size - rows per chunk
+      parameters - keyword arguments of the task (JSON serialisable)
+    A job directory started with a different task, parameters, chunk size or
+    input (see source_fingerprint) raises ValueError.
+    Returns the merged columns as read-only memory maps (see merge_chunks).
+    """
+    if isinstance(task, str):
+        function = tasks[task]
+    else:
+        function, task = task, task.__module__ + "." + task.__name__
+    n = count_rows(source)
+    job = {
+        "task": task,
+        "parameters": parameters,
+        "rows": n,
+        "chunk_size": chunk_size,
+        "chunks": -(-n // chunk_size),
+        "source": source_fingerprint(source),
+    }
+    os.makedirs(path, exist_ok=True)
+    manifest = read_manifest(path)
+    if manifest is None:
+        manifest = dict(job, completed=[])
+        write_manifest(path, manifest)
+    elif manifest.get("source") != json.loads(json.dumps(job["source"])):
+        raise ValueError("The job in {} was started on another input".format(path))
+    elif {key: manifest[key] for key in job} != json.loads(json.dumps(job)):
+        raise ValueError("The job in {} has different parameters".format(path))
+    if manifest.get("merged"):
+        return load_classification(os.path.join(path, merged_name))
+    for number in range(job["chunks"]):
+        # The chunk directories are renamed into place once complete, so
+        # they are trusted even if the manifest was not updated
+        if os.path.exists(os.path.join(path, chunk_name(number), manifest_name)):
+            continue
+        start = number * chunk_size
+        chunk = read_rows(source, start, min(start + chunk_size, n))
+        save_classification(
+            function(chunk, number, **parameters),
+            os.path.join(path, chunk_name(number)),
+        )
+        manifest["completed"] = sorted(set(manifest["completed"]) | {number})
+        write_manifest(path, manifest)
+    return merge_chunks(path)
+
+
+def merge_chunks(path, keep_chunks=False):
+    """
+    Concatenate the columns of the chunks of a finished job into the
+    directory 'merged' of the job (one .npy file per column), removing the
+    chunks unless keep_chunks is True.
+    Returns the merged columns as read-only memory maps.
+    """
+    manifest = read_manifest(path)
+    chunks = [os.path.join(path, chunk_name(i)) for i in range(manifest["chunks"])]
+    missing = [c for c in chunks if load_classification(c) is None]
+    if missing:
+        raise ValueError("Unfinished chunks: " + ", ".join(missing))
+    output = os.path.join(path, merged_name)
+    tmp = output + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    first = load_classification(chunks[0]) if chunks else {}
+    for name, values in first.items():
+        column = np.lib.format.open_memmap(
+            os.path.join(tmp, name + ".npy"),
+            mode="w+",
+            dtype=values.dtype,
+            shape=(manifest["rows"],) + values.shape[1:],
+        )
+        start = 0
+        for chunk in chunks:
+            values = np.load(os.path.join(chunk, name + ".npy"), mmap_mode="r")
+            column[start : start + len(values)] = values
+            start += len(values)
+        column.flush()
+        del column
+    with open(os.path.join(tmp, manifest_name), "w") as f:
+        json.dump(list(first), f)
+    shutil.rmtree(output, ignore_errors=True)
+    os.rename(tmp, output)
+    manifest["merged"] = True
+    write_manifest(path, manifest)
+    if not keep_chunks:
+        for chunk in chunks:
+            shutil.rmtree(chunk)
+    return load_classification(output)
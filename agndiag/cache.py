@@ -0,0 +1,91 @@
+"""
+On-disk cache of the cleaned line data and line ratios.
+Each cache entry is a directory with one .npy file per column, named after
+a hash of the input line columns and of the cleaning parameters. The
+columns are reopened as read-only memory maps, so repeated classifications
+(e.g. changing use_limits) skip the cleaning and only read from disk the
+columns that the diagnostics use.
+"""
+__author__ = "jsm"
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+from . import mpa_jhu
+
+manifest_name = "columns.json"
+
+
+def cache_key(data, sigma=3.0, ew_method=1, dtype=None):
+    """
+    Hash of the input line columns and of the cleaning parameters.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    h.update(
+        repr(
+            (sigma, ew_method, np.dtype(dtype).str if dtype else None)
+            + tuple(mpa_jhu.cor_factor)
+        ).encode()
+    )
+    for name in mpa_jhu.input_columns:
+        column = np.ascontiguousarray(data[name])
+        h.update((name + column.dtype.str + str(len(column))).encode())
+        h.update(memoryview(column).cast("B"))
+    return h.hexdigest()
+
+
+def cleaned_columns(data, cache_dir, sigma=3.0, ew_method=1, dtype=None):
+    """
+    Cleaned flux and EW columns and line ratios (the output of clean_columns,
+    combine_sii_columns and ratio_columns) of the data.
+    They are read from the cache in cache_dir if available; otherwise they
+    are computed and stored in the cache.
+    Returns a dictionary of read-only np.memmap columns.
+    """
+    path = os.path.join(cache_dir, cache_key(data, sigma, ew_method, dtype))
+    if not os.path.exists(os.path.join(path, manifest_name)):
+        _write_entry(data, path, sigma, ew_method, dtype)
+    with open(os.path.join(path, manifest_name)) as f:
+        names = json.load(f)
+    return {
+        name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+        for name in names
+    }
+
+
+def _write_entry(data, path, sigma, ew_method, dtype):
+    """
+    Compute the cleaned columns and write them in a temporary directory
+    that is renamed to 'path' once complete.
+    """
+    out = mpa_jhu.clean_columns(data, sigma=sigma, ew_method=ew_method, dtype=dtype)
+    mpa_jhu.combine_sii_columns(out, out=out)
+    mpa_jhu.ratio_columns(out, out=out)
+    tmp = "{}.tmp-{}".format(path, os.getpid())
+    os.makedirs(tmp, exist_ok=True)
+    for name, values in out.items():
+        np.save(os.path.join(tmp, name + ".npy"), values)
+    with open(os.path.join(tmp, manifest_name), "w") as f:
+        json.dump(list(out), f)
+    try:
+        os.rename(tmp, path)
+    except OSError:  # Written meanwhile by another process
+        shutil.rmtree(tmp)
+
+
+def classify_cached(
+    data, cache_dir, sigma=3.0, ew_method=1, use_limits=True, dtype=None
+):
+    """
+    Version of mpa_jhu.classify_columns that takes the cleaned columns and
+    the ratios from the cache. Only the diagnostics are computed.
+    Returns the dictionary with the derived columns; the cached ones are
+    read-only memory maps.
+    """
+    out = cleaned_columns(
+        data, cache_dir, sigma=sigma, ew_method=ew_method, dtype=dtype
+    )
+    mpa_jhu.diag_Sabater2012_columns(out, use_limits=use_limits, out=out)
+    mpa_jhu.diag_CidFernandes2011_columns(out, out=out)
+    return out
@@ -0,0 +1,310 @@
+"""
+Command line interface to classify MPA-JHU catalogues.
+The input table (a gal_line FITS file or a CSV file with the line columns)
+is classified in chunks, optionally by a pool of processes, and the
+derived columns are written to a CSV file. At the end, the number of rows
+per second and the peak resident memory of each stage (measured in the
+process that ran it, on Linux) are reported. With
+--npy the derived columns are written out of core as .npy files (see
+outofcore.classify_out_of_core).
+"""
+__author__ = "jsm"
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from . import mpa_jhu, outofcore
+
+stages = ["read", "clean", "ratios", "Sabater2012", "CidFernandes2011", "write"]
+
+
+# Stages run in the worker processes with -w > 1
+worker_stages = ["clean", "ratios", "Sabater2012", "CidFernandes2011"]
+
+
+def reset_peak_rss():
+    """
+    Reset the peak resident memory of the process to the current one (Linux).
+    Returns False if it can not be reset.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    """
+    Peak resident memory of the process in bytes since the last
+    reset_peak_rss (None if unknown).
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def measure(step):
+    """
+    Run a step of the pipeline.
+    Returns its result, its time and the peak resident memory of the
+    process during the step (None if the peak can not be reset).
+    """
+    reset = reset_peak_rss()
+    t0 = time.perf_counter()
+    result = step()
+    return result, time.perf_counter() - t0, peak_rss() if reset else None
+
+
+def iter_input(path, chunk_size):
+    """
+    Read the line columns of the input table in chunks.
+    FITS files are read with mpa_jhu.iter_gal_line; other files are read as
+    CSV with pandas, with the exact float parser so the values match the
+    FITS input.
+    """
+    if path.lower().endswith((".fit", ".fits", ".fts")):
+        yield from mpa_jhu.iter_gal_line(path, chunk_size)
+    else:
+        import pandas as pd
+
+        for chunk in pd.read_csv(
+            path,
+            usecols=mpa_jhu.input_columns,
+            chunksize=chunk_size,
+            float_precision="round_trip",
+        ):
+            yield {c: chunk[c].to_numpy() for c in mpa_jhu.input_columns}
+
+
+def classify_chunk(chunk, sigma=3.0, ew_method=1, use_limits=True):
+    """
+    Run the stages of the pipeline on a chunk of line columns.
+    Returns the dictionary with the derived columns and a dictionary with
+    the time and the peak memory of each stage (see measure).
+    """
+    out = {}
+    stats = {}
+    steps = [
+        ("clean", lambda: mpa_jhu.clean_columns(chunk, sigma, ew_method, out=out)),
+        (
+            "ratios",
+            lambda: mpa_jhu.ratio_columns(
+                mpa_jhu.combine_sii_columns(out, out=out), out=out
+            ),
+        ),
+        (
+            "Sabater2012",
+            lambda: mpa_jhu.diag_Sabater2012_columns(out, use_limits, out=out),
+        ),
+        (
+            "CidFernandes2011",
+            lambda: mpa_jhu.diag_CidFernandes2011_columns(out, out=out),
+        ),
+    ]
+    for stage, step in steps:
+        stats[stage] = measure(step)[1:]
+    return out, stats
+
+
+def write_csv(f, out, columns, header):
+    """
+    Append the selected columns of a classified chunk to a CSV file.
+    """
+    formats = []
+    for name in columns:
+        dtype = out[name].dtype
+        formats.append(
+            "%d" if dtype.kind in "iub" else "%.17g" if dtype.itemsize > 4 else "%.9g"
+        )
+    table = np.empty(len(out[columns[0]]), dtype=[(c, out[c].dtype) for c in columns])
+    for name in columns:
+        table[name] = out[name]
+    np.savetxt(
+        f,
+        table,
+        fmt=formats,
+        delimiter=",",
+        header=",".join(columns) if header else "",
+        comments="",
+    )
+
+
+def run(
+    input_path,
+    output_path,
+    chunk_size=100000,
+    n_workers=1,
+    columns=None,
+    sigma=3.0,
+    ew_method=1,
+    use_limits=True,
+):
+    """
+    Classify the input table and write the derived columns to a CSV file.
+    Input:
+      input_path - gal_line FITS file or CSV file with the line columns
+      output_path - output CSV file
+      chunk_size - rows per chunk
+      n_workers - number of processes classifying the chunks
+      columns - output columns (default: all the derived columns); the input
+                line columns can also be selected
+      sigma, ew_method, use_limits - passed to the pipeline
+    Returns a dictionary with the number of rows, the number of worker
+    processes and the accumulated time and the peak memory of each stage
+    (the largest of its chunks, measured in the process that ran it).
+    """
+    kwargs = dict(sigma=sigma, ew_method=ew_method, use_limits=use_limits)
+    report = {
+        "rows": 0,
+        "workers": n_workers,
+        "stages": {stage: [0.0, None] for stage in stages},
+    }
+
+    def account(stage, seconds, rss):
+        total = report["stages"][stage]
+        total[0] += seconds
+        if rss is not None:
+            total[1] = max(total[1] or 0, rss)
+
+    def chunks():
+        iterator = iter_input(input_path, chunk_size)
+        while True:
+            chunk, seconds, rss = measure(lambda: next(iterator, None))
+            account("read", seconds, rss)
+            if chunk is None:
+                return
+            yield chunk
+
+    def results():
+        if n_workers == 1:
+            for chunk in chunks():
+                yield chunk, classify_chunk(chunk, **kwargs)
+            return
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            pending = []
+            for chunk in chunks():
+                pending.append((chunk, pool.submit(classify_chunk, chunk, **kwargs)))
+                if len(pending) > 2 * n_workers:  # Bound the chunks in memory
+                    chunk, future = pending.pop(0)
+                    yield chunk, future.result()
+            for chunk, future in pending:
+                yield chunk, future.result()
+
+    with open(output_path, "w") as f:
+        for chunk, (out, stats) in results():
+            for stage, (seconds, rss) in stats.items():
+                account(stage, seconds, rss)
+            if columns is None:
+                columns = list(out)
+            for name in columns:
+                if name not in out:
+                    if name not in mpa_jhu.input_columns:
+                        raise KeyError("Unknown output column {}".format(name))
+                    out[name] = np.asarray(chunk[name])
+            seconds, rss = measure(
+                lambda: write_csv(f, out, columns, header=report["rows"] == 0)
+            )[1:]
+            account("write", seconds, rss)
+            report["rows"] += len(out[columns[0]])
+    return report
+
+
+def format_report(report):
+    """
+    Format the throughput report as a table. The process column tells if
+    the peak memory of a stage is that of the main process or of a worker.
+    """
+    lines = [
+        "{:<18}{:>10}{:>14}{:>16}{:>10}".format(
+            "stage", "time (s)", "rows/s", "peak RSS (MB)", "process"
+        )
+    ]
+    workers = report.get("workers", 1) > 1
+    for stage, (seconds, rss) in report["stages"].items():
+        lines.append(
+            "{:<18}{:>10.3f}{:>14.0f}{:>16}{:>10}".format(
+                stage,
+                seconds,
+                report["rows"] / seconds if seconds > 0 else float("inf"),
+                "-" if rss is None else "{:.1f}".format(rss / 1048576),
+                "worker" if workers and stage in worker_stages else "main",
+            )
+        )
+    total = sum(seconds for seconds, _ in report["stages"].values())
+    lines.append(
+        "{:<18}{:>10.3f}{:>14.0f}".format(
+            "total", total, report["rows"] / total if total > 0 else float("inf")
+        )
+    )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    """
+    Entry point of the agndiag command.
+    """
+    parser = argparse.ArgumentParser(
+        prog="agndiag", description="Classify an MPA-JHU catalogue of emission lines."
+    )
+    parser.add_argument(
+        "input", help="gal_line FITS file or CSV file with the line columns"
+    )
+    parser.add_argument("output", help="output CSV file")
+    parser.add_argument(
+        "-c", "--chunk-size", type=int, default=100000, help="rows per chunk"
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=1, help="number of worker processes"
+    )
+    parser.add_argument(
+        "--columns",
+        help="comma separated output columns (default: all derived columns)",
+    )
+    parser.add_argument("--sigma", type=float, default=3.0, help="detection limit")
+    parser.add_argument(
+        "--no-limits", action="store_true", help="do not use the censored data"
+    )
+    parser.add_argument(
+        "--npy",
+        action="store_true",
+        help="write all the derived columns as .npy files in the output directory "
+        "without loading the catalogue in memory (FITS or .npy directory input)",
+    )
+    args = parser.parse_args(argv)
+    if args.npy:
+        columns = outofcore.classify_out_of_core(
+            args.input,
+            args.output,
+            block_size=args.chunk_size,
+            sigma=args.sigma,
+            use_limits=not args.no_limits,
+        )
+        print(
+            "{} rows classified".format(len(columns["class_Sabater2012"])),
+            file=sys.stderr,
+        )
+        return
+    report = run(
+        args.input,
+        args.output,
+        chunk_size=args.chunk_size,
+        n_workers=args.workers if args.workers > 0 else (os.cpu_count() or 1),
+        columns=args.columns.split(",") if args.columns else None,
+        sigma=args.sigma,
+        use_limits=not args.no_limits,
+    )
+    print("{} rows classified".format(report["rows"]), file=sys.stderr)
+    print(format_report(report), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+Minimal reader of FITS binary tables.
+Only the header keywords needed to locate the columns are parsed; the table
+is memory-mapped and just the requested columns of the requested rows are
+copied into memory. It is enough to read the MPA-JHU gal_line files
+without external dependencies.
+"""
+__author__ = "jsm"
+import re
+import numpy as np
+
+block_size = 2880
+card_size = 80
+# Bytes and numpy type of each TFORM data type
+tform_types = {
+    "L": (1, "S1"),
+    "B": (1, "u1"),
+    "I": (2, ">i2"),
+    "J": (4, ">i4"),
+    "K": (8, ">i8"),
+    "A": (1, "S"),
+    "E": (4, ">f4"),
+    "D": (8, ">f8"),
+    "C": (8, ">c8"),
+    "M": (16, ">c16"),
+    "P": (8, None),
+    "Q": (16, None),
+}
+_tform = re.compile(r"^\s*(\d*)([A-Z])")
+
+
+def parse_card(card):
+    """
+    Get the keyword and the value of a header card.
+    The value is None for cards without value (e.g. COMMENT).
+    """
+    key = card[:8].strip()
+    if card[8:10] != "= ":
+        return key, None
+    value = card[10:].strip()
+    if value.startswith("'"):
+        match = re.match(r"'((?:[^']|'')*)'", value)
+        return key, match.group(1).replace("''", "'").rstrip()
+    value = value.split("/", 1)[0].strip()
+    if value in ["T", "F"]:
+        return key, value == "T"
+    try:
+        return key, int(value)
+    except ValueError:
+        pass
+    try:
+        return key, float(value.replace("D", "E"))
+    except ValueError:
+        return key, value
+
+
+def read_header(f):
+    """
+    Read the header that starts at the current position of the file.
+    Returns a dictionary with the keywords; the file is left at the start
+    of the data.
+    """
+    header = {}
+    while True:
+        block = f.read(block_size)
+        if len(block) < block_size:
+            raise ValueError("Truncated FITS header")
+        for i in range(0, block_size, card_size):
+            key, value = parse_card(block[i : i + card_size].decode("ascii"))
+            if key == "END":
+                return header
+            if value is not None:
+                header[key] = value
+
+
+def data_size(header):
+    """
+    Size in bytes of the data of an HDU, including the padding.
+    """
+    if header.get("NAXIS", 0) == 0:
+        return 0
+    size = 1
+    for i in range(1, header["NAXIS"] + 1):
+        size *= header["NAXIS" + str(i)]
+    size = (
+        abs(header["BITPIX"])
+        // 8
+        * header.get("GCOUNT", 1)
+        * (header.get("PCOUNT", 0) + size)
+    )
+    return -(-size // block_size) * block_size
+
+
+def table_layout(path, hdu=1):
+    """
+    Locate a binary table in a FITS file.
+    Returns the offset of the data, the number of rows, the size of a row
+    and the list of the columns as (name, numpy type, offset in the row,
+    scale, zero, null value or None).
+    """
+    with open(path, "rb") as f:
+        for _ in range(hdu):
+            f.seek(data_size(read_header(f)), 1)
+        header = read_header(f)
+        offset = f.tell()
+    if header.get("XTENSION") != "BINTABLE":
+        raise ValueError("HDU {} of {} is not a binary table".format(hdu, path))
+    columns = []
+    start = 0
+    for i in range(1, header["TFIELDS"] + 1):
+        repeat, code = _tform.match(header["TFORM" + str(i)]).groups()
+        repeat = int(repeat) if repeat else 1
+        if code == "X":
+            width, dtype = -(-repeat // 8), None
+        else:
+            size, dtype = tform_types[code]
+            width = size * repeat
+            if code == "A":
+                dtype = "S" + str(repeat)
+            elif repeat != 1 and dtype is not None:
+                dtype = (dtype, (repeat,))
+        columns.append(
+            (
+                header.get("TTYPE" + str(i), "col" + str(i)),
+                dtype,
+                start,
+                header.get("TSCAL" + str(i), 1),
+                header.get("TZERO" + str(i), 0),
+                header.get("TNULL" + str(i)) if code in "BIJK" else None,
+            )
+        )
+        start += width
+    return offset, header["NAXIS2"], header["NAXIS1"], columns
+
+
+def read_table(path, columns=None, start=0, stop=None, hdu=1):
+    """
+    Read columns of a FITS binary table.
+    Input:
+      path - FITS file
+      columns - names of the columns to read (default: all); the names are
+                not case sensitive
+      start, stop - range of rows to read
+      hdu - number of the HDU with the table
+    Returns a numpy structured array in native byte order. Scaled columns
+    (TSCAL, TZERO) and integer columns with a null value (TNULL) are
+    returned as float64, with NaN for the null values.
+    """
+    offset, n_rows, row_size, layout = table_layout(path, hdu=hdu)
+    fields = {name.upper(): field for name, *field in layout}
+    if columns is None:
+        columns = [name for name, dtype, *_ in layout if dtype is not None]
+    selected = []
+    for name in columns:
+        if name.upper() not in fields:
+            raise KeyError("Column {} not found in {}".format(name, path))
+        dtype, column_offset, scale, zero, null = fields[name.upper()]
+        if dtype is None:
+            raise ValueError("Column {} has an unsupported format".format(name))
+        selected.append((name, np.dtype(dtype), column_offset, scale, zero, null))
+    start, stop, _ = slice(start, stop).indices(n_rows)
+    native = [
+        (
+            name,
+            (
+                dtype.newbyteorder("=")
+                if scale == 1 and zero == 0 and null is None
+                else np.dtype((np.float64, dtype.shape))
+            ),
+        )
+        for name, dtype, _, scale, zero, null in selected
+    ]
+    out = np.empty(max(stop - start, 0), dtype=native)
+    if len(out) == 0:
+        return out
+    rows = np.memmap(
+        path,
+        dtype=np.dtype(
+            {
+                "names": [s[0] for s in selected],
+                "formats": [s[1] for s in selected],
+                "offsets": [s[2] for s in selected],
+                "itemsize": row_size,
+            }
+        ),
+        mode="r",
+        offset=offset + start * row_size,
+        shape=(stop - start,),
+    )
+    for name, _, _, scale, zero, null in selected:
+        if scale == 1 and zero == 0:
+            out[name] = rows[name]
+        else:
+            out[name] = rows[name] * scale + zero
+        if null is not None:
+            out[name][rows[name] == null] = np.nan
+    del rows
+    return out
+
+
+def write_table(path, data, nulls=None):
+    """
+    Write a dictionary of numpy columns (numbers or byte strings) as a FITS
+    file with an empty primary HDU and a binary table.
+    'nulls' is an optional dictionary with the null value (TNULL) of integer
+    columns.
+    """
+    nulls = {} if nulls is None else nulls
+    codes = {"u1": "B", "i2": "I", "i4": "J", "i8": "K"}
+    codes.update({"f4": "E", "f8": "D", "c8": "C", "c16": "M"})
+    names = list(data)
+    columns = [np.asarray(data[name]) for name in names]
+    formats = []
+    for column in columns:
+        if column.dtype.kind == "S":
+            formats.append(str(column.dtype.itemsize) + "A")
+        else:
+            formats.append(codes[column.dtype.str[1:]])
+    table = np.empty(
+        len(columns[0]) if columns else 0,
+        dtype=[
+            (name, column.dtype.newbyteorder(">"))
+            for name, column in zip(names, columns)
+        ],
+    )
+    for name, column in zip(names, columns):
+        table[name] = column
+    cards = [
+        ("XTENSION", "BINTABLE"),
+        ("BITPIX", 8),
+        ("NAXIS", 2),
+        ("NAXIS1", table.dtype.itemsize),
+        ("NAXIS2", len(table)),
+        ("PCOUNT", 0),
+        ("GCOUNT", 1),
+        ("TFIELDS", len(names)),
+    ]
+    for i, (name, tform) in enumerate(zip(names, formats), 1):
+        cards += [("TTYPE" + str(i), name), ("TFORM" + str(i), tform)]
+        if name in nulls:
+            cards.append(("TNULL" + str(i), int(nulls[name])))
+    with open(path, "wb") as f:
+        f.write(
+            _header([("SIMPLE", True), ("BITPIX", 8), ("NAXIS", 0), ("EXTEND", True)])
+        )
+        f.write(_header(cards))
+        f.write(table.tobytes())
+        f.write(b"\0" * (-table.nbytes % block_size))
+
+
+def _header(cards):
+    """
+    Format a list of (keyword, value) as a padded header in the fixed format.
+    """
+    text = ""
+    for key, value in cards:
+        if isinstance(value, str):
+            value = "'{:8}'".format(value.replace("'", "''")).ljust(20)
+        elif isinstance(value, bool):
+            value = "{:>20}".format("T" if value else "F")
+        else:
+            value = "{:>20}".format(value)
+        text += "{:8}= {}".format(key, value).ljust(card_size)
+    text += "END".ljust(card_size)
+    return (text + " " * (-len(text) % block_size)).encode("ascii")
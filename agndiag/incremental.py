@@ -0,0 +1,155 @@
+"""
+Incremental classification of a growing MPA-JHU catalogue.
+The stored classification keeps, for every galaxy identifier, a fingerprint
+of its input line columns and of the pipeline parameters. In each run only
+the new galaxies and those whose fingerprint changed are classified, and
+the results are merged into the stored columns.
+"""
+__author__ = "jsm"
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+from . import mpa_jhu
+from .cache import manifest_name
+
+fingerprint_column = "fingerprint"
+
+
+def _mix(h):
+    """
+    64-bit finaliser of splitmix64.
+    """
+    h ^= h >> np.uint64(30)
+    h *= np.uint64(0xBF58476D1CE4E5B9)
+    h ^= h >> np.uint64(27)
+    h *= np.uint64(0x94D049BB133111EB)
+    h ^= h >> np.uint64(31)
+    return h
+
+
+def row_fingerprints(data, sigma=3.0, ew_method=1, use_limits=True):
+    """
+    64-bit fingerprint of the input line columns of each row, seeded with
+    the parameters of the pipeline and the correction factors.
+    """
+    seed = hashlib.blake2b(
+        repr((sigma, ew_method, use_limits) + tuple(mpa_jhu.cor_factor)).encode(),
+        digest_size=8,
+    ).digest()
+    h = np.full(
+        len(np.asarray(data[mpa_jhu.input_columns[0]])),
+        np.frombuffer(seed, dtype=np.uint64)[0],
+    )
+    for name in mpa_jhu.input_columns:
+        h = _mix(h ^ np.asarray(data[name], dtype=np.float64).view(np.uint64))
+    return h
+
+
+def classify_incremental(
+    data, stored=None, id_column="SPECOBJID", sigma=3.0, ew_method=1, use_limits=True
+):
+    """
+    Update a stored classification with new or modified galaxies.
+    Input:
+      data - line columns and identifiers of the galaxies to add or update
+             (a batch or the whole catalogue)
+      stored - dictionary with the identifiers, the fingerprints and the
+               derived columns of a previous run (None in the first run)
+      id_column - column with the galaxy identifiers
+      sigma, ew_method, use_limits - passed to the pipeline; changing them
+                                     changes all the fingerprints
+    Returns the updated dictionary of columns and a boolean mask of the rows
+    of the data that were classified. The stored galaxies keep their
+    position; the new ones are appended in the order of the data.
+    """
+    ids = np.asarray(data[id_column])
+    if len(np.unique(ids)) != len(ids):
+        raise ValueError("Duplicated identifiers in " + id_column)
+    fingerprint = row_fingerprints(data, sigma, ew_method, use_limits)
+    if stored is None:
+        stored = {id_column: ids[:0], fingerprint_column: fingerprint[:0]}
+    stored_ids = np.asarray(stored[id_column])
+    order = np.argsort(stored_ids, kind="stable")
+    index = np.zeros(len(ids), dtype=np.intp)
+    found = np.zeros(len(ids), dtype=bool)
+    if len(order) > 0:
+        index = order[
+            np.minimum(np.searchsorted(stored_ids[order], ids), len(order) - 1)
+        ]
+        found = stored_ids[index] == ids
+    changed = ~found
+    changed[found] = (
+        np.asarray(stored[fingerprint_column])[index[found]] != fingerprint[found]
+    )
+    rows = np.flatnonzero(changed)
+    derived = mpa_jhu.classify_columns(
+        {c: np.asarray(data[c])[rows] for c in mpa_jhu.input_columns},
+        sigma=sigma,
+        ew_method=ew_method,
+        use_limits=use_limits,
+    )
+    derived[id_column] = ids[rows]
+    derived[fingerprint_column] = fingerprint[rows]
+    update = found[rows]
+    n_new = len(rows) - np.count_nonzero(update)
+    result = {}
+    for name in [id_column, fingerprint_column] + [
+        c for c in derived if c not in (id_column, fingerprint_column)
+    ]:
+        values = derived[name]
+        old = stored.get(name)
+        if old is None:
+            old = np.zeros(len(stored_ids), dtype=values.dtype)
+        column = np.empty(len(stored_ids) + n_new, dtype=np.asarray(old).dtype)
+        column[: len(stored_ids)] = old
+        column[index[rows[update]]] = values[update]
+        column[len(stored_ids) :] = values[~update]
+        result[name] = column
+    return result, changed
+
+
+def save_classification(columns, path):
+    """
+    Save the columns of a classification as one .npy file per column in the
+    directory 'path', replacing the previous version once complete.
+    The previous version is moved to path + ".old" before the new one is
+    renamed into place; if the process stops in between, load_classification
+    restores it.
+    """
+    tmp = path.rstrip(os.sep) + ".tmp"
+    old = path.rstrip(os.sep) + ".old"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name, values in columns.items():
+        np.save(os.path.join(tmp, name + ".npy"), values)
+    with open(os.path.join(tmp, manifest_name), "w") as f:
+        json.dump(list(columns), f)
+    if os.path.exists(path):
+        # Left by a save interrupted while it was being removed
+        shutil.rmtree(old, ignore_errors=True)
+        os.rename(path, old)
+        os.rename(tmp, path)
+        shutil.rmtree(old)
+    else:
+        os.rename(tmp, path)
+
+
+def load_classification(path):
+    """
+    Load the columns of a classification saved with save_classification as
+    read-only memory maps (None if there is none).
+    The previous version left by an interrupted save is restored.
+    """
+    old = path.rstrip(os.sep) + ".old"
+    if not os.path.exists(path) and os.path.exists(os.path.join(old, manifest_name)):
+        os.rename(old, path)
+    if not os.path.exists(os.path.join(path, manifest_name)):
+        return None
+    with open(os.path.join(path, manifest_name)) as f:
+        names = json.load(f)
+    return {
+        name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+        for name in names
+    }
@@ -0,0 +1,168 @@
+"""
+Opt-in instrumentation of the pipeline stages and the diagnostic functions.
+The instrumented functions report their wall time, CPU time, number of
+rows and (optionally) peak allocated memory to the registered hooks. With
+no hooks registered the only overhead is the check of an empty list.
+
+Usage:
+    with Recorder(memory=True) as recorder:
+        mpa_jhu.classify(df)
+    recorder.to_json("stages.json")
+"""
+__author__ = "jsm"
+import functools
+import json
+import time
+import tracemalloc
+
+_hooks = []
+_memory = []  # Hooks that requested the tracing of the memory
+_stack = []  # Records of the functions being run
+_started_tracing = False
+
+
+def add_hook(hook, memory=False):
+    """
+    Register a callable that receives a dictionary for every call of an
+    instrumented function. If memory is True, the allocated memory is traced
+    with tracemalloc while the hook is registered.
+    """
+    global _started_tracing
+    _hooks.append(hook)
+    if memory:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _started_tracing = True
+        _memory.append(hook)
+
+
+def remove_hook(hook):
+    """
+    Unregister a hook, stopping the tracing of the memory if it was started
+    for the hooks.
+    """
+    global _started_tracing
+    _hooks.remove(hook)
+    if hook in _memory:
+        _memory.remove(hook)
+        if not _memory and _started_tracing:
+            tracemalloc.stop()
+            _started_tracing = False
+
+
+def n_rows(data):
+    """
+    Number of rows of an argument (array, dataframe or dictionary of columns).
+    """
+    if isinstance(data, dict):
+        data = next(iter(data.values()), ())
+    try:
+        return len(data)
+    except TypeError:
+        return None
+
+
+def instrumented(function):
+    """
+    Decorator reporting the calls of a function to the hooks.
+    The rows are taken from the first argument.
+    """
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not _hooks:
+            return function(*args, **kwargs)
+        return _record(function, args, kwargs)
+
+    return wrapper
+
+
+def _record(function, args, kwargs):
+    """
+    Run a function measuring it and send the record to the hooks.
+    The peak memory is relative to the memory allocated at the start.
+    """
+    memory = bool(_memory) and tracemalloc.is_tracing()
+    record = {
+        "name": function.__name__,
+        "rows": n_rows(args[0]) if args else None,
+        "depth": len(_stack),
+    }
+    if memory:
+        current, peak = tracemalloc.get_traced_memory()
+        if _stack and "_peak" in _stack[-1]:  # Keep the peak of the caller
+            _stack[-1]["_peak"] = max(_stack[-1]["_peak"], peak)
+        if hasattr(tracemalloc, "reset_peak"):  # Python >= 3.9
+            tracemalloc.reset_peak()
+        record["_start"] = record["_peak"] = current
+    _stack.append(record)
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        record["wall"] = time.perf_counter() - wall
+        record["cpu"] = time.process_time() - cpu
+        _stack.pop()
+        if memory and tracemalloc.is_tracing():
+            peak = max(record.pop("_peak"), tracemalloc.get_traced_memory()[1])
+            record["peak_bytes"] = peak - record.pop("_start")
+            if _stack and "_peak" in _stack[-1]:
+                _stack[-1]["_peak"] = max(_stack[-1]["_peak"], peak)
+        else:
+            record.pop("_peak", None)
+            record.pop("_start", None)
+            record["peak_bytes"] = None
+        for hook in list(_hooks):
+            hook(record)
+
+
+class Recorder:
+    """
+    Hook collecting the records. Can be used as a context manager.
+    """
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.records = []
+
+    def __call__(self, record):
+        self.records.append(record)
+
+    def __enter__(self):
+        add_hook(self, memory=self.memory)
+        return self
+
+    def __exit__(self, *exc):
+        remove_hook(self)
+
+    def summary(self):
+        """
+        Totals per function: calls, rows, wall and CPU time and the maximum
+        of the peak memory.
+        """
+        totals = {}
+        for record in self.records:
+            total = totals.setdefault(
+                record["name"],
+                {"calls": 0, "rows": 0, "wall": 0.0, "cpu": 0.0, "peak_bytes": None},
+            )
+            total["calls"] += 1
+            total["rows"] += record["rows"] or 0
+            total["wall"] += record["wall"]
+            total["cpu"] += record["cpu"]
+            if record["peak_bytes"] is not None:
+                total["peak_bytes"] = max(
+                    total["peak_bytes"] or 0, record["peak_bytes"]
+                )
+        return totals
+
+    def to_json(self, path=None):
+        """
+        Export the records and the summary as JSON. Returns the JSON text
+        if no path is given.
+        """
+        text = json.dumps({"records": self.records, "summary": self.summary()})
+        if path is None:
+            return text
+        with open(path, "w") as f:
+            f.write(text)
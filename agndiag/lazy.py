@@ -0,0 +1,161 @@
+"""
+Lazy frame of the columns derived by the pipeline.
+The derived columns are computed the first time that they are accessed
+and memoised. Which function produces each column and which columns it
+reads are declared once in 'graph'; the functions are the columnar
+functions of mpa_jhu, which read their inputs from the frame itself, so
+accessing a column computes only the columns it depends on. E.g. the final
+class of Sabater et al. 2012 cleans only the fluxes of the lines of the
+three diagrams and no equivalent width.
+
+Usage:
+    frame = LazyFrame(data)
+    classes = frame["class_Sabater2012"]
+"""
+__author__ = "jsm"
+from collections.abc import Mapping
+from . import mpa_jhu
+from .plan import make_config
+
+_flux = ["flux_", "e_flux_", "c_flux_"]
+_ew = ["ew_", "e_ew_", "c_ew_"]
+
+
+def _clean(line, equivalent_widths):
+    def function(frame):
+        config = frame.config
+        return mpa_jhu.clean_columns(
+            frame.data,
+            sigma=config.sigma,
+            ew_method=config.ew_method,
+            dtype=config.dtype,
+            lines=[line],
+            factors=[dict(config.factors)[line]],
+            equivalent_widths=equivalent_widths,
+        )
+
+    return function
+
+
+def _ratio(ratio):
+    return lambda frame: mpa_jhu.ratio_columns(frame, ratios=[ratio])
+
+
+def _diagram(name):
+    return lambda frame: mpa_jhu.diag_Sabater2012_columns(
+        frame, use_limits=frame.config.use_limits, diagrams=[name]
+    )
+
+
+def _final_class(frame):
+    final, final_to = mpa_jhu.diag_class_Sabater2012(
+        *[frame[name + "_Sabater2012"] for name in ["nii", "sii", "oi"]]
+    )
+    return {"class_Sabater2012": final, "class_to_Sabater2012": final_to}
+
+
+# Dependency graph: [columns produced, columns read, function of the frame]
+graph = []
+for _line in mpa_jhu.name_lines:
+    _inputs = [_line + p for p in mpa_jhu.name_params]
+    graph.append([[p + _line for p in _flux], _inputs, _clean(_line, False)])
+    # The cleaning of the EW gives the flux too; only the EW columns are kept
+    graph.append([[p + _line for p in _ew], _inputs, _clean(_line, True)])
+# combine_sii_columns reads only the SII_6717 line
+graph.append(
+    [
+        [p + "SII" for p in _flux],
+        [p + "SII_6717" for p in _flux],
+        mpa_jhu.combine_sii_columns,
+    ]
+)
+for _ratio_name, (_num, _den) in mpa_jhu.dict_ratios.items():
+    graph.append(
+        [
+            [p + _ratio_name for p in ["", "e_", "c_"]],
+            [p + line for line in [_num, _den] for p in _flux],
+            _ratio(_ratio_name),
+        ]
+    )
+for _name, (_x, _y) in mpa_jhu.dict_diagnostic.items():
+    graph.append(
+        [
+            [p + _name + "_Sabater2012" for p in ["", "c_"]],
+            [_x, _y, "c_" + _x, "c_" + _y],
+            _diagram(_name),
+        ]
+    )
+graph.append(
+    [
+        ["class_Sabater2012", "class_to_Sabater2012"],
+        [name + "_Sabater2012" for name in ["nii", "sii", "oi"]],
+        _final_class,
+    ]
+)
+graph.append(
+    [
+        ["whan_CidFernandes2011", "c_whan_CidFernandes2011"],
+        ["nii_h_alpha", "c_nii_h_alpha", "ew_H_ALPHA", "c_ew_H_ALPHA"]
+        + ["ew_NII_6584", "c_ew_NII_6584"],
+        mpa_jhu.diag_CidFernandes2011_columns,
+    ]
+)
+_producers = {name: node for node in graph for name in node[0]}
+
+
+def dependencies(name):
+    """
+    Derived columns needed to compute a column, in the order in which they
+    can be computed (including the column itself).
+    """
+    result = []
+    for input_name in _producers[name][1] if name in _producers else []:
+        result += [n for n in dependencies(input_name) if n not in result]
+    return result + [name] if name in _producers else result
+
+
+class LazyFrame(Mapping):
+    """
+    Read-only mapping with the input columns of the data and the derived
+    columns of the pipeline, computed on first access with the parameters of
+    a configuration (see plan.make_config). Iterating gives the names of the
+    derived columns, computed or not.
+    """
+
+    def __init__(self, data, config=None):
+        self.data = data
+        self.config = make_config() if config is None else config
+        self.computed = {}
+
+    def __getitem__(self, name):
+        if name in self.computed:
+            return self.computed[name]
+        if name not in _producers:
+            return self.data[name]
+        outputs, inputs, function = _producers[name]
+        columns = function(self)
+        for output in outputs:
+            self.computed[output] = columns[output]
+        return self.computed[name]
+
+    def __contains__(self, name):
+        if name in _producers:
+            return True
+        try:
+            self.data[name]
+        except (KeyError, ValueError, IndexError):
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(_producers)
+
+    def __len__(self):
+        return len(_producers)
+
+    def release(self, *names):
+        """
+        Forget computed columns (all by default) to free their memory.
+        """
+        for name in names or list(self.computed):
+            self.computed.pop(name, None)
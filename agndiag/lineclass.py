@@ -1,4 +1,9 @@
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+from .backend import array_kernel
+from .instrument import instrumented
 
 
 ##########################################
@@ -10,7 +15,105 @@ import numpy as np
 # ----------------------#
 
 
-def diag_nii_Sabater2012(x, y, c_x, c_y, use_limits=False):
+# Rules of the [NII] diagram: [function of (x, y, c_x, c_y), code]
+rules_nii_Sabater2012 = [
+    [
+        lambda x, y, c_x, c_y: (
+            (x >= 0.0) | (y >= 0.8) | ((y - 1.19) * (x - 0.47) <= 0.61)
+        ),
+        5,
+    ],  # AGN
+    [
+        lambda x, y, c_x, c_y: (
+            (x < 0.0) & (y < 0.8) & ((y - 1.3) * (x - 0.05) > 0.61)
+        ),
+        1,
+    ],  # SFN
+    [
+        lambda x, y, c_x, c_y: (
+            (x < 0.0)
+            & (y < 0.8)
+            & ((y - 1.3) * (x - 0.05) <= 0.61)
+            & ((y - 1.19) * (x - 0.47) > 0.61)
+        ),
+        4,
+    ],  # TO
+]
+# Terms of the demarcation curves of the [NII] diagram used by the rules:
+# [function of (x, y), threshold, side of the threshold that is closed]
+terms_nii_Sabater2012 = [
+    [lambda x, y: x, 0.0, "high"],
+    [lambda x, y: y, 0.8, "high"],
+    [lambda x, y: (y - 1.3) * (x - 0.05), 0.61, "low"],
+    [lambda x, y: (y - 1.19) * (x - 0.47), 0.61, "low"],
+]
+# Additional rules of the [NII] diagram for the limits
+rules_nii_Sabater2012_limits = [
+    [lambda x, y, c_x, c_y: (x >= 0.0) & ((c_x == 0) | (c_x == 2)), 5],  # AGN right
+    [lambda x, y, c_x, c_y: (y >= 0.8) & ((c_y == 0) | (c_y == 2)), 5],  # AGN up
+    [
+        lambda x, y, c_x, c_y: (
+            ((y - 1.19) * (x - 0.47) <= 0.61)
+            & (
+                ((c_x == 0) & (c_y == 2))
+                | ((c_x == 2) & (c_y == 2))
+                | ((c_x == 2) & (c_y == 0))
+            )
+        ),
+        5,
+    ],  # AGN
+    [
+        lambda x, y, c_x, c_y: (
+            (
+                (x < 0.0)
+                & (y < 0.8)
+                & ((y - 1.3) * (x - 0.05) <= 0.61)
+                & ((y - 1.19) * (x - 0.47) > 0.61)
+            )
+            & (
+                ((c_x == 0) & (c_y == 2))
+                | ((c_x == 2) & (c_y == 2))
+                | ((c_x == 2) & (c_y == 0))
+            )
+        ),
+        9,
+    ],  # TO or AGN
+    [
+        lambda x, y, c_x, c_y: (
+            (
+                (x < 0.0)
+                & (y < 0.8)
+                & ((y - 1.3) * (x - 0.05) <= 0.61)
+                & ((y - 1.19) * (x - 0.47) > 0.61)
+            )
+            & (
+                ((c_x == 0) & (c_y == 1))
+                | ((c_x == 1) & (c_y == 1))
+                | ((c_x == 1) & (c_y == 0))
+            )
+        ),
+        8,
+    ],  # TO or SFN
+    [
+        lambda x, y, c_x, c_y: (
+            ((x < 0.0) & (y < 0.8) & ((y - 1.3) * (x - 0.05) > 0.61))
+            & (
+                ((c_x == 0) & (c_y == 1))
+                | ((c_x == 1) & (c_y == 1))
+                | ((c_x == 1) & (c_y == 0))
+            )
+        ),
+        1,
+    ],  # SFN
+    # TODO: Add limits for just one line
+]
+
+
+@instrumented
+@array_kernel
+def diag_nii_Sabater2012(
+    x, y, c_x, c_y, use_limits=False, e_x=None, e_y=None, n_threads=1, block_size=None
+):
     """
     Diagnostic using the [NII] diagram
     Input:
@@ -19,9 +122,14 @@ def diag_nii_Sabater2012(x, y, c_x, c_y, use_limits=False):
       c_x - detection code for x (0 detection; 1 upper limit; 2 lower limit; 3 non-determined)
       c_y - detection code for y (0 detection; 1 upper limit; 2 lower limit; 3 non-determined)
       use_limits - Take into account the limits if True
+      e_x, e_y - errors of x and y (optional)
+      n_threads - number of threads evaluating blocks of elements
+      block_size - elements per block (default default_block_size)
     Output:
       diag - Diagnostic code
       c_diag - Code indicating if the diagnostic was applied to an element 1 or 0
+      distance - Only if the errors are given: signed distance in sigma units
+                 to the nearest demarcation curve (see boundary_distance)
     Diagnostic codes:
       1 - SFN
       4 - TO
@@ -30,89 +138,138 @@ def diag_nii_Sabater2012(x, y, c_x, c_y, use_limits=False):
       9 - TO or NLAGN
     """
     x, y, c_x, c_y = numpy_arrays4(x, y, c_x, c_y)
-    conditions = [
-        [((x >= 0.0) | (y >= 0.8) | ((y - 1.19) * (x - 0.47) <= 0.61)), 5],  # AGN
-        [((x < 0.0) & (y < 0.8) & ((y - 1.3) * (x - 0.05) > 0.61)), 1],  # SFN
-        [
-            (
-                (x < 0.0)
-                & (y < 0.8)
-                & ((y - 1.3) * (x - 0.05) <= 0.61)
-                & ((y - 1.19) * (x - 0.47) > 0.61)
-            ),
-            4,
-        ],
-    ]  # TO
     if not use_limits:
-        cond_init = (c_x == 0) & (c_y == 0)  # Only detections
+        diag, c_diag = evaluate_regions(
+            _regions_nii_Sabater2012,
+            x,
+            y,
+            c_x,
+            c_y,
+            block_size=block_size,
+            n_threads=n_threads,
+        )
     else:
-        # Take into account only detections for the previous conditions
-        conditions = [[c[0] & ((c_x == 0) & (c_y == 0)), c[1]] for c in conditions]
-        cond_init = (c_x >= 0) & (c_y >= 0)  # Detections and limits
-        conditions_lim = [
-            [(x >= 0.0) & ((c_x == 0) | (c_x == 2)), 5],  # AGN right
-            [(y >= 0.8) & ((c_y == 0) | (c_y == 2)), 5],  # AGN up
-            [
-                (
-                    ((y - 1.19) * (x - 0.47) <= 0.61)
-                    & (
-                        ((c_x == 0) & (c_y == 2))
-                        | ((c_x == 2) & (c_y == 2))
-                        | ((c_x == 2) & (c_y == 0))
-                    )
-                ),
-                5,
-            ],  # AGN
-            [
-                (
-                    (
-                        (x < 0.0)
-                        & (y < 0.8)
-                        & ((y - 1.3) * (x - 0.05) <= 0.61)
-                        & ((y - 1.19) * (x - 0.47) > 0.61)
-                    )
-                    & (
-                        ((c_x == 0) & (c_y == 2))
-                        | ((c_x == 2) & (c_y == 2))
-                        | ((c_x == 2) & (c_y == 0))
-                    )
-                ),
-                9,
-            ],  # TO or AGN
-            [
-                (
-                    (
-                        (x < 0.0)
-                        & (y < 0.8)
-                        & ((y - 1.3) * (x - 0.05) <= 0.61)
-                        & ((y - 1.19) * (x - 0.47) > 0.61)
-                    )
-                    & (
-                        ((c_x == 0) & (c_y == 1))
-                        | ((c_x == 1) & (c_y == 1))
-                        | ((c_x == 1) & (c_y == 0))
-                    )
-                ),
-                8,
-            ],  # TO or SFN
-            [
-                (
-                    ((x < 0.0) & (y < 0.8) & ((y - 1.3) * (x - 0.05) > 0.61))
-                    & (
-                        ((c_x == 0) & (c_y == 1))
-                        | ((c_x == 1) & (c_y == 1))
-                        | ((c_x == 1) & (c_y == 0))
-                    )
-                ),
-                1,
-            ],  # SFN
-        ]
-        # TODO: Add limits for just one line
-        conditions.extend(conditions_lim)
-    return apply_conditions(cond_init, conditions)
+        diag, c_diag = evaluate_code_regions(
+            _limits_nii_Sabater2012,
+            [x, y],
+            [c_x, c_y],
+            block_size=block_size,
+            n_threads=n_threads,
+        )
+    if e_x is None or e_y is None:
+        return diag, c_diag
+    distance = boundary_distance(
+        _regions_nii_Sabater2012,
+        [x, y],
+        [np.asarray(e_x), np.asarray(e_y)],
+        block_size=block_size,
+        n_threads=n_threads,
+    )
+    distance[c_diag == 0] = np.nan
+    return diag, c_diag, distance
+
 
+# Rules of the [SII] diagram: [function of (x, y, c_x, c_y), code]
+rules_sii_Sabater2012 = [
+    [
+        lambda x, y, c_x, c_y: (
+            (((y - 1.3) * (x - 0.32) <= 0.72) | (x >= 0.32)) & ((1.89 * x - y) <= -0.76)
+        ),
+        2,
+    ],  # Seyfert
+    [
+        lambda x, y, c_x, c_y: (
+            (((y - 1.3) * (x - 0.32) <= 0.72) | (x >= 0.32)) & ((1.89 * x - y) > -0.76)
+        ),
+        3,
+    ],  # LINER
+    [lambda x, y, c_x, c_y: (((y - 1.3) * (x - 0.32) > 0.72) & (x < 0.32)), 1],  # SFN
+]
+# Terms of the demarcation curves of the [SII] diagram
+terms_sii_Sabater2012 = [
+    [lambda x, y: x, 0.32, "high"],
+    [lambda x, y: (y - 1.3) * (x - 0.32), 0.72, "low"],
+    [lambda x, y: 1.89 * x - y, -0.76, "low"],
+]
+# Additional rules of the [SII] diagram for the limits
+rules_sii_Sabater2012_limits = [
+    [
+        lambda x, y, c_x, c_y: (
+            ((y - 1.3) * (x - 0.32) <= 0.72) & (c_x == 2) & (c_y == 2)
+        ),
+        5,
+    ],  # AGN case 1
+    [
+        lambda x, y, c_x, c_y: (
+            ((y - 1.3) * (x - 0.32) <= 0.72)
+            & ((1.89 * x - y) <= -0.76)
+            & (c_x == 0)
+            & (c_y == 2)
+        ),
+        2,
+    ],  # Seyfert case 2
+    [
+        lambda x, y, c_x, c_y: (
+            ((y - 1.3) * (x - 0.32) <= 0.72)
+            & ((1.89 * x - y) <= -0.76)
+            & (c_x == 2)
+            & (c_y == 0)
+        ),
+        5,
+    ],  # AGN case 2
+    [
+        lambda x, y, c_x, c_y: (
+            ((y - 1.3) * (x - 0.32) <= 0.72)
+            & ((1.89 * x - y) > -0.76)
+            & (c_x == 0)
+            & (c_y == 2)
+        ),
+        5,
+    ],  # AGN case 3
+    [
+        lambda x, y, c_x, c_y: (
+            ((y - 1.3) * (x - 0.32) <= 0.72)
+            & ((1.89 * x - y) > -0.76)
+            & (c_x == 2)
+            & (c_y == 0)
+        ),
+        3,
+    ],  # LINER case 3
+    [
+        lambda x, y, c_x, c_y: (
+            (x >= 0.32)
+            & ((1.89 * x - y) <= -0.76)
+            & (((c_x == 2) & (c_y == 1)) | ((c_x == 0) & (c_y == 1)))
+        ),
+        5,
+    ],  # AGN case 4
+    [
+        lambda x, y, c_x, c_y: (
+            (x >= 0.32)
+            & ((1.89 * x - y) > -0.76)
+            & (((c_x == 2) & (c_y == 1)) | ((c_x == 0) & (c_y == 1)))
+        ),
+        3,
+    ],  # LINER case 5
+    [
+        lambda x, y, c_x, c_y: (
+            ((y - 1.3) * (x - 0.32) > 0.72)
+            & (
+                ((c_x == 0) & (c_y == 1))
+                | ((c_x == 1) & (c_y == 1))
+                | ((c_x == 1) & (c_y == 0))
+            )
+        ),
+        1,
+    ],  # SFN
+]
 
-def diag_sii_Sabater2012(x, y, c_x, c_y, use_limits=False):
+
+@instrumented
+@array_kernel
+def diag_sii_Sabater2012(
+    x, y, c_x, c_y, use_limits=False, e_x=None, e_y=None, n_threads=1, block_size=None
+):
     """
     Diagnostic using the [SII] diagram
     Input:
@@ -121,9 +278,14 @@ def diag_sii_Sabater2012(x, y, c_x, c_y, use_limits=False):
       c_x - detection code for x (0 detection; 1 upper limit; 2 lower limit)
       c_y - detection code for y (0 detection; 1 upper limit; 2 lower limit)
       use_limits - Take into account the limits if True
+      e_x, e_y - errors of x and y (optional)
+      n_threads - number of threads evaluating blocks of elements
+      block_size - elements per block (default default_block_size)
     Output:
       diag - Diagnostic code
       c_diag - Code indicating if the diagnostic was applied to an element 1 or 0
+      distance - Only if the errors are given: signed distance in sigma units
+                 to the nearest demarcation curve (see boundary_distance)
     Diagnostic codes:
       1 - SFN
       2 - Seyfert
@@ -131,103 +293,139 @@ def diag_sii_Sabater2012(x, y, c_x, c_y, use_limits=False):
       5 - NLAGN (Seyfert or LINER)
     """
     x, y, c_x, c_y = numpy_arrays4(x, y, c_x, c_y)
-    conditions = [
-        [
-            (
-                (((y - 1.3) * (x - 0.32) <= 0.72) | (x >= 0.32))
-                & ((1.89 * x - y) <= -0.76)
-            ),
-            2,
-        ],  # Seyfert
-        [
-            (
-                (((y - 1.3) * (x - 0.32) <= 0.72) | (x >= 0.32))
-                & ((1.89 * x - y) > -0.76)
-            ),
-            3,
-        ],  # LINER
-        [(((y - 1.3) * (x - 0.32) > 0.72) & (x < 0.32)), 1],
-    ]  # SFN
     if not use_limits:
-        cond_init = (c_x == 0) & (c_y == 0)  # Only detections
+        diag, c_diag = evaluate_regions(
+            _regions_sii_Sabater2012,
+            x,
+            y,
+            c_x,
+            c_y,
+            block_size=block_size,
+            n_threads=n_threads,
+        )
     else:
-        # Take into account only detections for the previous conditions
-        conditions = [[c[0] & ((c_x == 0) & (c_y == 0)), c[1]] for c in conditions]
-        cond_init = (c_x >= 0) & (c_y >= 0)  # Detections and limits
-        conditions_lim = [
-            [
-                (((y - 1.3) * (x - 0.32) <= 0.72) & (c_x == 2) & (c_y == 2)),
-                5,
-            ],  # AGN case 1
-            [
-                (
-                    ((y - 1.3) * (x - 0.32) <= 0.72)
-                    & ((1.89 * x - y) <= -0.76)
-                    & (c_x == 0)
-                    & (c_y == 2)
-                ),
-                2,
-            ],  # Seyfert case 2
-            [
-                (
-                    ((y - 1.3) * (x - 0.32) <= 0.72)
-                    & ((1.89 * x - y) <= -0.76)
-                    & (c_x == 2)
-                    & (c_y == 0)
-                ),
-                5,
-            ],  # AGN case 2
-            [
-                (
-                    ((y - 1.3) * (x - 0.32) <= 0.72)
-                    & ((1.89 * x - y) > -0.76)
-                    & (c_x == 0)
-                    & (c_y == 2)
-                ),
-                5,
-            ],  # AGN case 3
-            [
-                (
-                    ((y - 1.3) * (x - 0.32) <= 0.72)
-                    & ((1.89 * x - y) > -0.76)
-                    & (c_x == 2)
-                    & (c_y == 0)
-                ),
-                3,
-            ],  # LINER case 3
-            [
-                (
-                    (x >= 0.32)
-                    & ((1.89 * x - y) <= -0.76)
-                    & (((c_x == 2) & (c_y == 1)) | ((c_x == 0) & (c_y == 1)))
-                ),
-                5,
-            ],  # AGN case 4
-            [
-                (
-                    (x >= 0.32)
-                    & ((1.89 * x - y) > -0.76)
-                    & (((c_x == 2) & (c_y == 1)) | ((c_x == 0) & (c_y == 1)))
-                ),
-                3,
-            ],  # LINER case 5
-            [
-                (
-                    ((y - 1.3) * (x - 0.32) > 0.72)
-                    & (
-                        ((c_x == 0) & (c_y == 1))
-                        | ((c_x == 1) & (c_y == 1))
-                        | ((c_x == 1) & (c_y == 0))
-                    )
-                ),
-                1,
-            ],  # SFN
-        ]
-        conditions.extend(conditions_lim)
-    return apply_conditions(cond_init, conditions)
+        diag, c_diag = evaluate_code_regions(
+            _limits_sii_Sabater2012,
+            [x, y],
+            [c_x, c_y],
+            block_size=block_size,
+            n_threads=n_threads,
+        )
+    if e_x is None or e_y is None:
+        return diag, c_diag
+    distance = boundary_distance(
+        _regions_sii_Sabater2012,
+        [x, y],
+        [np.asarray(e_x), np.asarray(e_y)],
+        block_size=block_size,
+        n_threads=n_threads,
+    )
+    distance[c_diag == 0] = np.nan
+    return diag, c_diag, distance
+
 
+# Rules of the [OI] diagram: [function of (x, y, c_x, c_y), code]
+rules_oi_Sabater2012 = [
+    [
+        lambda x, y, c_x, c_y: (
+            (((y - 1.33) * (x + 0.59) <= 0.73) | (x >= -0.59))
+            & ((1.18 * x - y) <= -1.3)
+        ),
+        2,
+    ],  # Seyfert
+    [
+        lambda x, y, c_x, c_y: (
+            (((y - 1.33) * (x + 0.59) <= 0.73) | (x >= -0.59)) & ((1.18 * x - y) > -1.3)
+        ),
+        3,
+    ],  # LINER
+    [lambda x, y, c_x, c_y: (((y - 1.33) * (x + 0.59) > 0.73) & (x < -0.59)), 1],  # SFN
+]
+# Terms of the demarcation curves of the [OI] diagram
+terms_oi_Sabater2012 = [
+    [lambda x, y: x, -0.59, "high"],
+    [lambda x, y: (y - 1.33) * (x + 0.59), 0.73, "low"],
+    [lambda x, y: 1.18 * x - y, -1.3, "low"],
+]
+# Additional rules of the [OI] diagram for the limits
+rules_oi_Sabater2012_limits = [
+    [
+        lambda x, y, c_x, c_y: (
+            ((y - 1.33) * (x + 0.59) <= 0.73) & (c_x == 2) & (c_y == 2)
+        ),
+        5,
+    ],  # AGN case 1
+    [
+        lambda x, y, c_x, c_y: (
+            ((y - 1.33) * (x + 0.59) <= 0.73)
+            & ((1.18 * x - y) <= -1.3)
+            & (c_x == 0)
+            & (c_y == 2)
+        ),
+        2,
+    ],  # Seyfert case 2
+    [
+        lambda x, y, c_x, c_y: (
+            ((y - 1.33) * (x + 0.59) <= 0.73)
+            & ((1.18 * x - y) <= -1.3)
+            & (c_x == 2)
+            & (c_y == 0)
+        ),
+        5,
+    ],  # AGN case 2
+    [
+        lambda x, y, c_x, c_y: (
+            ((y - 1.33) * (x + 0.59) <= 0.73)
+            & ((1.18 * x - y) > -1.3)
+            & (c_x == 0)
+            & (c_y == 2)
+        ),
+        5,
+    ],  # AGN case 3
+    [
+        lambda x, y, c_x, c_y: (
+            ((y - 1.33) * (x + 0.59) <= 0.73)
+            & ((1.18 * x - y) > -1.3)
+            & (c_x == 2)
+            & (c_y == 0)
+        ),
+        3,
+    ],  # LINER case 3
+    [
+        lambda x, y, c_x, c_y: (
+            (x >= -0.59)
+            & ((1.18 * x - y) <= -1.3)
+            & (((c_x == 2) & (c_y == 1)) | ((c_x == 0) & (c_y == 1)))
+        ),
+        5,
+    ],  # AGN case 4
+    [
+        lambda x, y, c_x, c_y: (
+            (x >= -0.59)
+            & ((1.18 * x - y) > -1.3)
+            & (((c_x == 2) & (c_y == 1)) | ((c_x == 0) & (c_y == 1)))
+        ),
+        3,
+    ],  # LINER case 5
+    [
+        lambda x, y, c_x, c_y: (
+            ((y - 1.33) * (x + 0.59) > 0.73)
+            & (
+                ((c_x == 0) & (c_y == 1))
+                | ((c_x == 1) & (c_y == 1))
+                | ((c_x == 1) & (c_y == 0))
+            )
+        ),
+        1,
+    ],  # SFN
+]
 
-def diag_oi_Sabater2012(x, y, c_x, c_y, use_limits=False):
+
+@instrumented
+@array_kernel
+def diag_oi_Sabater2012(
+    x, y, c_x, c_y, use_limits=False, e_x=None, e_y=None, n_threads=1, block_size=None
+):
     """
     Diagnostic using the [OI] diagram
     Input:
@@ -236,9 +434,14 @@ def diag_oi_Sabater2012(x, y, c_x, c_y, use_limits=False):
       c_x - detection code for x (0 detection; 1 upper limit; 2 lower limit)
       c_y - detection code for y (0 detection; 1 upper limit; 2 lower limit)
       use_limits - Take into account the limits if True
+      e_x, e_y - errors of x and y (optional)
+      n_threads - number of threads evaluating blocks of elements
+      block_size - elements per block (default default_block_size)
     Output:
       diag - Diagnostic code
       c_diag - Code indicating if the diagnostic was applied to an element 1 or 0
+      distance - Only if the errors are given: signed distance in sigma units
+                 to the nearest demarcation curve (see boundary_distance)
     Diagnostic codes:
       1 - SFN
       2 - Seyfert
@@ -246,102 +449,290 @@ def diag_oi_Sabater2012(x, y, c_x, c_y, use_limits=False):
       5 - NLAGN (Seyfert or LINER)
     """
     x, y, c_x, c_y = numpy_arrays4(x, y, c_x, c_y)
-    conditions = [
-        [
-            (
-                (((y - 1.33) * (x + 0.59) <= 0.73) | (x >= -0.59))
-                & ((1.18 * x - y) <= -1.3)
-            ),
-            2,
-        ],  # Seyfert
-        [
-            (
-                (((y - 1.33) * (x + 0.59) <= 0.73) | (x >= -0.59))
-                & ((1.18 * x - y) > -1.3)
-            ),
-            3,
-        ],  # LINER
-        [(((y - 1.33) * (x + 0.59) > 0.73) & (x < -0.59)), 1],
-    ]  # SFN
     if not use_limits:
-        cond_init = (c_x == 0) & (c_y == 0)  # Only detections
+        diag, c_diag = evaluate_regions(
+            _regions_oi_Sabater2012,
+            x,
+            y,
+            c_x,
+            c_y,
+            block_size=block_size,
+            n_threads=n_threads,
+        )
     else:
-        # Take into account only detections for the previous conditions
-        conditions = [[c[0] & ((c_x == 0) & (c_y == 0)), c[1]] for c in conditions]
-        cond_init = (c_x >= 0) & (c_y >= 0)  # Detections and limits
-        conditions_lim = [
-            [
-                (((y - 1.33) * (x + 0.59) <= 0.73) & (c_x == 2) & (c_y == 2)),
-                5,
-            ],  # AGN case 1
-            [
-                (
-                    ((y - 1.33) * (x + 0.59) <= 0.73)
-                    & ((1.18 * x - y) <= -1.3)
-                    & (c_x == 0)
-                    & (c_y == 2)
-                ),
-                2,
-            ],  # Seyfert case 2
-            [
-                (
-                    ((y - 1.33) * (x + 0.59) <= 0.73)
-                    & ((1.18 * x - y) <= -1.3)
-                    & (c_x == 2)
-                    & (c_y == 0)
-                ),
-                5,
-            ],  # AGN case 2
-            [
-                (
-                    ((y - 1.33) * (x + 0.59) <= 0.73)
-                    & ((1.18 * x - y) > -1.3)
-                    & (c_x == 0)
-                    & (c_y == 2)
-                ),
-                5,
-            ],  # AGN case 3
-            [
-                (
-                    ((y - 1.33) * (x + 0.59) <= 0.73)
-                    & ((1.18 * x - y) > -1.3)
-                    & (c_x == 2)
-                    & (c_y == 0)
-                ),
-                3,
-            ],  # LINER case 3
-            [
-                (
-                    (x >= -0.59)
-                    & ((1.18 * x - y) <= -1.3)
-                    & (((c_x == 2) & (c_y == 1)) | ((c_x == 0) & (c_y == 1)))
-                ),
-                5,
-            ],  # AGN case 4
-            [
-                (
-                    (x >= -0.59)
-                    & ((1.18 * x - y) > -1.3)
-                    & (((c_x == 2) & (c_y == 1)) | ((c_x == 0) & (c_y == 1)))
-                ),
-                3,
-            ],  # LINER case 5
-            [
-                (
-                    ((y - 1.33) * (x + 0.59) > 0.73)
-                    & (
-                        ((c_x == 0) & (c_y == 1))
-                        | ((c_x == 1) & (c_y == 1))
-                        | ((c_x == 1) & (c_y == 0))
-                    )
-                ),
-                1,
-            ],  # SFN
-        ]
-        conditions.extend(conditions_lim)
-    return apply_conditions(cond_init, conditions)
+        diag, c_diag = evaluate_code_regions(
+            _limits_oi_Sabater2012,
+            [x, y],
+            [c_x, c_y],
+            block_size=block_size,
+            n_threads=n_threads,
+        )
+    if e_x is None or e_y is None:
+        return diag, c_diag
+    distance = boundary_distance(
+        _regions_oi_Sabater2012,
+        [x, y],
+        [np.asarray(e_x), np.asarray(e_y)],
+        block_size=block_size,
+        n_threads=n_threads,
+    )
+    distance[c_diag == 0] = np.nan
+    return diag, c_diag, distance
 
 
+def diag_Sabater2012_sweep(
+    name, x, y, c_x, c_y, use_limits=(True, False), n_threads=1, block_size=None
+):
+    """
+    Diagnostic of a Sabater et al. 2012 diagram with several values of
+    use_limits at once. The region of each element is computed once and
+    the decision table of each value is gathered.
+    Input:
+      name - diagram: "nii", "sii" or "oi"
+      x, y, c_x, c_y, n_threads, block_size - as in diag_nii_Sabater2012
+      use_limits - sequence of values of use_limits
+    Output:
+      list with the (diag, c_diag) of each value of use_limits, as returned
+      by the diag function of the diagram
+    """
+    x, y, c_x, c_y = numpy_arrays4(x, y, c_x, c_y)
+    tables = _code_regions_Sabater2012[name]
+    return evaluate_code_regions(
+        [tables[bool(u)] for u in use_limits],
+        [x, y],
+        [c_x, c_y],
+        block_size=block_size,
+        n_threads=n_threads,
+    )
+
+
+def only_detections(x, y, c_x, c_y):
+    """
+    Elements detected in both axes of a diagram.
+    """
+    return (c_x == 0) & (c_y == 0)
+
+
+def detections_and_limits(x, y, c_x, c_y):
+    """
+    Elements detected or with limits in both axes of a diagram.
+    """
+    return (c_x >= 0) & (c_y >= 0)
+
+
+def restrict_rules(rules, cond):
+    """
+    Restrict the rules to the elements where the function 'cond' is true.
+    """
+    return [[lambda *a, rule=rule: rule(*a) & cond(*a), code] for rule, code in rules]
+
+
+# With limits the rules for detections are applied only to the detections
+_rules_nii_Sabater2012_limits = (
+    restrict_rules(rules_nii_Sabater2012, only_detections)
+    + rules_nii_Sabater2012_limits
+)
+_rules_sii_Sabater2012_limits = (
+    restrict_rules(rules_sii_Sabater2012, only_detections)
+    + rules_sii_Sabater2012_limits
+)
+_rules_oi_Sabater2012_limits = (
+    restrict_rules(rules_oi_Sabater2012, only_detections) + rules_oi_Sabater2012_limits
+)
+
+
+# Codes that can be found in the classification tables. Any other value is
+# sent to an extra slot of the compiled tables that does not match any row.
+table_codes = list(range(11))
+
+# Common classification for SII and OI
+# Key for sii oi class: [class sii, class oi, class sii oi]
+table_Sabater2012_sii_oi = [
+    [0, 0, 0],
+    [0, 1, 1],
+    [0, 2, 2],
+    [0, 3, 3],
+    [0, 5, 5],
+    [1, 0, 1],
+    [1, 1, 1],
+    [1, 2, 0],
+    [1, 3, 0],
+    [1, 5, 0],
+    [2, 0, 2],
+    [2, 1, 0],
+    [2, 2, 2],
+    [2, 3, 5],
+    [2, 5, 2],
+    [3, 0, 3],
+    [3, 1, 0],
+    [3, 2, 5],
+    [3, 3, 3],
+    [3, 5, 3],
+    [5, 0, 5],
+    [5, 1, 0],
+    [5, 2, 2],
+    [5, 3, 3],
+    [5, 5, 5],
+]
+# Key for similarity: [class sii, class oi, similarity sii oi]
+table_Sabater2012_sim = [
+    [0, 0, 0],
+    [0, 1, 0],
+    [0, 2, 0],
+    [0, 3, 0],
+    [0, 5, 0],
+    [1, 0, 0],
+    [1, 1, 1],
+    [1, 2, 0],
+    [1, 3, 0],
+    [1, 5, 0],
+    [2, 0, 0],
+    [2, 1, 0],
+    [2, 2, 1],
+    [2, 3, 1],
+    [2, 5, 1],
+    [3, 0, 0],
+    [3, 1, 0],
+    [3, 2, 1],
+    [3, 3, 1],
+    [3, 5, 1],
+    [5, 0, 0],
+    [5, 1, 0],
+    [5, 2, 1],
+    [5, 3, 1],
+    [5, 5, 1],
+]
+# Final classification
+# Key for final class: [class nii, class sii oi, similarity sii oi, final class]
+table_Sabater2012_class = [
+    [0, 0, 0, 0],
+    [0, 1, 0, 1],
+    [0, 2, 0, 2],
+    [0, 3, 0, 3],
+    [0, 5, 0, 5],
+    [0, 0, 1, 0],
+    [0, 1, 1, 1],
+    [0, 2, 1, 2],
+    [0, 3, 1, 3],
+    [0, 5, 1, 5],
+    [1, 0, 0, 1],
+    [1, 1, 0, 1],
+    [1, 2, 0, 1],
+    [1, 3, 0, 1],
+    [1, 5, 0, 1],
+    [1, 0, 1, 1],
+    [1, 1, 1, 1],
+    [1, 2, 1, 1],
+    [1, 3, 1, 1],
+    [1, 5, 1, 1],
+    [4, 0, 0, 4],
+    [4, 1, 0, 4],
+    [4, 2, 0, 4],
+    [4, 3, 0, 4],
+    [4, 5, 0, 4],
+    [4, 0, 1, 4],
+    [4, 1, 1, 4],
+    [4, 2, 1, 4],
+    [4, 3, 1, 4],
+    [4, 5, 1, 4],
+    [5, 0, 0, 5],
+    [5, 1, 0, 5],
+    [5, 2, 0, 2],
+    [5, 3, 0, 3],
+    [5, 5, 0, 5],
+    [5, 0, 1, 5],
+    [5, 1, 1, 1],
+    [5, 2, 1, 2],
+    [5, 3, 1, 3],
+    [5, 5, 1, 5],
+    [8, 0, 0, 8],
+    [8, 1, 0, 4],
+    [8, 2, 0, 4],
+    [8, 3, 0, 4],
+    [8, 5, 0, 4],
+    [8, 0, 1, 8],
+    [8, 1, 1, 4],
+    [8, 2, 1, 4],
+    [8, 3, 1, 4],
+    [8, 5, 1, 4],
+    [9, 0, 0, 9],
+    [9, 1, 0, 4],
+    [9, 2, 0, 4],
+    [9, 3, 0, 4],
+    [9, 5, 0, 4],
+    [9, 0, 1, 9],
+    [9, 1, 1, 4],
+    [9, 2, 1, 4],
+    [9, 3, 1, 4],
+    [9, 5, 1, 4],
+]
+# Key for final TO class: [class nii, class sii oi, similarity sii oi, final TO class]
+table_Sabater2012_class_to = [
+    [0, 0, 0, 0],
+    [0, 1, 0, 0],
+    [0, 2, 0, 0],
+    [0, 3, 0, 0],
+    [0, 5, 0, 0],
+    [0, 0, 1, 0],
+    [0, 1, 1, 0],
+    [0, 2, 1, 0],
+    [0, 3, 1, 0],
+    [0, 5, 1, 0],
+    [1, 0, 0, 0],
+    [1, 1, 0, 0],
+    [1, 2, 0, 0],
+    [1, 3, 0, 0],
+    [1, 5, 0, 0],
+    [1, 0, 1, 0],
+    [1, 1, 1, 0],
+    [1, 2, 1, 0],
+    [1, 3, 1, 0],
+    [1, 5, 1, 0],
+    [4, 0, 0, 0],
+    [4, 1, 0, 1],
+    [4, 2, 0, 2],
+    [4, 3, 0, 3],
+    [4, 5, 0, 5],
+    [4, 0, 1, 0],
+    [4, 1, 1, 1],
+    [4, 2, 1, 2],
+    [4, 3, 1, 3],
+    [4, 5, 1, 5],
+    [5, 0, 0, 0],
+    [5, 1, 0, 0],
+    [5, 2, 0, 0],
+    [5, 3, 0, 0],
+    [5, 5, 0, 0],
+    [5, 0, 1, 0],
+    [5, 1, 1, 0],
+    [5, 2, 1, 0],
+    [5, 3, 1, 0],
+    [5, 5, 1, 0],
+    [8, 0, 0, 0],
+    [8, 1, 0, 1],
+    [8, 2, 0, 2],
+    [8, 3, 0, 3],
+    [8, 5, 0, 5],
+    [8, 0, 1, 0],
+    [8, 1, 1, 1],
+    [8, 2, 1, 2],
+    [8, 3, 1, 3],
+    [8, 5, 1, 5],
+    [9, 0, 0, 0],
+    [9, 1, 0, 0],
+    [9, 2, 0, 2],
+    [9, 3, 0, 3],
+    [9, 5, 0, 5],
+    [9, 0, 1, 0],
+    [9, 1, 1, 0],
+    [9, 2, 1, 2],
+    [9, 3, 1, 3],
+    [9, 5, 1, 5],
+]
+
+
+@instrumented
+@array_kernel
 def diag_class_Sabater2012(class_nii, class_sii, class_oi):
     """
     Final classification. Sabater et al. 2012 criteria.
@@ -356,205 +747,182 @@ def diag_class_Sabater2012(class_nii, class_sii, class_oi):
     9 - TO or NLAGN
     10 - Seyfert 1 (not used here)
     """
-    sii_oi = np.zeros_like(class_sii)
-    s_sii_oi = np.zeros_like(class_sii)
-    final = np.zeros_like(class_sii)
-    final_to = np.zeros_like(class_sii)
-    # Common classification for SII and OI
-    # Key for sii oi class: [class sii, class oi, class sii oi]
-    table_class = [
-        [0, 0, 0],
-        [0, 1, 1],
-        [0, 2, 2],
-        [0, 3, 3],
-        [0, 5, 5],
-        [1, 0, 1],
-        [1, 1, 1],
-        [1, 2, 0],
-        [1, 3, 0],
-        [1, 5, 0],
-        [2, 0, 2],
-        [2, 1, 0],
-        [2, 2, 2],
-        [2, 3, 5],
-        [2, 5, 2],
-        [3, 0, 3],
-        [3, 1, 0],
-        [3, 2, 5],
-        [3, 3, 3],
-        [3, 5, 3],
-        [5, 0, 5],
-        [5, 1, 0],
-        [5, 2, 2],
-        [5, 3, 3],
-        [5, 5, 5],
-    ]
-    # Key for similarity: [class sii, class oi, similarity sii oi]
-    table_sim = [
-        [0, 0, 0],
-        [0, 1, 0],
-        [0, 2, 0],
-        [0, 3, 0],
-        [0, 5, 0],
-        [1, 0, 0],
-        [1, 1, 1],
-        [1, 2, 0],
-        [1, 3, 0],
-        [1, 5, 0],
-        [2, 0, 0],
-        [2, 1, 0],
-        [2, 2, 1],
-        [2, 3, 1],
-        [2, 5, 1],
-        [3, 0, 0],
-        [3, 1, 0],
-        [3, 2, 1],
-        [3, 3, 1],
-        [3, 5, 1],
-        [5, 0, 0],
-        [5, 1, 0],
-        [5, 2, 1],
-        [5, 3, 1],
-        [5, 5, 1],
-    ]
-    for t in table_class:
-        sii_oi[(class_sii == t[0]) & (class_oi == t[1])] = t[2]
-    for s in table_sim:
-        s_sii_oi[(class_sii == s[0]) & (class_oi == s[1])] = s[2]
-    # Final classification
-    # Key for final class: [class nii, class sii oi, similarity sii oi, final class]
-    table_class_nii = [
-        [0, 0, 0, 0],
-        [0, 1, 0, 1],
-        [0, 2, 0, 2],
-        [0, 3, 0, 3],
-        [0, 5, 0, 5],
-        [0, 0, 1, 0],
-        [0, 1, 1, 1],
-        [0, 2, 1, 2],
-        [0, 3, 1, 3],
-        [0, 5, 1, 5],
-        [1, 0, 0, 1],
-        [1, 1, 0, 1],
-        [1, 2, 0, 1],
-        [1, 3, 0, 1],
-        [1, 5, 0, 1],
-        [1, 0, 1, 1],
-        [1, 1, 1, 1],
-        [1, 2, 1, 1],
-        [1, 3, 1, 1],
-        [1, 5, 1, 1],
-        [4, 0, 0, 4],
-        [4, 1, 0, 4],
-        [4, 2, 0, 4],
-        [4, 3, 0, 4],
-        [4, 5, 0, 4],
-        [4, 0, 1, 4],
-        [4, 1, 1, 4],
-        [4, 2, 1, 4],
-        [4, 3, 1, 4],
-        [4, 5, 1, 4],
-        [5, 0, 0, 5],
-        [5, 1, 0, 5],
-        [5, 2, 0, 2],
-        [5, 3, 0, 3],
-        [5, 5, 0, 5],
-        [5, 0, 1, 5],
-        [5, 1, 1, 1],
-        [5, 2, 1, 2],
-        [5, 3, 1, 3],
-        [5, 5, 1, 5],
-        [8, 0, 0, 8],
-        [8, 1, 0, 4],
-        [8, 2, 0, 4],
-        [8, 3, 0, 4],
-        [8, 5, 0, 4],
-        [8, 0, 1, 8],
-        [8, 1, 1, 4],
-        [8, 2, 1, 4],
-        [8, 3, 1, 4],
-        [8, 5, 1, 4],
-        [9, 0, 0, 9],
-        [9, 1, 0, 4],
-        [9, 2, 0, 4],
-        [9, 3, 0, 4],
-        [9, 5, 0, 4],
-        [9, 0, 1, 9],
-        [9, 1, 1, 4],
-        [9, 2, 1, 4],
-        [9, 3, 1, 4],
-        [9, 5, 1, 4],
-    ]
-    for t in table_class_nii:
-        final[(class_nii == t[0]) & (sii_oi == t[1]) & (s_sii_oi == t[2])] = t[3]
-    # Key for final TO class: [class nii, class sii oi, similarity sii oi, final TO class]
-    table_class_to = [
-        [0, 0, 0, 0],
-        [0, 1, 0, 0],
-        [0, 2, 0, 0],
-        [0, 3, 0, 0],
-        [0, 5, 0, 0],
-        [0, 0, 1, 0],
-        [0, 1, 1, 0],
-        [0, 2, 1, 0],
-        [0, 3, 1, 0],
-        [0, 5, 1, 0],
-        [1, 0, 0, 0],
-        [1, 1, 0, 0],
-        [1, 2, 0, 0],
-        [1, 3, 0, 0],
-        [1, 5, 0, 0],
-        [1, 0, 1, 0],
-        [1, 1, 1, 0],
-        [1, 2, 1, 0],
-        [1, 3, 1, 0],
-        [1, 5, 1, 0],
-        [4, 0, 0, 0],
-        [4, 1, 0, 1],
-        [4, 2, 0, 2],
-        [4, 3, 0, 3],
-        [4, 5, 0, 5],
-        [4, 0, 1, 0],
-        [4, 1, 1, 1],
-        [4, 2, 1, 2],
-        [4, 3, 1, 3],
-        [4, 5, 1, 5],
-        [5, 0, 0, 0],
-        [5, 1, 0, 0],
-        [5, 2, 0, 0],
-        [5, 3, 0, 0],
-        [5, 5, 0, 0],
-        [5, 0, 1, 0],
-        [5, 1, 1, 0],
-        [5, 2, 1, 0],
-        [5, 3, 1, 0],
-        [5, 5, 1, 0],
-        [8, 0, 0, 0],
-        [8, 1, 0, 1],
-        [8, 2, 0, 2],
-        [8, 3, 0, 3],
-        [8, 5, 0, 5],
-        [8, 0, 1, 0],
-        [8, 1, 1, 1],
-        [8, 2, 1, 2],
-        [8, 3, 1, 3],
-        [8, 5, 1, 5],
-        [9, 0, 0, 0],
-        [9, 1, 0, 0],
-        [9, 2, 0, 2],
-        [9, 3, 0, 3],
-        [9, 5, 0, 5],
-        [9, 0, 1, 0],
-        [9, 1, 1, 0],
-        [9, 2, 1, 2],
-        [9, 3, 1, 3],
-        [9, 5, 1, 5],
-    ]
-    for t in table_class_to:
-        final_to[(class_nii == t[0]) & (sii_oi == t[1]) & (s_sii_oi == t[2])] = t[3]
+    index = table_index(class_nii, class_sii, class_oi)
+    dtype = np.asarray(class_sii).dtype
+    final = _lut_Sabater2012_class.take(index).astype(dtype, copy=False)
+    final_to = _lut_Sabater2012_class_to.take(index).astype(dtype, copy=False)
     return final, final_to
 
 
+def _diag_class_Sabater2012_rows(class_nii, class_sii, class_oi):
+    """
+    Row by row application of the Sabater et al. 2012 tables.
+    Used to compile the lookup tables of diag_class_Sabater2012.
+    """
+    sii_oi = apply_table(table_Sabater2012_sii_oi, class_sii, class_oi)
+    s_sii_oi = apply_table(table_Sabater2012_sim, class_sii, class_oi)
+    final = apply_table(table_Sabater2012_class, class_nii, sii_oi, s_sii_oi)
+    final_to = apply_table(table_Sabater2012_class_to, class_nii, sii_oi, s_sii_oi)
+    return final, final_to
+
+
+# Key for final class: [class nii, class sii, class oi, final class]
+table_OiSiiNii = [
+    [0, 0, 0, 0],
+    [0, 1, 0, 1],
+    [0, 2, 0, 2],
+    [0, 3, 0, 3],
+    [0, 5, 0, 5],
+    [0, 0, 1, 1],
+    [0, 1, 1, 1],
+    [0, 2, 1, 1],
+    [0, 3, 1, 1],
+    [0, 5, 1, 1],
+    [0, 0, 2, 2],
+    [0, 1, 2, 2],
+    [0, 2, 2, 2],
+    [0, 3, 2, 2],
+    [0, 5, 2, 2],
+    [0, 0, 3, 3],
+    [0, 1, 3, 3],
+    [0, 2, 3, 3],
+    [0, 3, 3, 3],
+    [0, 5, 3, 3],
+    [0, 0, 5, 5],
+    [0, 1, 5, 5],
+    [0, 2, 5, 5],
+    [0, 3, 5, 5],
+    [0, 5, 5, 5],
+    [1, 0, 0, 1],
+    [1, 1, 0, 1],
+    [1, 2, 0, 2],
+    [1, 3, 0, 3],
+    [1, 5, 0, 5],
+    [1, 0, 1, 1],
+    [1, 1, 1, 1],
+    [1, 2, 1, 1],
+    [1, 3, 1, 1],
+    [1, 5, 1, 1],
+    [1, 0, 2, 2],
+    [1, 1, 2, 2],
+    [1, 2, 2, 2],
+    [1, 3, 2, 2],
+    [1, 5, 2, 2],
+    [1, 0, 3, 3],
+    [1, 1, 3, 3],
+    [1, 2, 3, 3],
+    [1, 3, 3, 3],
+    [1, 5, 3, 3],
+    [1, 0, 5, 5],
+    [1, 1, 5, 5],
+    [1, 2, 5, 5],
+    [1, 3, 5, 5],
+    [1, 5, 5, 5],
+    [4, 0, 0, 4],
+    [4, 1, 0, 1],
+    [4, 2, 0, 2],
+    [4, 3, 0, 3],
+    [4, 5, 0, 5],
+    [4, 0, 1, 1],
+    [4, 1, 1, 1],
+    [4, 2, 1, 1],
+    [4, 3, 1, 1],
+    [4, 5, 1, 1],
+    [4, 0, 2, 2],
+    [4, 1, 2, 2],
+    [4, 2, 2, 2],
+    [4, 3, 2, 2],
+    [4, 5, 2, 2],
+    [4, 0, 3, 3],
+    [4, 1, 3, 3],
+    [4, 2, 3, 3],
+    [4, 3, 3, 3],
+    [4, 5, 3, 3],
+    [4, 0, 5, 5],
+    [4, 1, 5, 5],
+    [4, 2, 5, 5],
+    [4, 3, 5, 5],
+    [4, 5, 5, 5],
+    [5, 0, 0, 5],
+    [5, 1, 0, 1],
+    [5, 2, 0, 2],
+    [5, 3, 0, 3],
+    [5, 5, 0, 5],
+    [5, 0, 1, 1],
+    [5, 1, 1, 1],
+    [5, 2, 1, 1],
+    [5, 3, 1, 1],
+    [5, 5, 1, 1],
+    [5, 0, 2, 2],
+    [5, 1, 2, 2],
+    [5, 2, 2, 2],
+    [5, 3, 2, 2],
+    [5, 5, 2, 2],
+    [5, 0, 3, 3],
+    [5, 1, 3, 3],
+    [5, 2, 3, 3],
+    [5, 3, 3, 3],
+    [5, 5, 3, 3],
+    [5, 0, 5, 5],
+    [5, 1, 5, 5],
+    [5, 2, 5, 5],
+    [5, 3, 5, 5],
+    [5, 5, 5, 5],
+    [8, 0, 0, 8],
+    [8, 1, 0, 1],
+    [8, 2, 0, 2],
+    [8, 3, 0, 3],
+    [8, 5, 0, 5],
+    [8, 0, 1, 1],
+    [8, 1, 1, 1],
+    [8, 2, 1, 1],
+    [8, 3, 1, 1],
+    [8, 5, 1, 1],
+    [8, 0, 2, 2],
+    [8, 1, 2, 2],
+    [8, 2, 2, 2],
+    [8, 3, 2, 2],
+    [8, 5, 2, 2],
+    [8, 0, 3, 3],
+    [8, 1, 3, 3],
+    [8, 2, 3, 3],
+    [8, 3, 3, 3],
+    [8, 5, 3, 3],
+    [8, 0, 5, 5],
+    [8, 1, 5, 5],
+    [8, 2, 5, 5],
+    [8, 3, 5, 5],
+    [8, 5, 5, 5],
+    [9, 0, 0, 9],
+    [9, 1, 0, 1],
+    [9, 2, 0, 2],
+    [9, 3, 0, 3],
+    [9, 5, 0, 5],
+    [9, 0, 1, 1],
+    [9, 1, 1, 1],
+    [9, 2, 1, 1],
+    [9, 3, 1, 1],
+    [9, 5, 1, 1],
+    [9, 0, 2, 2],
+    [9, 1, 2, 2],
+    [9, 2, 2, 2],
+    [9, 3, 2, 2],
+    [9, 5, 2, 2],
+    [9, 0, 3, 3],
+    [9, 1, 3, 3],
+    [9, 2, 3, 3],
+    [9, 3, 3, 3],
+    [9, 5, 3, 3],
+    [9, 0, 5, 5],
+    [9, 1, 5, 5],
+    [9, 2, 5, 5],
+    [9, 3, 5, 5],
+    [9, 5, 5, 5],
+]
+
+
+@instrumented
+@array_kernel
 def diag_class_OiSiiNii(class_nii, class_sii, class_oi):
     """
     Final classification. Buttiglionne criteria ?
@@ -569,166 +937,166 @@ def diag_class_OiSiiNii(class_nii, class_sii, class_oi):
     9 - TO or NLAGN
     10 - Seyfert 1 (not used here)
     """
-    final = np.zeros_like(class_sii)
-    # Common classification for SII and OI
-    # Key for sii oi class: [class sii, class oi, class sii oi]
-    table_class = [
-        [0, 0, 0, 0],
-        [0, 1, 0, 1],
-        [0, 2, 0, 2],
-        [0, 3, 0, 3],
-        [0, 5, 0, 5],
-        [0, 0, 1, 1],
-        [0, 1, 1, 1],
-        [0, 2, 1, 1],
-        [0, 3, 1, 1],
-        [0, 5, 1, 1],
-        [0, 0, 2, 2],
-        [0, 1, 2, 2],
-        [0, 2, 2, 2],
-        [0, 3, 2, 2],
-        [0, 5, 2, 2],
-        [0, 0, 3, 3],
-        [0, 1, 3, 3],
-        [0, 2, 3, 3],
-        [0, 3, 3, 3],
-        [0, 5, 3, 3],
-        [0, 0, 5, 5],
-        [0, 1, 5, 5],
-        [0, 2, 5, 5],
-        [0, 3, 5, 5],
-        [0, 5, 5, 5],
-        [1, 0, 0, 1],
-        [1, 1, 0, 1],
-        [1, 2, 0, 2],
-        [1, 3, 0, 3],
-        [1, 5, 0, 5],
-        [1, 0, 1, 1],
-        [1, 1, 1, 1],
-        [1, 2, 1, 1],
-        [1, 3, 1, 1],
-        [1, 5, 1, 1],
-        [1, 0, 2, 2],
-        [1, 1, 2, 2],
-        [1, 2, 2, 2],
-        [1, 3, 2, 2],
-        [1, 5, 2, 2],
-        [1, 0, 3, 3],
-        [1, 1, 3, 3],
-        [1, 2, 3, 3],
-        [1, 3, 3, 3],
-        [1, 5, 3, 3],
-        [1, 0, 5, 5],
-        [1, 1, 5, 5],
-        [1, 2, 5, 5],
-        [1, 3, 5, 5],
-        [1, 5, 5, 5],
-        [4, 0, 0, 4],
-        [4, 1, 0, 1],
-        [4, 2, 0, 2],
-        [4, 3, 0, 3],
-        [4, 5, 0, 5],
-        [4, 0, 1, 1],
-        [4, 1, 1, 1],
-        [4, 2, 1, 1],
-        [4, 3, 1, 1],
-        [4, 5, 1, 1],
-        [4, 0, 2, 2],
-        [4, 1, 2, 2],
-        [4, 2, 2, 2],
-        [4, 3, 2, 2],
-        [4, 5, 2, 2],
-        [4, 0, 3, 3],
-        [4, 1, 3, 3],
-        [4, 2, 3, 3],
-        [4, 3, 3, 3],
-        [4, 5, 3, 3],
-        [4, 0, 5, 5],
-        [4, 1, 5, 5],
-        [4, 2, 5, 5],
-        [4, 3, 5, 5],
-        [4, 5, 5, 5],
-        [5, 0, 0, 5],
-        [5, 1, 0, 1],
-        [5, 2, 0, 2],
-        [5, 3, 0, 3],
-        [5, 5, 0, 5],
-        [5, 0, 1, 1],
-        [5, 1, 1, 1],
-        [5, 2, 1, 1],
-        [5, 3, 1, 1],
-        [5, 5, 1, 1],
-        [5, 0, 2, 2],
-        [5, 1, 2, 2],
-        [5, 2, 2, 2],
-        [5, 3, 2, 2],
-        [5, 5, 2, 2],
-        [5, 0, 3, 3],
-        [5, 1, 3, 3],
-        [5, 2, 3, 3],
-        [5, 3, 3, 3],
-        [5, 5, 3, 3],
-        [5, 0, 5, 5],
-        [5, 1, 5, 5],
-        [5, 2, 5, 5],
-        [5, 3, 5, 5],
-        [5, 5, 5, 5],
-        [8, 0, 0, 8],
-        [8, 1, 0, 1],
-        [8, 2, 0, 2],
-        [8, 3, 0, 3],
-        [8, 5, 0, 5],
-        [8, 0, 1, 1],
-        [8, 1, 1, 1],
-        [8, 2, 1, 1],
-        [8, 3, 1, 1],
-        [8, 5, 1, 1],
-        [8, 0, 2, 2],
-        [8, 1, 2, 2],
-        [8, 2, 2, 2],
-        [8, 3, 2, 2],
-        [8, 5, 2, 2],
-        [8, 0, 3, 3],
-        [8, 1, 3, 3],
-        [8, 2, 3, 3],
-        [8, 3, 3, 3],
-        [8, 5, 3, 3],
-        [8, 0, 5, 5],
-        [8, 1, 5, 5],
-        [8, 2, 5, 5],
-        [8, 3, 5, 5],
-        [8, 5, 5, 5],
-        [9, 0, 0, 9],
-        [9, 1, 0, 1],
-        [9, 2, 0, 2],
-        [9, 3, 0, 3],
-        [9, 5, 0, 5],
-        [9, 0, 1, 1],
-        [9, 1, 1, 1],
-        [9, 2, 1, 1],
-        [9, 3, 1, 1],
-        [9, 5, 1, 1],
-        [9, 0, 2, 2],
-        [9, 1, 2, 2],
-        [9, 2, 2, 2],
-        [9, 3, 2, 2],
-        [9, 5, 2, 2],
-        [9, 0, 3, 3],
-        [9, 1, 3, 3],
-        [9, 2, 3, 3],
-        [9, 3, 3, 3],
-        [9, 5, 3, 3],
-        [9, 0, 5, 5],
-        [9, 1, 5, 5],
-        [9, 2, 5, 5],
-        [9, 3, 5, 5],
-        [9, 5, 5, 5],
-    ]
-    for t in table_class:
-        final[(class_nii == t[0]) & (class_sii == t[1]) & (class_oi == t[2])] = t[3]
-    return final
+    return lookup_table(_lut_OiSiiNii, class_nii, class_sii, class_oi)
+
 
+# Key for final class: [class nii, class sii, class oi, final class]
+table_OiSiiNiiMine = [
+    [0, 0, 0, 0],
+    [0, 1, 0, 1],
+    [0, 2, 0, 2],
+    [0, 3, 0, 3],
+    [0, 5, 0, 5],
+    [0, 0, 1, 1],
+    [0, 1, 1, 1],
+    [0, 2, 1, 1],
+    [0, 3, 1, 1],
+    [0, 5, 1, 1],
+    [0, 0, 2, 2],
+    [0, 1, 2, 2],
+    [0, 2, 2, 2],
+    [0, 3, 2, 2],
+    [0, 5, 2, 2],
+    [0, 0, 3, 3],
+    [0, 1, 3, 3],
+    [0, 2, 3, 3],
+    [0, 3, 3, 3],
+    [0, 5, 3, 3],
+    [0, 0, 5, 5],
+    [0, 1, 5, 5],
+    [0, 2, 5, 2],
+    [0, 3, 5, 3],
+    [0, 5, 5, 5],
+    [1, 0, 0, 1],
+    [1, 1, 0, 1],
+    [1, 2, 0, 2],
+    [1, 3, 0, 3],
+    [1, 5, 0, 5],
+    [1, 0, 1, 1],
+    [1, 1, 1, 1],
+    [1, 2, 1, 1],
+    [1, 3, 1, 1],
+    [1, 5, 1, 1],
+    [1, 0, 2, 2],
+    [1, 1, 2, 2],
+    [1, 2, 2, 2],
+    [1, 3, 2, 2],
+    [1, 5, 2, 2],
+    [1, 0, 3, 3],
+    [1, 1, 3, 3],
+    [1, 2, 3, 3],
+    [1, 3, 3, 3],
+    [1, 5, 3, 3],
+    [1, 0, 5, 5],
+    [1, 1, 5, 5],
+    [1, 2, 5, 2],
+    [1, 3, 5, 3],
+    [1, 5, 5, 5],
+    [4, 0, 0, 4],
+    [4, 1, 0, 4],
+    [4, 2, 0, 2],
+    [4, 3, 0, 3],
+    [4, 5, 0, 5],
+    [4, 0, 1, 4],
+    [4, 1, 1, 4],
+    [4, 2, 1, 2],
+    [4, 3, 1, 3],
+    [4, 5, 1, 4],
+    [4, 0, 2, 2],
+    [4, 1, 2, 2],
+    [4, 2, 2, 2],
+    [4, 3, 2, 2],
+    [4, 5, 2, 2],
+    [4, 0, 3, 3],
+    [4, 1, 3, 3],
+    [4, 2, 3, 3],
+    [4, 3, 3, 3],
+    [4, 5, 3, 3],
+    [4, 0, 5, 5],
+    [4, 1, 5, 5],
+    [4, 2, 5, 2],
+    [4, 3, 5, 5],
+    [4, 5, 5, 5],
+    [5, 0, 0, 5],
+    [5, 1, 0, 1],
+    [5, 2, 0, 2],
+    [5, 3, 0, 3],
+    [5, 5, 0, 5],
+    [5, 0, 1, 1],
+    [5, 1, 1, 1],
+    [5, 2, 1, 1],
+    [5, 3, 1, 1],
+    [5, 5, 1, 5],
+    [5, 0, 2, 2],
+    [5, 1, 2, 2],
+    [5, 2, 2, 2],
+    [5, 3, 2, 2],
+    [5, 5, 2, 2],
+    [5, 0, 3, 3],
+    [5, 1, 3, 3],
+    [5, 2, 3, 3],
+    [5, 3, 3, 3],
+    [5, 5, 3, 3],
+    [5, 0, 5, 5],
+    [5, 1, 5, 5],
+    [5, 2, 5, 2],
+    [5, 3, 5, 3],
+    [5, 5, 5, 5],
+    [8, 0, 0, 8],
+    [8, 1, 0, 1],
+    [8, 2, 0, 2],
+    [8, 3, 0, 3],
+    [8, 5, 0, 5],
+    [8, 0, 1, 1],
+    [8, 1, 1, 1],
+    [8, 2, 1, 4],
+    [8, 3, 1, 4],
+    [8, 5, 1, 4],
+    [8, 0, 2, 2],
+    [8, 1, 2, 2],
+    [8, 2, 2, 2],
+    [8, 3, 2, 2],
+    [8, 5, 2, 2],
+    [8, 0, 3, 3],
+    [8, 1, 3, 3],
+    [8, 2, 3, 3],
+    [8, 3, 3, 3],
+    [8, 5, 3, 3],
+    [8, 0, 5, 5],
+    [8, 1, 5, 5],
+    [8, 2, 5, 5],
+    [8, 3, 5, 5],
+    [8, 5, 5, 5],
+    [9, 0, 0, 9],
+    [9, 1, 0, 4],
+    [9, 2, 0, 2],
+    [9, 3, 0, 3],
+    [9, 5, 0, 5],
+    [9, 0, 1, 1],
+    [9, 1, 1, 1],
+    [9, 2, 1, 1],
+    [9, 3, 1, 1],
+    [9, 5, 1, 1],
+    [9, 0, 2, 2],
+    [9, 1, 2, 2],
+    [9, 2, 2, 2],
+    [9, 3, 2, 2],
+    [9, 5, 2, 2],
+    [9, 0, 3, 3],
+    [9, 1, 3, 3],
+    [9, 2, 3, 3],
+    [9, 3, 3, 3],
+    [9, 5, 3, 3],
+    [9, 0, 5, 5],
+    [9, 1, 5, 5],
+    [9, 2, 5, 2],
+    [9, 3, 5, 3],
+    [9, 5, 5, 5],
+]
 
+
+@instrumented
+@array_kernel
 def diag_class_OiSiiNiiMine(class_nii, class_sii, class_oi):
     """
     Final classification. My criteria in November 2012.
@@ -743,167 +1111,167 @@ def diag_class_OiSiiNiiMine(class_nii, class_sii, class_oi):
     9 - TO or NLAGN
     10 - Seyfert 1 (not used here)
     """
-    final = np.zeros_like(class_sii)
-    # Common classification for SII and OI
-    # Key for sii oi class: [class sii, class oi, class sii oi]
-    table_class = [
-        [0, 0, 0, 0],
-        [0, 1, 0, 1],
-        [0, 2, 0, 2],
-        [0, 3, 0, 3],
-        [0, 5, 0, 5],
-        [0, 0, 1, 1],
-        [0, 1, 1, 1],
-        [0, 2, 1, 1],
-        [0, 3, 1, 1],
-        [0, 5, 1, 1],
-        [0, 0, 2, 2],
-        [0, 1, 2, 2],
-        [0, 2, 2, 2],
-        [0, 3, 2, 2],
-        [0, 5, 2, 2],
-        [0, 0, 3, 3],
-        [0, 1, 3, 3],
-        [0, 2, 3, 3],
-        [0, 3, 3, 3],
-        [0, 5, 3, 3],
-        [0, 0, 5, 5],
-        [0, 1, 5, 5],
-        [0, 2, 5, 2],
-        [0, 3, 5, 3],
-        [0, 5, 5, 5],
-        [1, 0, 0, 1],
-        [1, 1, 0, 1],
-        [1, 2, 0, 2],
-        [1, 3, 0, 3],
-        [1, 5, 0, 5],
-        [1, 0, 1, 1],
-        [1, 1, 1, 1],
-        [1, 2, 1, 1],
-        [1, 3, 1, 1],
-        [1, 5, 1, 1],
-        [1, 0, 2, 2],
-        [1, 1, 2, 2],
-        [1, 2, 2, 2],
-        [1, 3, 2, 2],
-        [1, 5, 2, 2],
-        [1, 0, 3, 3],
-        [1, 1, 3, 3],
-        [1, 2, 3, 3],
-        [1, 3, 3, 3],
-        [1, 5, 3, 3],
-        [1, 0, 5, 5],
-        [1, 1, 5, 5],
-        [1, 2, 5, 2],
-        [1, 3, 5, 3],
-        [1, 5, 5, 5],
-        [4, 0, 0, 4],
-        [4, 1, 0, 4],
-        [4, 2, 0, 2],
-        [4, 3, 0, 3],
-        [4, 5, 0, 5],
-        [4, 0, 1, 4],
-        [4, 1, 1, 4],
-        [4, 2, 1, 2],
-        [4, 3, 1, 3],
-        [4, 5, 1, 4],
-        [4, 0, 2, 2],
-        [4, 1, 2, 2],
-        [4, 2, 2, 2],
-        [4, 3, 2, 2],
-        [4, 5, 2, 2],
-        [4, 0, 3, 3],
-        [4, 1, 3, 3],
-        [4, 2, 3, 3],
-        [4, 3, 3, 3],
-        [4, 5, 3, 3],
-        [4, 0, 5, 5],
-        [4, 1, 5, 5],
-        [4, 2, 5, 2],
-        [4, 3, 5, 5],
-        [4, 5, 5, 5],
-        [5, 0, 0, 5],
-        [5, 1, 0, 1],
-        [5, 2, 0, 2],
-        [5, 3, 0, 3],
-        [5, 5, 0, 5],
-        [5, 0, 1, 1],
-        [5, 1, 1, 1],
-        [5, 2, 1, 1],
-        [5, 3, 1, 1],
-        [5, 5, 1, 5],
-        [5, 0, 2, 2],
-        [5, 1, 2, 2],
-        [5, 2, 2, 2],
-        [5, 3, 2, 2],
-        [5, 5, 2, 2],
-        [5, 0, 3, 3],
-        [5, 1, 3, 3],
-        [5, 2, 3, 3],
-        [5, 3, 3, 3],
-        [5, 5, 3, 3],
-        [5, 0, 5, 5],
-        [5, 1, 5, 5],
-        [5, 2, 5, 2],
-        [5, 3, 5, 3],
-        [5, 5, 5, 5],
-        [8, 0, 0, 8],
-        [8, 1, 0, 1],
-        [8, 2, 0, 2],
-        [8, 3, 0, 3],
-        [8, 5, 0, 5],
-        [8, 0, 1, 1],
-        [8, 1, 1, 1],
-        [8, 2, 1, 4],
-        [8, 3, 1, 4],
-        [8, 5, 1, 4],
-        [8, 0, 2, 2],
-        [8, 1, 2, 2],
-        [8, 2, 2, 2],
-        [8, 3, 2, 2],
-        [8, 5, 2, 2],
-        [8, 0, 3, 3],
-        [8, 1, 3, 3],
-        [8, 2, 3, 3],
-        [8, 3, 3, 3],
-        [8, 5, 3, 3],
-        [8, 0, 5, 5],
-        [8, 1, 5, 5],
-        [8, 2, 5, 5],
-        [8, 3, 5, 5],
-        [8, 5, 5, 5],
-        [9, 0, 0, 9],
-        [9, 1, 0, 4],
-        [9, 2, 0, 2],
-        [9, 3, 0, 3],
-        [9, 5, 0, 5],
-        [9, 0, 1, 1],
-        [9, 1, 1, 1],
-        [9, 2, 1, 1],
-        [9, 3, 1, 1],
-        [9, 5, 1, 1],
-        [9, 0, 2, 2],
-        [9, 1, 2, 2],
-        [9, 2, 2, 2],
-        [9, 3, 2, 2],
-        [9, 5, 2, 2],
-        [9, 0, 3, 3],
-        [9, 1, 3, 3],
-        [9, 2, 3, 3],
-        [9, 3, 3, 3],
-        [9, 5, 3, 3],
-        [9, 0, 5, 5],
-        [9, 1, 5, 5],
-        [9, 2, 5, 2],
-        [9, 3, 5, 3],
-        [9, 5, 5, 5],
-    ]
-    for t in table_class:
-        final[(class_nii == t[0]) & (class_sii == t[1]) & (class_oi == t[2])] = t[3]
-    return final
+    return lookup_table(_lut_OiSiiNiiMine, class_nii, class_sii, class_oi)
 
 
 # TEMPLATE for classifications
+# Key for final class: [class nii, class sii, class oi, final class]
+table_general = [
+    [0, 0, 0, 0],
+    [0, 1, 0, 0],
+    [0, 2, 0, 0],
+    [0, 3, 0, 0],
+    [0, 5, 0, 0],
+    [0, 0, 1, 0],
+    [0, 1, 1, 0],
+    [0, 2, 1, 0],
+    [0, 3, 1, 0],
+    [0, 5, 1, 0],
+    [0, 0, 2, 0],
+    [0, 1, 2, 0],
+    [0, 2, 2, 0],
+    [0, 3, 2, 0],
+    [0, 5, 2, 0],
+    [0, 0, 3, 0],
+    [0, 1, 3, 0],
+    [0, 2, 3, 0],
+    [0, 3, 3, 0],
+    [0, 5, 3, 0],
+    [0, 0, 5, 0],
+    [0, 1, 5, 0],
+    [0, 2, 5, 0],
+    [0, 3, 5, 0],
+    [0, 5, 5, 0],
+    [1, 0, 0, 0],
+    [1, 1, 0, 0],
+    [1, 2, 0, 0],
+    [1, 3, 0, 0],
+    [1, 5, 0, 0],
+    [1, 0, 1, 0],
+    [1, 1, 1, 0],
+    [1, 2, 1, 0],
+    [1, 3, 1, 0],
+    [1, 5, 1, 0],
+    [1, 0, 2, 0],
+    [1, 1, 2, 0],
+    [1, 2, 2, 0],
+    [1, 3, 2, 0],
+    [1, 5, 2, 0],
+    [1, 0, 3, 0],
+    [1, 1, 3, 0],
+    [1, 2, 3, 0],
+    [1, 3, 3, 0],
+    [1, 5, 3, 0],
+    [1, 0, 5, 0],
+    [1, 1, 5, 0],
+    [1, 2, 5, 0],
+    [1, 3, 5, 0],
+    [1, 5, 5, 0],
+    [4, 0, 0, 0],
+    [4, 1, 0, 0],
+    [4, 2, 0, 0],
+    [4, 3, 0, 0],
+    [4, 5, 0, 0],
+    [4, 0, 1, 0],
+    [4, 1, 1, 0],
+    [4, 2, 1, 0],
+    [4, 3, 1, 0],
+    [4, 5, 1, 0],
+    [4, 0, 2, 0],
+    [4, 1, 2, 0],
+    [4, 2, 2, 0],
+    [4, 3, 2, 0],
+    [4, 5, 2, 0],
+    [4, 0, 3, 0],
+    [4, 1, 3, 0],
+    [4, 2, 3, 0],
+    [4, 3, 3, 0],
+    [4, 5, 3, 0],
+    [4, 0, 5, 0],
+    [4, 1, 5, 0],
+    [4, 2, 5, 0],
+    [4, 3, 5, 0],
+    [4, 5, 5, 0],
+    [5, 0, 0, 0],
+    [5, 1, 0, 0],
+    [5, 2, 0, 0],
+    [5, 3, 0, 0],
+    [5, 5, 0, 0],
+    [5, 0, 1, 0],
+    [5, 1, 1, 0],
+    [5, 2, 1, 0],
+    [5, 3, 1, 0],
+    [5, 5, 1, 0],
+    [5, 0, 2, 0],
+    [5, 1, 2, 0],
+    [5, 2, 2, 0],
+    [5, 3, 2, 0],
+    [5, 5, 2, 0],
+    [5, 0, 3, 0],
+    [5, 1, 3, 0],
+    [5, 2, 3, 0],
+    [5, 3, 3, 0],
+    [5, 5, 3, 0],
+    [5, 0, 5, 0],
+    [5, 1, 5, 0],
+    [5, 2, 5, 0],
+    [5, 3, 5, 0],
+    [5, 5, 5, 0],
+    [8, 0, 0, 0],
+    [8, 1, 0, 0],
+    [8, 2, 0, 0],
+    [8, 3, 0, 0],
+    [8, 5, 0, 0],
+    [8, 0, 1, 0],
+    [8, 1, 1, 0],
+    [8, 2, 1, 0],
+    [8, 3, 1, 0],
+    [8, 5, 1, 0],
+    [8, 0, 2, 0],
+    [8, 1, 2, 0],
+    [8, 2, 2, 0],
+    [8, 3, 2, 0],
+    [8, 5, 2, 0],
+    [8, 0, 3, 0],
+    [8, 1, 3, 0],
+    [8, 2, 3, 0],
+    [8, 3, 3, 0],
+    [8, 5, 3, 0],
+    [8, 0, 5, 0],
+    [8, 1, 5, 0],
+    [8, 2, 5, 0],
+    [8, 3, 5, 0],
+    [8, 5, 5, 0],
+    [9, 0, 0, 0],
+    [9, 1, 0, 0],
+    [9, 2, 0, 0],
+    [9, 3, 0, 0],
+    [9, 5, 0, 0],
+    [9, 0, 1, 0],
+    [9, 1, 1, 0],
+    [9, 2, 1, 0],
+    [9, 3, 1, 0],
+    [9, 5, 1, 0],
+    [9, 0, 2, 0],
+    [9, 1, 2, 0],
+    [9, 2, 2, 0],
+    [9, 3, 2, 0],
+    [9, 5, 2, 0],
+    [9, 0, 3, 0],
+    [9, 1, 3, 0],
+    [9, 2, 3, 0],
+    [9, 3, 3, 0],
+    [9, 5, 3, 0],
+    [9, 0, 5, 0],
+    [9, 1, 5, 0],
+    [9, 2, 5, 0],
+    [9, 3, 5, 0],
+    [9, 5, 5, 0],
+]
+
+
+@instrumented
+@array_kernel
 def diag_class_general(class_nii, class_sii, class_oi):
     """
     Final classification
@@ -918,165 +1286,7 @@ def diag_class_general(class_nii, class_sii, class_oi):
     9 - TO or NLAGN
     10 - Seyfert 1 (not used here)
     """
-    final = np.zeros_like(class_sii)
-    # Common classification for SII and OI
-    # Key for sii oi class: [class sii, class oi, class sii oi]
-    table_class = [
-        [0, 0, 0, 0],
-        [0, 1, 0, 0],
-        [0, 2, 0, 0],
-        [0, 3, 0, 0],
-        [0, 5, 0, 0],
-        [0, 0, 1, 0],
-        [0, 1, 1, 0],
-        [0, 2, 1, 0],
-        [0, 3, 1, 0],
-        [0, 5, 1, 0],
-        [0, 0, 2, 0],
-        [0, 1, 2, 0],
-        [0, 2, 2, 0],
-        [0, 3, 2, 0],
-        [0, 5, 2, 0],
-        [0, 0, 3, 0],
-        [0, 1, 3, 0],
-        [0, 2, 3, 0],
-        [0, 3, 3, 0],
-        [0, 5, 3, 0],
-        [0, 0, 5, 0],
-        [0, 1, 5, 0],
-        [0, 2, 5, 0],
-        [0, 3, 5, 0],
-        [0, 5, 5, 0],
-        [1, 0, 0, 0],
-        [1, 1, 0, 0],
-        [1, 2, 0, 0],
-        [1, 3, 0, 0],
-        [1, 5, 0, 0],
-        [1, 0, 1, 0],
-        [1, 1, 1, 0],
-        [1, 2, 1, 0],
-        [1, 3, 1, 0],
-        [1, 5, 1, 0],
-        [1, 0, 2, 0],
-        [1, 1, 2, 0],
-        [1, 2, 2, 0],
-        [1, 3, 2, 0],
-        [1, 5, 2, 0],
-        [1, 0, 3, 0],
-        [1, 1, 3, 0],
-        [1, 2, 3, 0],
-        [1, 3, 3, 0],
-        [1, 5, 3, 0],
-        [1, 0, 5, 0],
-        [1, 1, 5, 0],
-        [1, 2, 5, 0],
-        [1, 3, 5, 0],
-        [1, 5, 5, 0],
-        [4, 0, 0, 0],
-        [4, 1, 0, 0],
-        [4, 2, 0, 0],
-        [4, 3, 0, 0],
-        [4, 5, 0, 0],
-        [4, 0, 1, 0],
-        [4, 1, 1, 0],
-        [4, 2, 1, 0],
-        [4, 3, 1, 0],
-        [4, 5, 1, 0],
-        [4, 0, 2, 0],
-        [4, 1, 2, 0],
-        [4, 2, 2, 0],
-        [4, 3, 2, 0],
-        [4, 5, 2, 0],
-        [4, 0, 3, 0],
-        [4, 1, 3, 0],
-        [4, 2, 3, 0],
-        [4, 3, 3, 0],
-        [4, 5, 3, 0],
-        [4, 0, 5, 0],
-        [4, 1, 5, 0],
-        [4, 2, 5, 0],
-        [4, 3, 5, 0],
-        [4, 5, 5, 0],
-        [5, 0, 0, 0],
-        [5, 1, 0, 0],
-        [5, 2, 0, 0],
-        [5, 3, 0, 0],
-        [5, 5, 0, 0],
-        [5, 0, 1, 0],
-        [5, 1, 1, 0],
-        [5, 2, 1, 0],
-        [5, 3, 1, 0],
-        [5, 5, 1, 0],
-        [5, 0, 2, 0],
-        [5, 1, 2, 0],
-        [5, 2, 2, 0],
-        [5, 3, 2, 0],
-        [5, 5, 2, 0],
-        [5, 0, 3, 0],
-        [5, 1, 3, 0],
-        [5, 2, 3, 0],
-        [5, 3, 3, 0],
-        [5, 5, 3, 0],
-        [5, 0, 5, 0],
-        [5, 1, 5, 0],
-        [5, 2, 5, 0],
-        [5, 3, 5, 0],
-        [5, 5, 5, 0],
-        [8, 0, 0, 0],
-        [8, 1, 0, 0],
-        [8, 2, 0, 0],
-        [8, 3, 0, 0],
-        [8, 5, 0, 0],
-        [8, 0, 1, 0],
-        [8, 1, 1, 0],
-        [8, 2, 1, 0],
-        [8, 3, 1, 0],
-        [8, 5, 1, 0],
-        [8, 0, 2, 0],
-        [8, 1, 2, 0],
-        [8, 2, 2, 0],
-        [8, 3, 2, 0],
-        [8, 5, 2, 0],
-        [8, 0, 3, 0],
-        [8, 1, 3, 0],
-        [8, 2, 3, 0],
-        [8, 3, 3, 0],
-        [8, 5, 3, 0],
-        [8, 0, 5, 0],
-        [8, 1, 5, 0],
-        [8, 2, 5, 0],
-        [8, 3, 5, 0],
-        [8, 5, 5, 0],
-        [9, 0, 0, 0],
-        [9, 1, 0, 0],
-        [9, 2, 0, 0],
-        [9, 3, 0, 0],
-        [9, 5, 0, 0],
-        [9, 0, 1, 0],
-        [9, 1, 1, 0],
-        [9, 2, 1, 0],
-        [9, 3, 1, 0],
-        [9, 5, 1, 0],
-        [9, 0, 2, 0],
-        [9, 1, 2, 0],
-        [9, 2, 2, 0],
-        [9, 3, 2, 0],
-        [9, 5, 2, 0],
-        [9, 0, 3, 0],
-        [9, 1, 3, 0],
-        [9, 2, 3, 0],
-        [9, 3, 3, 0],
-        [9, 5, 3, 0],
-        [9, 0, 5, 0],
-        [9, 1, 5, 0],
-        [9, 2, 5, 0],
-        [9, 3, 5, 0],
-        [9, 5, 5, 0],
-    ]
-
-    for t in table_class:
-        final[(class_nii == t[0]) & (class_sii == t[1]) & (class_oi == t[2])] = t[3]
-    return final
+    return lookup_table(_lut_general, class_nii, class_sii, class_oi)
 
 
 # ----------------------------#
@@ -1084,9 +1294,150 @@ def diag_class_general(class_nii, class_sii, class_oi):
 # ----------------------------#
 
 
-def diag_CidFernandes2011(x, c_x, ew_ha, c_ew_ha, ew_nii, c_ew_nii, use_limits=False):
+# Rules of Cid-Fernandes et al. 2011:
+# [function of (x, c_x, ew_ha, c_ew_ha, ew_nii, c_ew_nii), code]
+rules_CidFernandes2011 = [
+    [
+        lambda x, c_x, ew_ha, c_ew_ha, ew_nii, c_ew_nii: (
+            (ew_ha < 0.5) | (ew_nii < 0.5)
+        ),
+        7,
+    ],  # Passive galaxy
+    [
+        lambda x, c_x, ew_ha, c_ew_ha, ew_nii, c_ew_nii: (
+            (ew_ha >= 0.5) & (ew_nii >= 0.5) & (ew_ha < 3)
+        ),
+        6,
+    ],  # RG
+    [
+        lambda x, c_x, ew_ha, c_ew_ha, ew_nii, c_ew_nii: (
+            (ew_ha >= 3) & (ew_nii >= 0.5) & (x <= -0.4)
+        ),
+        1,
+    ],  # SFN
+    [
+        lambda x, c_x, ew_ha, c_ew_ha, ew_nii, c_ew_nii: (
+            (ew_ha >= 3) & (ew_nii >= 0.5) & (x > -0.4) & (ew_ha < 6)
+        ),
+        3,
+    ],  # wAGN
+    [
+        lambda x, c_x, ew_ha, c_ew_ha, ew_nii, c_ew_nii: (
+            (ew_ha >= 6) & (ew_nii >= 0.5) & (x > -0.4)
+        ),
+        2,
+    ],  # sAGN
+]
+# Additional rules of Cid-Fernandes et al. 2011 for the limits
+rules_CidFernandes2011_limits = [
+    [
+        lambda x, c_x, ew_ha, c_ew_ha, ew_nii, c_ew_nii: (
+            (
+                ((c_x == 1) & (c_ew_ha == 0))
+                | ((c_x == 1) & (c_ew_ha == 2))
+                | ((c_x == 0) & (c_ew_ha == 2))
+            )
+            & ((ew_ha >= 3) & (ew_nii >= 0.5) & (x <= -0.4))
+        ),
+        1,
+    ],  # SFN (x<;y+ or x<;y^ or x+;y^)
+    [
+        lambda x, c_x, ew_ha, c_ew_ha, ew_nii, c_ew_nii: (
+            (
+                ((c_x == 2) & (c_ew_ha == 0))
+                | ((c_x == 2) & (c_ew_ha == 2))
+                | ((c_x == 0) & (c_ew_ha == 2))
+            )
+            & ((ew_ha >= 6) & (ew_nii >= 0.5) & (x > -0.4))
+        ),
+        2,
+    ],  # sAGN (x>;y+ or x>;y^ or x+;y^)
+    [
+        lambda x, c_x, ew_ha, c_ew_ha, ew_nii, c_ew_nii: (
+            (((c_x == 2) & (c_ew_ha == 0)))
+            & ((ew_ha >= 3) & (ew_nii >= 0.5) & (x > -0.4) & (ew_ha < 6))
+        ),
+        3,
+    ],  # wAGN (x>;y+)
+    [
+        lambda x, c_x, ew_ha, c_ew_ha, ew_nii, c_ew_nii: (
+            (((c_x == 2) & (c_ew_ha == 2)) | ((c_x == 0) & (c_ew_ha == 2)))
+            & ((ew_ha >= 3) & (ew_nii >= 0.5) & (x > -0.4) & (ew_ha < 6))
+        ),
+        5,
+    ],  # AGN (x>;y^ or x+;y^)
+    [
+        lambda x, c_x, ew_ha, c_ew_ha, ew_nii, c_ew_nii: (
+            (((c_x == 0) & (c_ew_ha == 1)) | ((c_x == 0) & (c_ew_ha == 1)))
+            & ((ew_ha >= 3) & (ew_nii >= 0.5) & (x > -0.4) & (ew_ha < 6))
+        ),
+        0,
+    ],  # wAGN or passive NOT USED
+    [
+        lambda x, c_x, ew_ha, c_ew_ha, ew_nii, c_ew_nii: (
+            (((c_x == 2) & (c_ew_ha == 0)))
+            & ((ew_ha >= 0.5) & (ew_nii >= 0.5) & (ew_ha < 3))
+        ),
+        6,
+    ],  # RG (x>;y+)
+    [
+        lambda x, c_x, ew_ha, c_ew_ha, ew_nii, c_ew_nii: (
+            (((c_x == 1) & (c_ew_ha == 0)) | ((c_x == 1) & (c_ew_ha == 1)))
+            & ((ew_ha < 0.5) | (ew_nii < 0.5))
+        ),
+        7,
+    ],  # PG (x<;y+ or x<;yv)
+    [
+        lambda x, c_x, ew_ha, c_ew_ha, ew_nii, c_ew_nii: (
+            (((c_x == 0) & (c_ew_ha == 1)) | ((c_x == 2) & (c_ew_ha == 1)))
+            & (
+                ((ew_ha < 0.5) | (ew_nii < 0.5))
+                | ((ew_ha >= 0.5) & (ew_nii >= 0.5) & (ew_ha < 3))
+            )
+        ),
+        0,
+    ],  # RG or PG NOT USED
+]
+# Terms of the demarcation lines used by the rules:
+# [function of (x, ew_ha, ew_nii), threshold, side of the threshold that is closed]
+terms_CidFernandes2011 = [
+    [lambda x, ew_ha, ew_nii: x, -0.4, "low"],
+    [lambda x, ew_ha, ew_nii: ew_ha, 0.5, "high"],
+    [lambda x, ew_ha, ew_nii: ew_ha, 3.0, "high"],
+    [lambda x, ew_ha, ew_nii: ew_ha, 6.0, "high"],
+    [lambda x, ew_ha, ew_nii: ew_nii, 0.5, "high"],
+]
+
+
+def _arguments_CidFernandes2011(x, ew_ha, ew_nii, c_x, c_ew_ha, c_ew_nii):
+    """
+    Arguments of the rules from the values and the detection codes.
+    """
+    return x, c_x, ew_ha, c_ew_ha, ew_nii, c_ew_nii
+
+
+@instrumented
+@array_kernel
+def diag_CidFernandes2011(
+    x,
+    c_x,
+    ew_ha,
+    c_ew_ha,
+    ew_nii,
+    c_ew_nii,
+    use_limits=False,
+    e_x=None,
+    e_ew_ha=None,
+    e_ew_nii=None,
+    n_threads=1,
+    block_size=None,
+):
     """
     Apply the diagnostic criterion of Cid-Fernandes et al. 2011
+    If the errors of x, ew_ha and ew_nii are given, the signed distance in
+    sigma units to the nearest demarcation line (see boundary_distance) is
+    returned as a third output. The blocks of block_size elements (default
+    default_block_size) are evaluated by n_threads threads.
     Codes:
     0 - Unclassified
     1 - SFN
@@ -1100,76 +1451,38 @@ def diag_CidFernandes2011(x, c_x, ew_ha, c_ew_ha, ew_nii, c_ew_nii, use_limits=F
     9 - TO or NLAGN (not used here)
     10 - Seyfert 1 (not used here)
     """
-    conditions = [
-        [((ew_ha < 0.5) | (ew_nii < 0.5)), 7],  # Passive galaxy
-        [((ew_ha >= 0.5) & (ew_nii >= 0.5) & (ew_ha < 3)), 6],  # RG
-        [((ew_ha >= 3) & (ew_nii >= 0.5) & (x <= -0.4)), 1],  # SFN
-        [((ew_ha >= 3) & (ew_nii >= 0.5) & (x > -0.4) & (ew_ha < 6)), 3],  # wAGN
-        [((ew_ha >= 6) & (ew_nii >= 0.5) & (x > -0.4)), 2],
-    ]  # sAGN
+    arrays = [np.asarray(a) for a in (x, c_x, ew_ha, c_ew_ha, ew_nii, c_ew_nii)]
     if not use_limits:
-        cond_init = (
-            (c_x == 0) & (c_ew_ha == 0) & (c_ew_nii == 0)
-        )  # Only detections in the ratio and all the good EW
+        # Only detections in the ratio and all the good EW
+        diag, c_diag = evaluate_rules(
+            lambda x, c_x, ew_ha, c_ew_ha, ew_nii, c_ew_nii: (
+                (c_x == 0) & (c_ew_ha == 0) & (c_ew_nii == 0)
+            ),
+            rules_CidFernandes2011,
+            *arrays,
+            block_size=block_size,
+            n_threads=n_threads
+        )
     else:
-        cond_init = (
-            (c_x >= 0) & (c_ew_ha >= 0) & (c_ew_nii >= 0)
-        )  # Only well defined lines
-        conditions_lim = [
-            [
-                (
-                    ((c_x == 1) & (c_ew_ha == 0))
-                    | ((c_x == 1) & (c_ew_ha == 2))
-                    | ((c_x == 0) & (c_ew_ha == 2))
-                )
-                & ((ew_ha >= 3) & (ew_nii >= 0.5) & (x <= -0.4)),
-                1,
-            ],  # SFN (x<;y+ or x<;y^ or x+;y^)
-            [
-                (
-                    ((c_x == 2) & (c_ew_ha == 0))
-                    | ((c_x == 2) & (c_ew_ha == 2))
-                    | ((c_x == 0) & (c_ew_ha == 2))
-                )
-                & ((ew_ha >= 6) & (ew_nii >= 0.5) & (x > -0.4)),
-                2,
-            ],  # sAGN (x>;y+ or x>;y^ or x+;y^)
-            [
-                (((c_x == 2) & (c_ew_ha == 0)))
-                & ((ew_ha >= 3) & (ew_nii >= 0.5) & (x > -0.4) & (ew_ha < 6)),
-                3,
-            ],  # wAGN (x>;y+)
-            [
-                (((c_x == 2) & (c_ew_ha == 2)) | ((c_x == 0) & (c_ew_ha == 2)))
-                & ((ew_ha >= 3) & (ew_nii >= 0.5) & (x > -0.4) & (ew_ha < 6)),
-                5,
-            ],  # AGN (x>;y^ or x+;y^)
-            [
-                (((c_x == 0) & (c_ew_ha == 1)) | ((c_x == 0) & (c_ew_ha == 1)))
-                & ((ew_ha >= 3) & (ew_nii >= 0.5) & (x > -0.4) & (ew_ha < 6)),
-                0,
-            ],  # wAGN or passive NOT USED
-            [
-                (((c_x == 2) & (c_ew_ha == 0)))
-                & ((ew_ha >= 0.5) & (ew_nii >= 0.5) & (ew_ha < 3)),
-                6,
-            ],  # RG (x>;y+)
-            [
-                (((c_x == 1) & (c_ew_ha == 0)) | ((c_x == 1) & (c_ew_ha == 1)))
-                & ((ew_ha < 0.5) | (ew_nii < 0.5)),
-                7,
-            ],  # PG (x<;y+ or x<;yv)
-            [
-                (((c_x == 0) & (c_ew_ha == 1)) | ((c_x == 2) & (c_ew_ha == 1)))
-                & (
-                    ((ew_ha < 0.5) | (ew_nii < 0.5))
-                    | ((ew_ha >= 0.5) & (ew_nii >= 0.5) & (ew_ha < 3))
-                ),
-                0,
-            ],
-        ]  # RG or PG NOT USED
-        conditions.append(conditions_lim)
-    return apply_conditions(cond_init, conditions)
+        # Only well defined lines
+        diag, c_diag = evaluate_code_regions(
+            _limits_CidFernandes2011,
+            arrays[::2],
+            arrays[1::2],
+            block_size=block_size,
+            n_threads=n_threads,
+        )
+    if e_x is None or e_ew_ha is None or e_ew_nii is None:
+        return diag, c_diag
+    distance = boundary_distance(
+        _regions_CidFernandes2011,
+        arrays[::2],
+        [np.asarray(e) for e in (e_x, e_ew_ha, e_ew_nii)],
+        block_size=block_size,
+        n_threads=n_threads,
+    )
+    distance[c_diag == 0] = np.nan
+    return diag, c_diag, distance
 
 
 #######################
@@ -1180,12 +1493,12 @@ def diag_CidFernandes2011(x, c_x, ew_ha, c_ew_ha, ew_nii, c_ew_nii, use_limits=F
 def numpy_arrays4(x, y, xx, yy):
     """
     Transform 4 values, tuples or lists into 4 numpy arrays.
-    Useful for entering values for testing.
+    Useful for entering values for testing. The arrays are not copied.
     """
-    x = np.array(x)
-    y = np.array(y)
-    xx = np.array(xx)
-    yy = np.array(yy)
+    x = np.asarray(x)
+    y = np.asarray(y)
+    xx = np.asarray(xx)
+    yy = np.asarray(yy)
     return x, y, xx, yy
 
 
@@ -1199,6 +1512,762 @@ def apply_conditions(cond_init, conditions):
     diag = np.zeros(len(cond_init), dtype="i")
     c_diag = np.zeros(len(cond_init), dtype="i")
     for cond, typec in conditions:
-        diag[cond_init & cond] = typec
-        c_diag[cond_init & cond] = 1
+        cond = cond_init & cond
+        diag[cond] = typec
+        c_diag[cond] = 1
     return diag, c_diag
+
+
+def evaluate_rules(cond_init, rules, *arrays, block_size=None, n_threads=1):
+    """
+    Evaluate a list of rules in blocks of elements.
+    Input:
+      cond_init - function of the arrays selecting the elements that can be classified
+      rules - list of [function of the arrays returning a mask, code]
+      arrays - input arrays, all of the same length
+      block_size - number of elements evaluated at a time (default
+                   default_block_size)
+      n_threads - number of threads evaluating blocks (see for_blocks)
+    Output (as apply_conditions):
+      diag - diagnostic code; the last rule matching an element wins
+      c_diag - code indicating if the diagnostic was applied to an element 1 or 0.
+    Only one mask of block_size elements is alive at a time per thread, so
+    the memory used besides the output does not depend on the number of
+    elements. The index of the last matching rule is kept in a small integer
+    buffer of each thread and converted to diag and c_diag once per block.
+    """
+    n = len(arrays[0])
+    diag = np.zeros(n, dtype="i")
+    c_diag = np.zeros(n, dtype="i")
+    codes = np.array([0] + [code for rule, code in rules], dtype="i")
+    applied = np.array([0] + [1] * len(rules), dtype="i")
+    winner_type = np.min_scalar_type(len(rules))
+
+    def evaluate_block(start, stop, scratch):
+        block = [a[start:stop] for a in arrays]
+        init = cond_init(*block)
+        win = _scratch(scratch, "winner", stop - start, winner_type)
+        win[:] = 0
+        for i, (rule, code) in enumerate(rules, 1):
+            cond = rule(*block)
+            cond &= init
+            np.copyto(win, i, where=cond)
+        codes.take(win, out=diag[start:stop])
+        applied.take(win, out=c_diag[start:stop])
+
+    for_blocks(evaluate_block, n, block_size, n_threads)
+    return diag, c_diag
+
+
+def for_blocks(function, n, block_size=None, n_threads=1):
+    """
+    Call function(start, stop, scratch) for the blocks of block_size of n
+    elements, where scratch is a dictionary of buffers reused by the blocks
+    evaluated in the same thread.
+    With n_threads > 1 the blocks are evaluated by a pool of threads: the
+    numpy operations release the GIL, so the blocks run in parallel without
+    copying the inputs. The blocks must write disjoint parts of the outputs.
+    The floating point error handling of the caller is used in the threads.
+    """
+    if block_size is None:
+        block_size = default_block_size
+    starts = range(0, n, block_size)
+    if n_threads == 1 or len(starts) <= 1:
+        scratch = {}
+        for start in starts:
+            function(start, min(start + block_size, n), scratch)
+        return
+    errors = np.geterr()
+    local = threading.local()
+
+    def run(start):
+        if not hasattr(local, "scratch"):
+            local.scratch = {}
+        with np.errstate(**errors):
+            function(start, min(start + block_size, n), local.scratch)
+
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        list(pool.map(run, starts))
+
+
+def _scratch(scratch, name, size, dtype):
+    """
+    Buffer of at least 'size' elements from a dictionary of scratch buffers.
+    """
+    buffer = scratch.get(name)
+    if buffer is None or len(buffer) < size or buffer.dtype != dtype:
+        buffer = scratch[name] = np.empty(size, dtype=dtype)
+    return buffer[:size]
+
+
+def region_ids(terms, *values, grid=None):
+    """
+    Region of the diagram of each element.
+    Input:
+      terms - list of [function of the values, threshold, closed side]
+      values - coordinates in the diagram (e.g. x, y)
+      grid - optional grid from compile_region_grid (two values only)
+    Output:
+      region - sum of state * 3**i for the terms i, where the state is 0 on
+               the low side of the threshold, 1 on the high side and 2 if
+               the term is NaN (no comparison is true)
+    With a grid, the region of float32 and float64 elements is looked up in
+    the cell that contains them and only the elements in cells crossed by
+    a demarcation curve, outside of the grid or non finite are evaluated
+    exactly.
+    """
+    if grid is not None and all(v.dtype in _grid_types for v in values):
+        x, y = values
+        x_origin, x_scale, y_origin, y_scale, cells = grid
+        index = _grid_index(x, x_origin, x_scale, cells.shape[0])
+        index *= cells.shape[1]
+        index += _grid_index(y, y_origin, y_scale, cells.shape[1])
+        region = cells.take(index)
+        exact = np.flatnonzero(region < 0)
+        if len(exact):
+            region[exact] = region_ids(terms, x[exact], y[exact])
+        return region
+    dtype = np.int8 if 3 ** len(terms) <= 128 else np.int16
+    region = np.zeros(len(values[0]), dtype=dtype)
+    for i, (function, threshold, closed) in enumerate(terms):
+        value = function(*values)
+        if closed == "high":
+            high, low = value >= threshold, value < threshold
+        else:
+            high, low = value > threshold, value <= threshold
+        region += dtype(2 * 3**i)
+        region -= low.view(np.int8) * dtype(2 * 3**i)
+        region -= high.view(np.int8) * dtype(3**i)
+    return region
+
+
+def _grid_index(x, origin, scale, n):
+    """
+    Index of the cells of a grid axis. The first and the last cells collect
+    the elements outside of the grid and the NaN values.
+    """
+    index = x - origin
+    index *= scale
+    np.fmax(index, 0, out=index)
+    np.minimum(index, n - 1, out=index)
+    return index.astype(np.intp)
+
+
+def compile_region_grid(
+    terms, x_range=(-3.0, 2.0), y_range=(-2.0, 2.0), shape=(512, 512)
+):
+    """
+    Grid of the regions of a diagram for region_ids.
+    A cell gets a region only if every term is beyond its threshold, by a
+    margin that covers float32 rounding errors, in the cell enlarged by 1%
+    of its size. The terms are linear or bilinear, so their extremes in a
+    cell are found at the corners. The other cells, and a border of cells
+    for the elements outside of the grid, get -1 (exact evaluation).
+    """
+    (x0, x1), (y0, y1), (nx, ny) = x_range, y_range, shape
+    dx, dy = (x1 - x0) / nx, (y1 - y0) / ny
+    x_edges = x0 + dx * np.arange(nx + 1)
+    y_edges = y0 + dy * np.arange(ny + 1)
+    corners = [
+        np.meshgrid(
+            x_edges[a:][:nx] + sx * dx, y_edges[b:][:ny] + sy * dy, indexing="ij"
+        )
+        for a, sx in [(0, -0.01), (1, 0.01)]
+        for b, sy in [(0, -0.01), (1, 0.01)]
+    ]
+    region = np.zeros(shape, dtype=np.int8)
+    pure = np.ones(shape, dtype=bool)
+    for i, (function, threshold, closed) in enumerate(terms):
+        with np.errstate(invalid="ignore"):
+            values = [function(x, y) for x, y in corners]
+        margin = 1e-4 * max(1.0, abs(threshold))
+        high = np.minimum.reduce(values) > threshold + margin
+        low = np.maximum.reduce(values) < threshold - margin
+        pure &= high | low
+        region += high.astype(np.int8) * np.int8(3**i)
+    cells = np.full((nx + 2, ny + 2), -1, dtype=np.int8)
+    cells[1:-1, 1:-1] = np.where(pure, region, -1)
+    return x0 - dx, 1.0 / dx, y0 - dy, 1.0 / dy, cells
+
+
+def compile_regions(terms, rules, arguments=None, grid=True):
+    """
+    Classification of the detections in each region of a diagram.
+    Input:
+      terms - list of [function of the values, threshold, closed side]
+      rules - rules of the detections
+      arguments - function of the values followed by the detection codes
+                  returning the arguments of the rules (default: the same
+                  order, e.g. x, y, c_x, c_y)
+      grid - compile a grid for region_ids (two values only)
+    The rules are evaluated on sample points (a grid with the constants of
+    the terms, infinities and NaN) and the result of each region is
+    tabulated. Regions without sample points get -1 and are evaluated with
+    the rules. A region with two different results means that the terms do
+    not describe the rules and raises ValueError.
+    Returns a dictionary for evaluate_regions.
+    """
+    if arguments is None:
+        arguments = lambda *a: a
+    n_values = terms[0][0].__code__.co_argcount
+    n_codes = rules[0][0].__code__.co_argcount - n_values
+    constants = [float(threshold) for function, threshold, closed in terms]
+    for function, threshold, closed in terms:
+        constants += [c for c in function.__code__.co_consts if isinstance(c, float)]
+    values = np.concatenate(
+        [
+            np.linspace(-4.0, 3.0, 701) if n_values == 2 else np.linspace(-4, 10, 57),
+            constants,
+            np.negative(constants),
+            [np.inf, -np.inf, np.nan],
+        ]
+    )
+    values = [v.ravel() for v in np.meshgrid(*[values] * n_values)]
+    codes = np.zeros(len(values[0]), dtype=int)
+    everything = lambda *a: np.ones(len(a[0]), dtype=bool)
+    with np.errstate(invalid="ignore"):
+        diag, c_diag = evaluate_rules(
+            everything, rules, *arguments(*values, *[codes] * n_codes)
+        )
+        region = region_ids(terms, *values)
+    # diag and c_diag packed in one small integer (-1 if unknown)
+    table = np.full(3 ** len(terms), -1, dtype=np.int8)
+    table[region] = 2 * diag + c_diag
+    if (table[region] != 2 * diag + c_diag).any():
+        raise ValueError("The terms do not match the rules")
+    # Up to region_samples sample points of each region, evenly spaced
+    order = np.argsort(region, kind="stable")
+    ordered = region[order]
+    rank = np.arange(len(order)) - np.searchsorted(ordered, ordered)
+    step = np.maximum(np.bincount(region)[ordered] // region_samples, 1)
+    samples = order[(rank % step == 0) & (rank // step < region_samples)]
+    # Regions where crossing a set of terms (one, or several at the corners)
+    # changes the class; crossings into the regions without sample points
+    # are impossible
+    region = np.arange(len(table))
+    crossings = []
+    for n_crossed in range(1, len(terms) + 1):
+        for crossed in itertools.combinations(range(len(terms)), n_crossed):
+            flipped = region.copy()
+            possible = np.ones(len(region), dtype=bool)
+            for i in crossed:
+                state = region // 3**i % 3
+                flipped += np.where(state == 0, 3**i, -(3**i))
+                possible &= state != 2
+            flipped = table[np.where(possible, flipped, region)]
+            changed = possible & (flipped != table) & (flipped != -1)
+            if changed.any():
+                crossings.append((crossed, changed))
+    # Gradients of the straight lines
+    gradients = []
+    for function, threshold, closed in terms:
+        gradient = _gradient(function, [np.array([-1.5, 0.0, 2.0])] * n_values)
+        constant = all(np.allclose(g, g[1], rtol=1e-12, atol=0) for g in gradient)
+        gradients.append(tuple(float(g[1]) for g in gradient) if constant else None)
+    return {
+        "terms": terms,
+        "gradients": gradients,
+        "crossings": crossings,
+        "grid": compile_region_grid(terms) if grid and n_values == 2 else None,
+        "table": table,
+        "rules": rules,
+        "samples": [v[samples] for v in values],
+    }
+
+
+def compile_code_regions(regions, cond_init, rules, arguments=None):
+    """
+    Classification of each combination of detection codes in each region of
+    a diagram (the decision table of the classification with limits).
+    Input:
+      regions - output of compile_regions for the terms of the diagram
+      cond_init - function of the arguments of the rules selecting the
+                  elements that can be classified
+      rules - rules of the detections and limits
+      arguments - as in compile_regions
+    The rules are evaluated on the sample points of each region with every
+    combination of detection slots (see detection_slots) and the results
+    are tabulated as in compile_regions. A result that changes inside a
+    region raises ValueError.
+    Returns a dictionary for evaluate_code_regions.
+    """
+    if arguments is None:
+        arguments = lambda *a: a
+    terms = regions["terms"]
+    n_codes = cond_init.__code__.co_argcount - len(regions["samples"])
+    n_regions = 3 ** len(terms)
+    with np.errstate(invalid="ignore"):
+        region = region_ids(terms, *regions["samples"]).astype(np.intp)
+    n = len(region)
+    combinations = np.array(
+        list(itertools.product(range(n_detection_slots), repeat=n_codes))
+    )
+    # Every sample point with every combination of codes
+    values = [np.tile(v, len(combinations)) for v in regions["samples"]]
+    codes = [np.repeat(detection_codes[c], n) for c in combinations.T]
+    index = np.tile(region, len(combinations))
+    index += np.repeat(np.arange(len(combinations)) * n_regions, n)
+    with np.errstate(invalid="ignore"):
+        diag, c_diag = evaluate_rules(
+            cond_init, rules, *arguments(*values, *codes), block_size=len(index)
+        )
+    table = np.full(len(combinations) * n_regions, -1, dtype=np.int8)
+    table[index] = 2 * diag + c_diag
+    if (table[index] != 2 * diag + c_diag).any():
+        raise ValueError("The terms do not match the rules")
+    return {
+        "regions": regions,
+        "cond_init": cond_init,
+        "rules": rules,
+        "arguments": arguments,
+        "table": table,
+    }
+
+
+def detection_slots(codes, stride=1):
+    """
+    Slot of each detection code in the tables of compile_code_regions,
+    multiplied by 'stride': the codes 0, 1 and 2, any other non negative
+    value (e.g. 3) and the negative values or NaN. The rules only compare
+    the codes with 0, 1, 2 and the sign, so all the codes in a slot are
+    classified alike.
+    """
+    codes = np.asarray(codes)
+    slots = stride * np.arange(n_detection_slots)
+    if codes.dtype.kind == "i":
+        # The negative codes are clipped to -1, the last slot
+        return slots.take(np.clip(codes, -1, 3))
+    with np.errstate(invalid="ignore"):
+        known = (codes == 0) | (codes == 1) | (codes == 2)
+        slot = np.where(codes >= 0, np.where(known, codes, 3), -1)
+    return slots.take(slot.astype(np.intp))
+
+
+def evaluate_code_regions(compiled, values, codes, block_size=None, n_threads=1):
+    """
+    Classify the elements of a diagram from their detection codes and region
+    with one gather per element.
+    Input:
+      compiled - output of compile_code_regions, or a list of them compiled
+                 from the same regions (the index of each element is
+                 computed once for all of them)
+      values - list of arrays with the values (e.g. [x, y])
+      codes - list of arrays with the detection codes (e.g. [c_x, c_y])
+      block_size, n_threads - as in evaluate_regions
+    Output (as evaluate_rules with the cond_init and rules compiled; a list
+    of them for a list of compiled tables):
+      diag - diagnostic code
+      c_diag - code indicating if the diagnostic was applied to an element 1 or 0.
+    """
+    tables = compiled if isinstance(compiled, list) else [compiled]
+    regions = tables[0]["regions"]
+    n = len(values[0])
+    results = [(np.zeros(n, dtype="i"), np.zeros(n, dtype="i")) for _ in tables]
+
+    def evaluate_block(start, stop, scratch):
+        v = [a[start:stop] for a in values]
+        c = [a[start:stop] for a in codes]
+        index = region_ids(regions["terms"], *v, grid=regions["grid"]).astype(np.intp)
+        stride = 3 ** len(regions["terms"])
+        for code in c[::-1]:
+            index += detection_slots(code, stride)
+            stride *= n_detection_slots
+        for table, (diag, c_diag) in zip(tables, results):
+            packed = table["table"].take(index)
+            d = diag[start:stop]
+            c_d = c_diag[start:stop]
+            np.right_shift(packed, 1, out=d)
+            np.bitwise_and(packed, 1, out=c_d)
+            unknown = np.flatnonzero(packed < 0)
+            if len(unknown):
+                d[unknown], c_d[unknown] = evaluate_rules(
+                    table["cond_init"],
+                    table["rules"],
+                    *table["arguments"](*[a[unknown] for a in v + c])
+                )
+
+    for_blocks(evaluate_block, n, block_size, n_threads)
+    return results if isinstance(compiled, list) else results[0]
+
+
+def term_distances(terms, values, errors, iterations=4, gradients=None):
+    """
+    Signed distance, in units of the errors, from each element to the
+    demarcation curve of each term.
+    Input:
+      terms - list of [function of the values, threshold, closed side]
+      values - list of arrays with the values (e.g. [x, y])
+      errors - list of arrays with the errors of the values
+      iterations - refinements of the nearest point of the curve
+      gradients - constant gradient of each term (None if it is not constant)
+    Output:
+      list with the distances to each term, positive on the high side
+    The terms are linear in each value, so central differences with a unit
+    step give their exact gradient. The distances to the straight lines are
+    exact in closed form and those to the hyperbolas of two values are
+    exact too (see _hyperbola_distance); where an error is zero the value
+    of the term over its propagated error is exact. For other terms, the
+    nearest point of the curve in the metric of the errors is found
+    projecting the element on the tangent of the curve at the current point
+    (Gauss-Newton). Where the refinement does not reach the curve and with
+    iterations=0, the distance is the value of the term over its propagated
+    error.
+    """
+    if gradients is None:
+        gradients = [None] * len(terms)
+    distances = []
+    for (function, threshold, closed), constant in zip(terms, gradients):
+        value = function(*values) - threshold
+        if constant is not None:  # Straight line
+            variance = sum((g * e) ** 2 for g, e in zip(constant, errors) if g != 0)
+            distances.append(value / np.sqrt(variance))
+            continue
+        if len(values) == 2:  # Hyperbola
+            gradient = _gradient(function, values, value + threshold)
+            first_order = value / np.sqrt(
+                sum((g * e) ** 2 for g, e in zip(gradient, errors))
+            )
+            distance = _hyperbola_distance(function, threshold, values, errors)
+            positive = (errors[0] > 0) & (errors[1] > 0)
+            distances.append(
+                np.where(positive, np.copysign(distance, value), first_order)
+            )
+            continue
+        scale = max(1.0, abs(threshold))
+        point = values
+        residual = value
+        for k in range(iterations + 1):
+            gradient = _gradient(function, point, residual + threshold)
+            variance = sum((g * e) ** 2 for g, e in zip(gradient, errors))
+            linear = residual
+            if k > 0:
+                for g, v, p in zip(gradient, values, point):
+                    linear = linear + g * (v - p)
+            multiplier = linear / variance
+            if k == 0:
+                first_order = value / np.sqrt(variance)
+            if k == iterations:
+                break
+            point = [
+                v - multiplier * g * e**2 for g, v, e in zip(gradient, values, errors)
+            ]
+            residual = function(*point) - threshold
+            converged = np.abs(residual) <= 1e-2 * scale
+            if (np.abs(residual) <= 1e-9 * scale).all():
+                break
+        if k == 0:
+            distances.append(first_order)
+            continue
+        distance = np.copysign(np.abs(multiplier) * np.sqrt(variance), value)
+        distances.append(np.where(converged, distance, first_order))
+    return distances
+
+
+def _hyperbola_distance(function, threshold, values, errors):
+    """
+    Distance, in units of the errors, from each element to the curve
+    function(x, y) = threshold of a term linear in x and in y.
+    The term is d (x - a) (y - b) + constant, so the curve is X Y = k with
+    X = (x - a) / e_x and Y = (y - b) / e_y. Reflections that keep the
+    distances move the element so that k > 0, X + Y >= 0 and X >= Y; the
+    nearest point of the curve is then X = c u, Y = c / u with c = sqrt(k)
+    and u >= 1, the only root in [1, inf) of c u^4 - X u^3 + Y u - c. It is
+    found with Newton steps kept inside a bracket of the root.
+    """
+    x, y = values
+    e_x, e_y = errors
+    f00 = function(0.0, 0.0)
+    f10 = function(1.0, 0.0) - f00
+    f01 = function(0.0, 1.0) - f00
+    d = function(1.0, 1.0) - f00 - f10 - f01
+    with np.errstate(divide="ignore", invalid="ignore"):
+        X = (x + f01 / d) / e_x
+        Y = (y + f10 / d) / e_y
+        k = (threshold - f00 + f10 * f01 / d) / d / (e_x * e_y)
+        Y = np.where(k < 0, -Y, Y)
+        c = np.sqrt(np.abs(k))
+        side = np.where(X + Y < 0, -1.0, 1.0)
+        high = np.maximum(side * X, side * Y)
+        low = np.minimum(side * X, side * Y)
+        lower = np.ones(len(c))
+        upper = 2.0 + (high + np.abs(low)) / c
+        u = np.clip(high / c, lower, upper)
+        active = np.flatnonzero(np.isfinite(u) & np.isfinite(upper))
+        for _ in range(100):
+            if len(active) == 0:
+                break
+            ua, ca, ha, la = u[active], c[active], high[active], low[active]
+            q = (ca * ua - ha) * ua**3 + la * ua - ca
+            slope = (4.0 * ca * ua - 3.0 * ha) * ua**2 + la
+            lower[active] = np.where(q > 0, lower[active], ua)
+            upper[active] = np.where(q > 0, ua, upper[active])
+            step = ua - q / slope
+            inside = (step >= lower[active]) & (step <= upper[active])
+            step = np.where(inside, step, np.sqrt(lower[active] * upper[active]))
+            u[active] = step
+            width = np.minimum(np.abs(step - ua), upper[active] - lower[active])
+            active = active[width > 1e-12 * step]
+        distance = np.hypot(c * u - high, c / u - low)
+    # Degenerate hyperbola: the two asymptotes
+    return np.where(c > 0, distance, np.minimum(np.abs(X), np.abs(Y)))
+
+
+def _gradient(function, values, value=None):
+    """
+    Gradient of a term that is linear in each value (exact with differences
+    of unit step). 'value' is the term at the values, if known.
+    """
+    if value is None:
+        value = function(*values)
+    gradient = []
+    for i in range(len(values)):
+        up = list(values)
+        up[i] = values[i] + 1.0
+        gradient.append(function(*up) - value)
+    return gradient
+
+
+def boundary_distance(regions, values, errors, block_size=None, n_threads=1):
+    """
+    Signed distance, in sigma units, to the nearest demarcation curve of
+    the classification of the detections.
+    Only the terms whose crossing changes the class of the region of the
+    element are considered (e.g. the hyperbola branches that are not part
+    of the diagram are ignored). Where the class only changes crossing
+    several terms (e.g. at the corners of the regions) the largest of their
+    distances is used. The distances to the straight lines and to the
+    hyperbolas of two values are exact (see term_distances), so the result
+    is a lower bound of the distance to the nearest change of class. The
+    sign is positive on the high side of the threshold of the nearest term.
+    inf if no crossing changes the class and NaN for non finite values.
+    """
+    n = len(values[0])
+    distance = np.empty(n)
+
+    def evaluate_block(start, stop, scratch):
+        distance[start:stop] = _boundary_distance(
+            regions, [v[start:stop] for v in values], [e[start:stop] for e in errors]
+        )
+
+    for_blocks(evaluate_block, n, block_size, n_threads)
+    return distance
+
+
+def _boundary_distance(regions, values, errors):
+    """
+    Boundary distance of a block.
+    """
+    terms = regions["terms"]
+    region = region_ids(terms, *values, grid=regions["grid"]).astype(np.intp)
+    distance = np.full(len(region), np.inf)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        distances = term_distances(
+            terms, values, errors, gradients=regions["gradients"]
+        )
+        sizes = [np.abs(d) for d in distances]
+        nearest = np.full(len(region), np.inf)
+        for crossed, changed in regions["crossings"]:
+            size = sizes[crossed[0]]
+            for i in crossed[1:]:
+                size = np.maximum(size, sizes[i])
+            closer = np.flatnonzero(changed.take(region) & (size < nearest))
+            nearest[closer] = size[closer]
+            # Sign of the farthest term crossed
+            d = distances[crossed[0]][closer]
+            for i in crossed[1:]:
+                d = np.where(sizes[i][closer] > np.abs(d), distances[i][closer], d)
+            distance[closer] = d
+    distance[~np.all([np.isfinite(v) for v in values], axis=0)] = np.nan
+    return distance
+
+
+def misclassification_probability(distance):
+    """
+    Probability that an element is on the other side of the nearest
+    demarcation curve, for a normal error: 0.5 * erfc(|distance| / sqrt(2)).
+    Uses the approximation 7.1.26 of Abramowitz & Stegun (absolute error
+    below 1e-7). NaN distances give NaN.
+    """
+    z = np.abs(np.asarray(distance, dtype=np.float64)) / np.sqrt(2.0)
+    t = 1.0 / (1.0 + 0.3275911 * z)
+    poly = t * (
+        0.254829592
+        + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429)))
+    )
+    with np.errstate(under="ignore"):
+        return 0.5 * poly * np.exp(-z * z)
+
+
+def evaluate_regions(regions, x, y, c_x, c_y, block_size=None, n_threads=1):
+    """
+    Classify the detections of a diagram from their region.
+    Input:
+      regions - output of compile_regions
+      x, y, c_x, c_y - coordinates and detection codes
+      block_size - number of elements evaluated at a time (default
+                   default_block_size)
+      n_threads - number of threads evaluating blocks (see for_blocks)
+    Output (as evaluate_rules with only_detections and the rules):
+      diag - diagnostic code
+      c_diag - code indicating if the diagnostic was applied to an element 1 or 0.
+    """
+    n = len(x)
+    diag = np.zeros(n, dtype="i")
+    c_diag = np.zeros(n, dtype="i")
+
+    def evaluate_block(start, stop, scratch):
+        block = [a[start:stop] for a in (x, y, c_x, c_y)]
+        region = region_ids(regions["terms"], *block[:2], grid=regions["grid"])
+        packed = regions["table"].take(region)
+        packed *= only_detections(*block)
+        d = diag[start:stop]
+        c_d = c_diag[start:stop]
+        np.right_shift(packed, 1, out=d)
+        np.bitwise_and(packed, 1, out=c_d)
+        unknown = np.flatnonzero(packed < 0)
+        if len(unknown):
+            d[unknown], c_d[unknown] = evaluate_rules(
+                only_detections, regions["rules"], *[a[unknown] for a in block]
+            )
+
+    for_blocks(evaluate_block, n, block_size, n_threads)
+    return diag, c_diag
+
+
+def apply_table(table, *classes):
+    """
+    Apply a classification table row by row.
+    Each row contains the input class codes followed by the output code.
+    The last matching row wins. Reference implementation used to compile
+    the lookup tables.
+    """
+    final = np.zeros_like(classes[0])
+    for row in table:
+        cond = classes[0] == row[0]
+        for c, code in zip(classes[1:], row[1:-1]):
+            cond &= c == code
+        final[cond] = row[-1]
+    return final
+
+
+def _code_slots(codes):
+    """
+    Slot of each class code in the compiled tables.
+    """
+    codes = np.asarray(codes)
+    if codes.dtype.kind == "f":
+        # NaN and non integer values do not match any code
+        codes = np.where(codes == np.floor(codes), codes, -1)
+    if codes.dtype.kind != "i":
+        codes = codes.astype(np.intp)
+    return _slots[np.clip(codes, -1, len(table_codes)) + 1]
+
+
+def table_index(*classes):
+    """
+    Flat index of the combinations of class codes in a compiled table.
+    """
+    index = _code_slots(classes[0])
+    for c in classes[1:]:
+        index = index * _n_slots + _code_slots(c)
+    return index
+
+
+def lookup_table(lut, *classes):
+    """
+    Gather the output codes of a compiled table for the input classes.
+    The output has the same type as the second class (as np.zeros_like did).
+    """
+    dtype = np.asarray(classes[1]).dtype
+    return lut.take(table_index(*classes)).astype(dtype, copy=False)
+
+
+def compile_table(function, n_classes):
+    """
+    Evaluate a row by row classification function on every combination of
+    codes and return the results as flat lookup tables for table_index.
+    """
+    codes = np.array(table_codes + [-1])  # -1 represents the extra slot
+    grid = np.meshgrid(*([codes] * n_classes), indexing="ij")
+    out = function(*[g.ravel() for g in grid])
+    if isinstance(out, tuple):
+        return tuple(np.asarray(o, dtype="i") for o in out)
+    return np.asarray(out, dtype="i")
+
+
+##################################
+# Compiled classification tables #
+##################################
+
+# Elements evaluated at a time by the diagrams: the inputs and temporary
+# masks of a block (about 64 bytes per element) fit in a 2 MiB L2 cache.
+default_block_size = 32768
+
+# Sample points of each region used to compile the tables of the detection
+# codes, and the code representing each slot of detection_slots.
+region_samples = 64
+detection_codes = np.array([0, 1, 2, 3, -1])
+n_detection_slots = len(detection_codes)
+
+# Slot of each code in the compiled tables (index is code + 1).
+_n_slots = len(table_codes) + 1
+_slots = np.array([_n_slots - 1] + list(range(len(table_codes))) + [_n_slots - 1])
+
+_lut_Sabater2012_class, _lut_Sabater2012_class_to = compile_table(
+    _diag_class_Sabater2012_rows, 3
+)
+_lut_OiSiiNii = compile_table(lambda *c: apply_table(table_OiSiiNii, *c), 3)
+_lut_OiSiiNiiMine = compile_table(lambda *c: apply_table(table_OiSiiNiiMine, *c), 3)
+_lut_general = compile_table(lambda *c: apply_table(table_general, *c), 3)
+
+# Region grids and tables of the Sabater et al. 2012 diagrams.
+_grid_types = [np.dtype(np.float32), np.dtype(np.float64)]
+_regions_nii_Sabater2012 = compile_regions(terms_nii_Sabater2012, rules_nii_Sabater2012)
+_regions_sii_Sabater2012 = compile_regions(terms_sii_Sabater2012, rules_sii_Sabater2012)
+_regions_oi_Sabater2012 = compile_regions(terms_oi_Sabater2012, rules_oi_Sabater2012)
+_regions_CidFernandes2011 = compile_regions(
+    terms_CidFernandes2011,
+    rules_CidFernandes2011,
+    arguments=_arguments_CidFernandes2011,
+    grid=False,
+)
+
+# Decision tables of the classifications with limits.
+_limits_nii_Sabater2012 = compile_code_regions(
+    _regions_nii_Sabater2012, detections_and_limits, _rules_nii_Sabater2012_limits
+)
+_limits_sii_Sabater2012 = compile_code_regions(
+    _regions_sii_Sabater2012, detections_and_limits, _rules_sii_Sabater2012_limits
+)
+_limits_oi_Sabater2012 = compile_code_regions(
+    _regions_oi_Sabater2012, detections_and_limits, _rules_oi_Sabater2012_limits
+)
+# Decision tables of the Sabater et al. 2012 diagrams with and without limits
+_code_regions_Sabater2012 = {
+    "nii": {
+        True: _limits_nii_Sabater2012,
+        False: compile_code_regions(
+            _regions_nii_Sabater2012, only_detections, rules_nii_Sabater2012
+        ),
+    },
+    "sii": {
+        True: _limits_sii_Sabater2012,
+        False: compile_code_regions(
+            _regions_sii_Sabater2012, only_detections, rules_sii_Sabater2012
+        ),
+    },
+    "oi": {
+        True: _limits_oi_Sabater2012,
+        False: compile_code_regions(
+            _regions_oi_Sabater2012, only_detections, rules_oi_Sabater2012
+        ),
+    },
+}
+_limits_CidFernandes2011 = compile_code_regions(
+    _regions_CidFernandes2011,
+    lambda x, c_x, ew_ha, c_ew_ha, ew_nii, c_ew_nii: (
+        (c_x >= 0) & (c_ew_ha >= 0) & (c_ew_nii >= 0)
+    ),
+    rules_CidFernandes2011 + rules_CidFernandes2011_limits,
+    arguments=_arguments_CidFernandes2011,
+)
@@ -0,0 +1,199 @@
+"""
+Monte-Carlo classification probabilities of the Sabater et al. 2012
+diagrams from the errors of the line ratios.
+Each galaxy is classified in n_samples realisations of its ratios, drawn
+from normal distributions with the ratio errors. The [OIII]/Hbeta ratio is
+drawn once per realisation and shared by the three diagrams, so the final
+classification of each realisation is consistent. The detection codes are
+not perturbed.
+The realisations of a galaxy that stay in a circle around its ratios in
+which no demarcation curve is crossed all get the class of the ratios, so
+only the galaxies with realisations out of that circle are classified
+realisation by realisation.
+The galaxies are processed in chunks of about chunk_samples realisations,
+each with its own random stream derived from the seed, so the result does
+not depend on the number of worker processes.
+"""
+__author__ = "jsm"
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from .lineclass import (
+    diag_class_Sabater2012,
+    diag_nii_Sabater2012,
+    diag_oi_Sabater2012,
+    diag_sii_Sabater2012,
+    table_codes,
+    terms_nii_Sabater2012,
+    terms_oi_Sabater2012,
+    terms_sii_Sabater2012,
+)
+from .mpa_jhu import dict_diagnostic
+
+diagrams = [
+    ("nii", diag_nii_Sabater2012),
+    ("sii", diag_sii_Sabater2012),
+    ("oi", diag_oi_Sabater2012),
+]
+diagram_terms = {
+    "nii": terms_nii_Sabater2012,
+    "sii": terms_sii_Sabater2012,
+    "oi": terms_oi_Sabater2012,
+}
+n_codes = len(table_codes)
+
+
+def input_columns():
+    """
+    Ratios, errors and codes used by class_probabilities.
+    """
+    names = []
+    for name, function in diagrams:
+        for ratio in dict_diagnostic[name]:
+            names += [n for n in [ratio, "e_" + ratio, "c_" + ratio] if n not in names]
+    return names
+
+
+def class_probabilities(
+    data, n_samples=100, use_limits=True, seed=0, chunk_samples=2**22, n_workers=1
+):
+    """
+    Probability of each class in each Sabater et al. 2012 diagram and in the
+    final classification.
+    Input:
+      data - ratios, errors and codes (output of ratio_columns or a
+             dataframe after get_ratios)
+      n_samples - realisations per galaxy
+      use_limits - passed to the diagrams
+      seed - seed of the random numbers
+      chunk_samples - realisations processed at a time (caps the memory)
+      n_workers - number of processes
+    Output:
+      dictionary with (N, 11) float32 arrays for "nii_Sabater2012",
+      "sii_Sabater2012", "oi_Sabater2012" and "class_Sabater2012"; the
+      column j is the probability of the class code j.
+    """
+    columns = {name: np.asarray(data[name]) for name in input_columns()}
+    n = len(columns["oiii_h_beta"])
+    rows = max(1, chunk_samples // n_samples)
+    bounds = [(start, min(start + rows, n)) for start in range(0, n, rows)]
+    seeds = np.random.SeedSequence(seed).spawn(len(bounds))
+    args = [
+        ({k: v[start:stop] for k, v in columns.items()}, n_samples, use_limits, s)
+        for (start, stop), s in zip(bounds, seeds)
+    ]
+    if n_workers == 1 or len(args) <= 1:
+        results = [_chunk_probabilities(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            results = list(pool.map(_chunk_probabilities, *zip(*args)))
+    names = [name + "_Sabater2012" for name, _ in diagrams] + ["class_Sabater2012"]
+    if not results:
+        return {name: np.zeros((0, n_codes), dtype=np.float32) for name in names}
+    return {name: np.concatenate([r[name] for r in results]) for name in names}
+
+
+def _sample(value, error, samples):
+    """
+    Realisations of a column as a (N, n_samples) float32 array, from standard
+    normal samples (changed in place).
+    """
+    samples *= error[:, None]
+    samples += value[:, None]
+    return samples
+
+
+def _safe_radius(terms, x, y, e_x, e_y):
+    """
+    Radius, in units of the errors, of the circle around each point in which
+    every term stays beyond its threshold by the float32 margin of
+    compile_region_grid. The terms are linear or bilinear, so
+    |f(p + d) - f(p)| <= r |gradient * e| + |f_xy| e_x e_y r**2 / 2
+    for d = (z_x e_x, z_y e_y) and r = |z|.
+    NaN or 0 if the point is not clear of the thresholds.
+    """
+    x, y = x.astype(float), y.astype(float)
+    e_x, e_y = e_x.astype(float), e_y.astype(float)
+    radius = np.inf
+    for function, threshold, closed in terms:
+        value = function(x, y)
+        g_x, g_y = function(x + 1.0, y) - value, function(x, y + 1.0) - value
+        f_xy = function(1.0, 1.0) - function(1.0, 0.0) - function(0.0, 1.0)
+        f_xy += function(0.0, 0.0)
+        # Root of a r**2 + b r - c
+        a = abs(f_xy) * e_x * e_y / 2
+        b = np.hypot(g_x * e_x, g_y * e_y)
+        c = np.abs(value - threshold) - 1e-4 * max(1.0, abs(threshold))
+        root = 2 * c / (b + np.sqrt(b**2 + 4 * a * np.maximum(c, 0)))
+        radius = np.fmin(radius, np.where(c > 0, root, 0))
+    return radius
+
+
+def _frequencies(centre, rows, codes, n_samples):
+    """
+    Fraction of the realisations of each row with each class code.
+    Input:
+      centre - class of the ratios of each row
+      rows - rows classified realisation by realisation (the others get
+             the class of their ratios)
+      codes - classes of the realisations of those rows
+    """
+    frequencies = np.zeros((len(centre), n_codes), dtype=np.float32)
+    frequencies[np.arange(len(centre)), np.clip(centre, 0, n_codes - 1)] = 1
+    index = np.arange(len(rows)).repeat(n_samples) * n_codes
+    index += np.clip(codes, 0, n_codes - 1)
+    counts = np.bincount(index, minlength=len(rows) * n_codes)
+    frequencies[rows] = (counts.reshape(-1, n_codes) / n_samples).astype(np.float32)
+    return frequencies
+
+
+def _chunk_probabilities(columns, n_samples, use_limits, seed):
+    """
+    Worker: class probabilities of a chunk of galaxies.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(columns["oiii_h_beta"])
+    y_name = dict_diagnostic["nii"][1]
+    names = [y_name] + [dict_diagnostic[name][0] for name, _ in diagrams]
+    samples = [rng.standard_normal((n, n_samples), dtype=np.float32) for _ in names]
+    deviation = [np.abs(s).max(axis=1, initial=0) ** 2 for s in samples]
+    values = [np.asarray(columns[k], dtype=np.float32) for k in names]
+    errors = [
+        np.where(np.isfinite(e), e, 0).astype(np.float32)
+        for e in [columns["e_" + k] for k in names]
+    ]
+    codes = [columns["c_" + k] for k in names]
+    # Rows of each diagram with realisations out of the circle of their ratios
+    slow = {}
+    for i, (name, function) in enumerate(diagrams, 1):
+        with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+            radius = _safe_radius(
+                diagram_terms[name], values[i], values[0], errors[i], errors[0]
+            )
+        slow[name] = np.flatnonzero(~(deviation[i] + deviation[0] < radius**2))
+    rows = np.unique(np.concatenate(list(slow.values())))
+    y = _sample(values[0][rows], errors[0][rows], samples[0][rows])
+    out = {}
+    centres, classes = [], []
+    for i, (name, function) in enumerate(diagrams, 1):
+        index = slow[name]
+        x = _sample(values[i][index], errors[i][index], samples[i][index])
+        with np.errstate(invalid="ignore"):
+            centre, c_centre = function(
+                values[i], values[0], codes[i], codes[0], use_limits=use_limits
+            )
+            diag, c_diag = function(
+                x.ravel(),
+                y[np.searchsorted(rows, index)].ravel(),
+                codes[i][index].repeat(n_samples),
+                codes[0][index].repeat(n_samples),
+                use_limits=use_limits,
+            )
+        out[name + "_Sabater2012"] = _frequencies(centre, index, diag, n_samples)
+        centres.append(centre)
+        # Classes of the realisations of all the rows out of a circle
+        classes.append(np.repeat(centre[rows, None], n_samples, axis=1))
+        classes[-1][np.searchsorted(rows, index)] = diag.reshape(-1, n_samples)
+    final, final_to = diag_class_Sabater2012(*centres)
+    final_samples, final_to = diag_class_Sabater2012(*[c.ravel() for c in classes])
+    out["class_Sabater2012"] = _frequencies(final, rows, final_samples, n_samples)
+    return out
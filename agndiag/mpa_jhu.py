@@ -1,9 +1,18 @@
 """
 Auxiliary methods to clean MPA-JHU line data.
-The lines have to be entered into a pandas dataframe.
+The lines can be entered into a pandas dataframe or, without pandas, as
+numpy columns (a dictionary of arrays or a structured array) using the
+columnar functions. The dataframe functions are thin wrappers around the
+columnar ones. Large catalogues can be processed in chunks with
+classify_chunks. The line columns can be read directly from the MPA-JHU
+gal_line FITS files with read_gal_line.
 """
 __author__ = "jsm"
+import math
 import numpy as np
+from .backend import array_kernel
+from .fits import read_table, table_layout
+from .instrument import instrumented
 from .lineclass import (
     diag_nii_Sabater2012,
     diag_oi_Sabater2012,
@@ -11,9 +20,9 @@ from .lineclass import (
     diag_CidFernandes2011,
     diag_class_OiSiiNiiMine,
     diag_class_Sabater2012,
+    misclassification_probability,
 )
 
-
 name_lines = [
     "H_BETA",
     "OIII_5007",
@@ -40,166 +49,663 @@ dict_diagnostic = {
     "sii": ["sii_h_alpha", "oiii_h_beta"],
 }
 cor_factor = [1.882, 1.566, 1.378, 2.473, 2.039, 1.621, 1.621]
+# Columns of the gal_line files used by the pipeline
+input_columns = [line + param for line in name_lines for param in name_params]
+
 
+##########################################
+# Columnar pipeline on numpy arrays
+##########################################
+# The data is any object giving a numpy array (or array-like) for each
+# column name: a dictionary of arrays, a numpy structured array or a pandas
+# dataframe. The derived columns are written into the dictionary 'out'.
+# Columns already present in 'out' (e.g. preallocated with
+# allocate_columns) are filled in place; the rest are created.
 
-def clean_data(df, sigma=3.0, ew_method=1):
+
+def output_columns(data, dtype=None):
     """
-    Clean the line data.
+    Names and types of the columns derived by classify_columns, in the
+    order in which the pipeline adds them.
+    The float type of the cleaned columns is 'dtype' or, by default, the
+    type of the input columns.
+    """
+    columns = []
+    if dtype is None:
+        dtype = np.result_type(
+            *[
+                np.asarray(data[line + p][:0])
+                for line in name_lines
+                for p in name_params
+            ],
+            np.float16
+        )
+    for line in name_lines:
+        columns += [
+            ("flux_" + line, dtype),
+            ("e_flux_" + line, dtype),
+            ("c_flux_" + line, np.dtype(np.int8)),
+            ("ew_" + line, dtype),
+            ("e_ew_" + line, dtype),
+            ("c_ew_" + line, np.dtype(np.int8)),
+        ]
+    columns += [
+        ("flux_SII", dict(columns)["flux_SII_6717"]),
+        ("e_flux_SII", dict(columns)["e_flux_SII_6717"]),
+        ("c_flux_SII", np.dtype(np.int8)),
+    ]
+    types = dict(columns)
+    for ratio in name_ratios:
+        num, den = [np.ones(0, types["flux_" + line]) for line in dict_ratios[ratio]]
+        e_num, e_den = [
+            np.ones(0, types["e_flux_" + line]) for line in dict_ratios[ratio]
+        ]
+        columns += [
+            (ratio, np.log10(num / den).dtype),
+            ("e_" + ratio, np.sqrt(e_num / num + e_den / den).dtype),
+            ("c_" + ratio, np.dtype(int)),
+        ]
+    for name in ["nii", "sii", "oi"]:
+        columns += [(name + "_Sabater2012", np.dtype("i"))]
+        columns += [("c_" + name + "_Sabater2012", np.dtype("i"))]
+    columns += [
+        ("class_Sabater2012", np.dtype("i")),
+        ("class_to_Sabater2012", np.dtype("i")),
+        ("whan_CidFernandes2011", np.dtype("i")),
+        ("c_whan_CidFernandes2011", np.dtype("i")),
+    ]
+    return columns
+
+
+def allocate_columns(data, dtype=None):
+    """
+    Preallocate the output columns of classify_columns for the data.
+    """
+    n = len(np.asarray(data[name_lines[0] + "_FLUX"]))
+    return {name: np.empty(n, dtype=t) for name, t in output_columns(data, dtype)}
+
+
+def _store(out, name, value):
+    """
+    Store a derived column in 'out', in place if it was preallocated.
+    """
+    if name in out:
+        out[name][...] = value
+    else:
+        out[name] = value
+
+
+@array_kernel(shared=["sigma", "factors"])
+def clean_kernel(
+    flux,
+    e_flux,
+    cont,
+    e_cont,
+    sigma=3.0,
+    factors=None,
+    dtype=None,
+    out=None,
+    scratch=None,
+    equivalent_widths=True,
+):
+    """
+    Cleaning kernel for all the lines at once.
+    Input:
+      flux, e_flux, cont, e_cont - (N, n_lines) arrays with the raw line values
+      sigma - detection threshold (a scalar or one per column)
+      factors - correction factors of the errors of each line (default cor_factor)
+      dtype - float type of the output (default: type of the inputs)
+      out - dictionary of (N, n_lines) output arrays (they can be views)
+      scratch - dictionary of temporary arrays reused between calls
+      equivalent_widths - also clean the equivalent widths (True), of none
+                          of the lines (False) or of the first n lines (n)
+    Output:
+      dictionary of arrays: flux, e_flux and c_flux (N, n_lines) and ew,
+      e_ew and c_ew (N, n) of the lines with EW; the values are of type dtype
+      and the codes c_flux and c_ew are int8
+    All the operations are done in place on the output and scratch arrays.
+    """
+    if factors is None:
+        factors = cor_factor
+    if dtype is None:
+        dtype = np.result_type(flux, e_flux, cont, e_cont, np.float16)
+    if out is None:
+        out = {}
+    if scratch is None:
+        scratch = {}
+    shape = np.shape(flux)
+    n_ew = shape[1] if equivalent_widths is True else int(equivalent_widths)
+    factors = np.asarray(factors, dtype=dtype)
+    cont = np.asarray(cont, dtype=dtype)
+    f, ef, c_f = [
+        _buffer(out, name, shape, dtype if name[0] != "c" else np.int8)
+        for name in ["flux", "e_flux", "c_flux"]
+    ]
+    # The EW is used as a temporary array in the cleaning of the flux
+    ew = _buffer(out if n_ew == shape[1] else scratch, "ew", shape, dtype)
+    s_e_flux, e_c, s_e_cont = [
+        _buffer(scratch, name, shape, dtype) for name in ["t1", "t2", "t3"]
+    ]
+    bad, good, cond, low = [
+        _buffer(scratch, name, shape, bool) for name in ["m1", "m2", "m3", "m4"]
+    ]
+    ## Flux
+    np.multiply(e_flux, factors, out=ef)
+    np.copyto(f, flux)
+    c_f.fill(0)
+    # Bad lines
+    np.less_equal(ef, 0.0, out=bad)
+    np.copyto(f, 0.0, where=bad)
+    np.copyto(ef, 0.0, where=bad)
+    np.copyto(c_f, -1, where=bad)
+    # Lines detected below sigma
+    np.multiply(ef, sigma, out=s_e_flux)
+    np.less(np.abs(f, out=ew), s_e_flux, out=cond)
+    np.greater(cond, bad, out=cond)  # cond & ~bad
+    np.copyto(f, s_e_flux, where=cond)
+    np.copyto(c_f, 1, where=cond)
+    if n_ew == 0:
+        return out
+
+    ## Equivalent width of the first n_ew lines
+    if n_ew < shape[1]:
+        f, ef, bad, s_e_flux, e_c, s_e_cont, good, cond, low = [
+            a[:, :n_ew] for a in [f, ef, bad, s_e_flux, e_c, s_e_cont, good, cond, low]
+        ]
+        cont, e_cont = cont[:, :n_ew], np.asarray(e_cont)[:, :n_ew]
+        factors = factors[..., :n_ew]
+        if np.ndim(sigma) > 0:
+            sigma = np.asarray(sigma)[..., :n_ew]
+        ew = _buffer(out, "ew", (shape[0], n_ew), dtype)
+    ew_shape = (shape[0], n_ew)
+    e_ew, c_ew = [
+        _buffer(out, name, ew_shape, dtype if name[0] != "c" else np.int8)
+        for name in ["e_ew", "c_ew"]
+    ]
+    np.multiply(e_cont, factors, out=e_c)
+    c_ew.fill(0)
+    # Bad lines in EW
+    np.less_equal(e_c, 0.0, out=good)
+    np.logical_or(good, bad, out=good)
+    np.logical_or(good, np.less_equal(cont, 0.0, out=cond), out=good)
+    np.copyto(c_ew, -1, where=good)
+    np.logical_not(good, out=good)
+    # Only for good lines
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        ew.fill(0.0)
+        np.divide(f, cont, out=ew, where=good)
+        np.square(np.divide(ef, cont, out=s_e_flux), out=s_e_flux)
+        np.multiply(f, e_c, out=e_ew)
+        np.divide(e_ew, np.square(cont, out=s_e_cont), out=e_ew)
+        np.add(s_e_flux, np.square(e_ew, out=e_ew), out=s_e_flux)
+        e_ew.fill(0.0)
+        np.sqrt(s_e_flux, out=e_ew, where=good)
+    np.multiply(ef, sigma, out=s_e_flux)
+    np.multiply(e_c, sigma, out=s_e_cont)
+    np.less(f, s_e_flux, out=bad)  # Low flux
+    np.less(cont, s_e_cont, out=low)  # Low continuum
+    np.greater_equal(cont, s_e_cont, out=cond)
+    np.logical_and(np.logical_and(cond, bad, out=cond), good, out=cond)
+    np.copyto(c_ew, 2, where=cond)
+    np.greater_equal(f, s_e_flux, out=cond)
+    np.logical_and(np.logical_and(cond, low, out=cond), good, out=cond)
+    np.copyto(c_ew, 1, where=cond)
+    np.logical_and(np.logical_and(bad, low, out=cond), good, out=cond)
+    np.copyto(c_ew, 3, where=cond)
+    return out
+
+
+def _buffer(buffers, name, shape, dtype):
+    """
+    Get an array of the given shape and type from a dictionary of buffers,
+    allocating it (in Fortran order) if needed.
+    """
+    buffer = buffers.get(name)
+    if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+        buffer = buffers[name] = np.empty(shape, dtype=dtype, order="F")
+    return buffer
+
+
+@instrumented
+def clean_columns(
+    data,
+    sigma=3.0,
+    ew_method=1,
+    dtype=None,
+    out=None,
+    buffers=None,
+    block_size=32768,
+    lines=None,
+    factors=None,
+    equivalent_widths=True,
+):
+    """
+    Clean the line data. Columnar version of clean_data.
     Applies the correction factors to the errors.
+    Only the given lines are cleaned (default name_lines; none raises
+    ValueError), with the given correction factors (default: those of
+    cor_factor for the lines). The EW are cleaned for all the lines
+    (equivalent_widths True), for none (False) or for the given list of
+    lines.
+    The lines are cleaned at once with clean_kernel in blocks of block_size
+    rows, so the temporary arrays are small and reused. The float type of
+    the output can be chosen with 'dtype'. The output is written into
+    (N, n_lines) arrays in Fortran order taken from 'buffers' (they can be
+    reused between calls); the cleaned columns stored in 'out' are views
+    of them unless they were preallocated.
+    Returns the dictionary with the cleaned flux and EW columns.
     """
-    global name_lines, cor_factor
-    # TODO: Check that the lines are in the dataframe
-    for i, line in enumerate(name_lines):
-        ## Flux
-        flux = df[line + "_FLUX"]
-        e_flux = df[line + "_FLUX_ERR"] * cor_factor[i]
-        c_flux = df[line + "_FLUX"].astype(int)
-        c_flux[~np.isnan(c_flux)] = 0
-        # Bad lines
-        # TODO: Use nan
-        cond = e_flux <= 0.0  # Bad lines
-        flux[cond] = 0.0
-        e_flux[cond] = 0.0
-        c_flux[cond] = -1
-        # Lines detected below 3 sigma
-        cond = (np.abs(flux) < sigma * e_flux) & (c_flux != -1)
-        flux[cond] = sigma * e_flux[cond]
-        c_flux[cond] = 1
-        # Add cleaned flux
-        df["flux_" + line] = flux
-        df["e_flux_" + line] = e_flux
-        df["c_flux_" + line] = c_flux
-
-        ## Equivalent width
-        cont = df[line + "_CONT"]
-        e_cont = df[line + "_CONT_ERR"] * cor_factor[i]
-        ew = np.zeros_like(cont)
-        e_ew = np.zeros_like(cont)
-        c_ew = df[line + "_CONT"].astype(int)
-        c_ew[~np.isnan(c_ew)] = 0
-        # Bad lines in EW
-        cond = (c_flux == -1) | (e_cont <= 0.0) | (cont <= 0.0)
-        cont[cond] = 0.0
-        e_ew[cond] = 0.0
-        c_ew[cond] = -1
-        # Only for good lines
-        cond = c_ew != -1
-        ew[cond] = flux[cond] / cont[cond]
-        e_ew[cond] = np.sqrt(
-            (e_flux[cond] / cont[cond]) ** 2
-            + (flux[cond] * e_cont[cond] / (cont[cond] ** 2)) ** 2
+    if lines is None:
+        lines = name_lines
+    if len(lines) == 0:
+        raise ValueError("No lines to clean")
+    if factors is None:
+        factors = [dict(zip(name_lines, cor_factor))[line] for line in lines]
+    if out is None:
+        out = {}
+    if buffers is None:
+        buffers = {}
+    if equivalent_widths is True:
+        equivalent_widths = lines
+    elif equivalent_widths is False:
+        equivalent_widths = []
+    # The lines with EW first, as clean_kernel expects them
+    order = [i for i, line in enumerate(lines) if line in equivalent_widths]
+    n_ew = len(order)
+    order += [i for i, line in enumerate(lines) if line not in equivalent_widths]
+    lines = [lines[i] for i in order]
+    factors = [factors[i] for i in order]
+    inputs = [[np.asarray(data[line + p]) for line in lines] for p in name_params]
+    if dtype is None:
+        dtype = np.result_type(*[c for columns in inputs for c in columns], np.float16)
+    n = len(inputs[0][0])
+    names = ["flux", "e_flux", "c_flux", "ew", "e_ew", "c_ew"]
+    if n_ew == 0:
+        names = names[:3]
+    clean = {
+        name: _buffer(
+            buffers,
+            name,
+            (n, len(lines) if name in names[:3] else n_ew),
+            dtype if name[0] != "c" else np.int8,
+        )
+        for name in names
+    }
+    scratch = {}
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        block = [
+            _buffer(
+                scratch,
+                "input" + str(i),
+                (stop - start, len(lines)),
+                np.result_type(*columns),
+            )
+            for i, columns in enumerate(inputs)
+        ]
+        for stack, columns in zip(block, inputs):
+            for i, column in enumerate(columns):
+                stack[:, i] = column[start:stop]
+        clean_kernel(
+            *block,
+            sigma=sigma,
+            factors=factors,
+            dtype=dtype,
+            out={name: a[start:stop] for name, a in clean.items()},
+            scratch=scratch,
+            equivalent_widths=n_ew
         )
-        cond = (flux < sigma * e_flux) & (cont >= sigma * e_cont) & (c_ew != -1)
-        c_ew[cond] = 2
-        cond = (flux >= sigma * e_flux) & (cont < sigma * e_cont) & (c_ew != -1)
-        c_ew[cond] = 1
-        cond = (flux < sigma * e_flux) & (cont < sigma * e_cont) & (c_ew != -1)
-        c_ew[cond] = 3
-        # Add cleaned EW
-        df["ew_" + line] = ew
-        df["e_ew_" + line] = e_ew
-        df["c_ew_" + line] = c_ew
+    for i, line in enumerate(lines):
+        for name in names if i < n_ew else names[:3]:
+            _store(out, name + "_" + line, clean[name][:, i])
+    return out
 
 
-def combine_sii(df, param="flux"):
+@instrumented
+def combine_sii_columns(data, param="flux", out=None):
     """
-    Combine the params (flux or ew) of the two SII lines
+    Combine the params (flux or ew) of the two SII lines.
+    Columnar version of combine_sii.
     """
     assert param in ["flux", "ew"]
-    df[param + "_SII"] = df[param + "_SII_6717"] + df[param + "_SII_6717"]
-    df["e_" + param + "_SII"] = (
-        df["e_" + param + "_SII_6717"] + df["e_" + param + "_SII_6717"]
+    if out is None:
+        out = {}
+    _store(
+        out,
+        param + "_SII",
+        np.asarray(data[param + "_SII_6717"]) + np.asarray(data[param + "_SII_6717"]),
     )
-    code1 = df["c_" + param + "_SII_6717"]
-    code2 = df["c_" + param + "_SII_6717"]
-    df["c_" + param + "_SII"] = code1
-    df["c_" + param + "_SII"][(code1 > 0) | (code2 > 0)] = 1
-    df["c_" + param + "_SII"][(code1 < 0) | (code2 < 0)] = -1
+    _store(
+        out,
+        "e_" + param + "_SII",
+        np.asarray(data["e_" + param + "_SII_6717"])
+        + np.asarray(data["e_" + param + "_SII_6717"]),
+    )
+    code1 = np.asarray(data["c_" + param + "_SII_6717"])
+    code2 = np.asarray(data["c_" + param + "_SII_6717"])
+    code = code1.copy()
+    code[(code1 > 0) | (code2 > 0)] = 1
+    code[(code1 < 0) | (code2 < 0)] = -1
+    _store(out, "c_" + param + "_SII", code)
+    return out
 
 
-def get_ratios(df):
+@instrumented
+def ratio_columns(data, out=None, ratios=None, definitions=None):
     """
-    Get the line ratios used in the diagnostic diagrams.
+    Get the line ratios used in the diagnostic diagrams from the cleaned
+    fluxes (including the combined SII flux). Columnar version of get_ratios.
+    Only the given ratios are computed (default name_ratios), with the
+    numerator and denominator lines of each ratio in 'definitions' (default
+    dict_ratios).
     """
-    global name_ratios, dict_ratios
-    combine_sii(df)
-    for i, ratio in enumerate(name_ratios):
-        flux_num = df["flux_" + dict_ratios[ratio][0]]
-        flux_den = df["flux_" + dict_ratios[ratio][1]]
-        e_flux_num = df["e_flux_" + dict_ratios[ratio][0]]
-        e_flux_den = df["e_flux_" + dict_ratios[ratio][1]]
-        c_flux_num = df["c_flux_" + dict_ratios[ratio][0]]
-        c_flux_den = df["c_flux_" + dict_ratios[ratio][1]]
-        log_num_den = np.log10(flux_num / flux_den)
-        e_log_num_den = (
-            1.0
-            / np.log(10.0)
-            * np.sqrt((e_flux_num / flux_num) ** 2 + (e_flux_den / flux_den) ** 2)
-        )
-        c_log_num_den = df["c_flux_" + dict_ratios[ratio][0]].astype(int)
-        c_log_num_den[~np.isnan(c_log_num_den)] = 0  # Default zero for detections
+    if out is None:
+        out = {}
+    if ratios is None:
+        ratios = name_ratios
+    if definitions is None:
+        definitions = dict_ratios
+    for ratio in ratios:
+        num, den = definitions[ratio]
+        flux_num = np.asarray(data["flux_" + num])
+        flux_den = np.asarray(data["flux_" + den])
+        e_flux_num = np.asarray(data["e_flux_" + num])
+        e_flux_den = np.asarray(data["e_flux_" + den])
+        c_flux_num = np.asarray(data["c_flux_" + num])
+        c_flux_den = np.asarray(data["c_flux_" + den])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            log_num_den = np.log10(flux_num / flux_den)
+            # Python float, so that float32 columns are not promoted
+            e_log_num_den = (
+                1.0
+                / math.log(10.0)
+                * np.sqrt((e_flux_num / flux_num) ** 2 + (e_flux_den / flux_den) ** 2)
+            )
+        c_log_num_den = np.zeros(len(flux_num), dtype=int)  # Detections
         c_log_num_den[(c_flux_num > 0) & (c_flux_den == 0)] = 1  # Upper limit
         c_log_num_den[(c_flux_num == 0) & (c_flux_den > 0)] = 2  # Lower limit
         c_log_num_den[(c_flux_num > 0) & (c_flux_den > 0)] = 3  # Non-defined
         c_log_num_den[(flux_num < 0.0) | (flux_den < 0.0)] = -2  # Negative flux
         c_log_num_den[(c_flux_num < 0) | (c_flux_den < 0)] = -1  # Flagged line
         # Add the ratios
-        df[ratio] = log_num_den
-        df["e_" + ratio] = e_log_num_den
-        df["c_" + ratio] = c_log_num_den
+        _store(out, ratio, log_num_den)
+        _store(out, "e_" + ratio, e_log_num_den)
+        _store(out, "c_" + ratio, c_log_num_den)
+    return out
+
+
+@instrumented
+def diag_Sabater2012_columns(
+    data, use_limits=True, distances=False, out=None, diagrams=None, axes=None
+):
+    """
+    Classification from the three diagnostic diagrams of Sabater et al. 2012
+    and final classification. Columnar version of apply_diag_Sabater2012.
+    If distances is True, the signed distance in sigma units to the nearest
+    demarcation curve of each diagram ("d_" columns) and the probability of
+    being on its other side ("p_" columns) are added from the ratio errors.
+    Only the given diagrams are applied (default: the three); the final
+    classification needs the three. The ratios of the x and y axes of each
+    diagram are those of 'axes' (default dict_diagnostic).
+    """
+    name = "Sabater2012"
+    if out is None:
+        out = {}
+    if diagrams is None:
+        diagrams = ["nii", "sii", "oi"]
+    if axes is None:
+        axes = dict_diagnostic
+    classes = []
+    for diag_name, function in [
+        ("nii", diag_nii_Sabater2012),
+        ("sii", diag_sii_Sabater2012),
+        ("oi", diag_oi_Sabater2012),
+    ]:
+        if diag_name not in diagrams:
+            continue
+        if distances:
+            x_name, y_name = axes[diag_name]
+            diag, c_diag, distance = function(
+                *get_diag_ratios(data, diag_name, axes),
+                use_limits=use_limits,
+                e_x=np.asarray(data["e_" + x_name]),
+                e_y=np.asarray(data["e_" + y_name])
+            )
+            _store(out, "d_" + diag_name + "_" + name, distance)
+            _store(
+                out,
+                "p_" + diag_name + "_" + name,
+                misclassification_probability(distance),
+            )
+        else:
+            diag, c_diag = function(
+                *get_diag_ratios(data, diag_name, axes), use_limits=use_limits
+            )
+        _store(out, diag_name + "_" + name, diag)
+        _store(out, "c_" + diag_name + "_" + name, c_diag)
+        classes.append(diag)
+    if len(classes) < 3:
+        return out
+    # Final classification
+    final, final_to = diag_class_Sabater2012(*classes)
+    _store(out, "class_" + name, final)
+    _store(out, "class_to_" + name, final_to)
+    return out
+
+
+@instrumented
+def diag_CidFernandes2011_columns(data, distances=False, out=None):
+    """
+    Classification of Cid-Fernandes et al. 2011.
+    Columnar version of apply_diag_CidFernandes2011.
+    If distances is True, the "d_" and "p_" columns are added as in
+    diag_Sabater2012_columns.
+    """
+    name = "CidFernandes2011"
+    if out is None:
+        out = {}
+    errors = {}
+    if distances:
+        errors = {
+            "e_" + v: np.asarray(data["e_" + c])
+            for v, c in [
+                ("x", "nii_h_alpha"),
+                ("ew_ha", "ew_H_ALPHA"),
+                ("ew_nii", "ew_NII_6584"),
+            ]
+        }
+    result = diag_CidFernandes2011(
+        *[
+            np.asarray(data[c])
+            for c in [
+                "nii_h_alpha",
+                "c_nii_h_alpha",
+                "ew_H_ALPHA",
+                "c_ew_H_ALPHA",
+                "ew_NII_6584",
+                "c_ew_NII_6584",
+            ]
+        ],
+        **errors
+    )
+    _store(out, "whan_" + name, result[0])
+    _store(out, "c_whan_" + name, result[1])
+    if distances:
+        _store(out, "d_whan_" + name, result[2])
+        _store(out, "p_whan_" + name, misclassification_probability(result[2]))
+    return out
+
+
+@instrumented
+def classify_columns(
+    data, sigma=3.0, ew_method=1, use_limits=True, dtype=None, out=None, buffers=None
+):
+    """
+    Apply the full pipeline to numpy columns without pandas: clean the data,
+    get the ratios and apply the Sabater et al. 2012 and Cid-Fernandes et al.
+    2011 diagnostics.
+    Input:
+      data - dictionary of numpy arrays, numpy structured array or dataframe
+      dtype - float type of the cleaned columns (default: type of the input)
+      out - dictionary of output columns, e.g. preallocated with
+            allocate_columns; by default the cleaned columns are views of
+            the buffers of clean_kernel
+      buffers - buffers of clean_kernel reused between calls
+    Returns the dictionary with the derived columns.
+    """
+    if out is None:
+        out = {}
+    clean_columns(
+        data, sigma=sigma, ew_method=ew_method, dtype=dtype, out=out, buffers=buffers
+    )
+    combine_sii_columns(out, out=out)
+    ratio_columns(out, out=out)
+    diag_Sabater2012_columns(out, use_limits=use_limits, out=out)
+    diag_CidFernandes2011_columns(out, out=out)
+    return out
+
+
+##########################################
+# Pipeline on pandas dataframes
+##########################################
 
 
-def apply_diag_CidFernandes2011(df):
+def _assign(df, columns):
+    """
+    Add the derived columns to the dataframe.
+    Each array is released as soon as it is copied into the dataframe.
+    """
+    for name in list(columns):
+        df[name] = columns.pop(name)
+
+
+@instrumented
+def clean_data(df, sigma=3.0, ew_method=1, dtype=None):
+    """
+    Clean the line data.
+    Applies the correction factors to the errors.
+    """
+    _assign(df, clean_columns(df, sigma=sigma, ew_method=ew_method, dtype=dtype))
+
+
+@instrumented
+def combine_sii(df, param="flux"):
+    """
+    Combine the params (flux or ew) of the two SII lines
+    """
+    _assign(df, combine_sii_columns(df, param=param))
+
+
+@instrumented
+def get_ratios(df):
+    """
+    Get the line ratios used in the diagnostic diagrams.
+    """
+    combine_sii(df)
+    _assign(df, ratio_columns(df))
+
+
+@instrumented
+def apply_diag_CidFernandes2011(df, distances=False):
     """
     Obtain the classification from the Cid-Fernandes diagnostic diagrams.
     Appends to 'diagnostic' an array with the classification in each diagnostic diagram.
     Also appends to 'diagnostic' an array indicating if the galaxy was classified.
     """
-    name = "CidFernandes2011"
-    # if self.ratios == {}:
-    #     self.get_ratios()
-    x = df["nii_h_alpha"]
-    c_x = df["c_nii_h_alpha"]
-    ew_ha = df["ew_H_ALPHA"]
-    c_ew_ha = df["c_ew_H_ALPHA"]
-    ew_nii = df["ew_NII_6584"]
-    c_ew_nii = df["c_ew_NII_6584"]
-    diag, c_diag = diag_CidFernandes2011(x, c_x, ew_ha, c_ew_ha, ew_nii, c_ew_nii)
-    df["whan_" + name] = diag
-    df["c_whan_" + name] = c_diag
-
-
-def get_diag_ratios(df, diag_name):
-    global dict_diagnostic
-    x = df[dict_diagnostic[diag_name][0]]
-    y = df[dict_diagnostic[diag_name][1]]
-    c_x = df["c_" + dict_diagnostic[diag_name][0]]
-    c_y = df["c_" + dict_diagnostic[diag_name][1]]
+    _assign(df, diag_CidFernandes2011_columns(df, distances=distances))
+
+
+def get_diag_ratios(df, diag_name, axes=None):
+    if axes is None:
+        axes = dict_diagnostic
+    x = df[axes[diag_name][0]]
+    y = df[axes[diag_name][1]]
+    c_x = df["c_" + axes[diag_name][0]]
+    c_y = df["c_" + axes[diag_name][1]]
     return x, y, c_x, c_y
 
 
-def apply_diag_Sabater2012(df, use_limits=True):
+@instrumented
+def apply_diag_Sabater2012(df, use_limits=True, distances=False):
     """
     Obtain the classification from the three diagnostic diagrams.
     Appends to 'diagnostic' three arrays with the classification in each diagnostic diagram.
     Also appends to 'diagnostic' three arrays indicating if the galaxy was classified.
+    With distances=True, also the distances to the demarcation curves (see
+    diag_Sabater2012_columns).
     """
-    name = "Sabater2012"
-    # if self.ratios == {}:
-    #     self.get_ratios()
-    # NII diagnostic
-    df["nii_" + name], df["c_nii_" + name] = diag_nii_Sabater2012(
-        *get_diag_ratios(df, "nii"), use_limits=use_limits
+    _assign(
+        df, diag_Sabater2012_columns(df, use_limits=use_limits, distances=distances)
     )
-    # SII diagnostic
-    df["sii_" + name], df["c_sii_" + name] = diag_sii_Sabater2012(
-        *get_diag_ratios(df, "sii"), use_limits=use_limits
-    )
-    # OI diagnostic
-    df["oi_" + name], df["c_oi_" + name] = diag_oi_Sabater2012(
-        *get_diag_ratios(df, "oi"), use_limits=use_limits
-    )
-    # Final classification
-    df["class_" + name], df["class_to_" + name] = diag_class_Sabater2012(
-        df["nii_" + name], df["sii_" + name], df["oi_" + name]
+
+
+@instrumented
+def classify(df, sigma=3.0, ew_method=1, use_limits=True):
+    """
+    Apply the full pipeline to the dataframe: clean the data, get the ratios
+    and apply the Sabater et al. 2012 and Cid-Fernandes et al. 2011
+    diagnostics. The derived columns are added to the dataframe.
+    """
+    _assign(
+        df,
+        classify_columns(df, sigma=sigma, ew_method=ew_method, use_limits=use_limits),
     )
+    return df
+
+
+def iter_chunks(data, chunk_size):
+    """
+    Split a dataframe or a numpy structured array in chunks of chunk_size rows.
+    The dataframe chunks are copies, so that the pipeline does not write into
+    the original dataframe.
+    """
+    for start in range(0, len(data), chunk_size):
+        if hasattr(data, "iloc"):
+            yield data.iloc[start : start + chunk_size].copy()
+        else:
+            yield data[start : start + chunk_size]
+
+
+def classify_chunks(chunks, sigma=3.0, ew_method=1, use_limits=True):
+    """
+    Streaming version of classify.
+    The catalogue is given as an iterator of row chunks, either pandas
+    dataframes or numpy structured (record) arrays. The record arrays are
+    converted to dataframes indexed by the row number in the catalogue.
+    Yields the classified chunks one by one, so the memory used is
+    proportional to the chunk size. The concatenation of the chunks is
+    identical to the output of classify on the whole catalogue.
+    """
+    start = 0
+    for chunk in chunks:
+        if not hasattr(chunk, "columns"):
+            import pandas as pd
+
+            chunk = pd.DataFrame(chunk, index=pd.RangeIndex(start, start + len(chunk)))
+        start += len(chunk)
+        yield classify(chunk, sigma=sigma, ew_method=ew_method, use_limits=use_limits)
+
+
+##########################################
+# Input from MPA-JHU FITS files
+##########################################
+
+
+def read_gal_line(path, start=0, stop=None, hdu=1):
+    """
+    Read the line columns used by the pipeline (input_columns) from the rows
+    start:stop of an MPA-JHU gal_line FITS file (e.g. gal_line_dr7_v5_2.fit).
+    The file is memory-mapped, so only the requested rows are read.
+    Returns a numpy structured array.
+    """
+    return read_table(path, columns=input_columns, start=start, stop=stop, hdu=hdu)
+
+
+def iter_gal_line(path, chunk_size, hdu=1):
+    """
+    Read an MPA-JHU gal_line FITS file in chunks of chunk_size rows to feed
+    classify_chunks.
+    """
+    n_rows = table_layout(path, hdu=hdu)[1]
+    for start in range(0, n_rows, chunk_size):
+        yield read_gal_line(path, start=start, stop=start + chunk_size, hdu=hdu)
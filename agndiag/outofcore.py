@@ -0,0 +1,128 @@
+"""
+Out-of-core classification of catalogues larger than the memory.
+The input line columns are read block by block from memory-mapped files (a
+gal_line FITS file or a directory with one .npy file per column) and every
+column derived by classify_columns (cleaned fluxes and EW, ratios, classes
+of the diagrams and final classes) is written straight into a preallocated
+.npy file. The files are mapped again for each block, so the resident
+memory is bounded by the block size and not by the number of rows.
+
+Usage:
+    columns = classify_out_of_core("gal_line_dr7_v5_2.fit", "classified")
+"""
+__author__ = "jsm"
+import json
+import os
+import shutil
+import numpy as np
+from . import mpa_jhu
+from .cache import manifest_name
+from .fits import table_layout
+from .incremental import load_classification
+
+# Rows classified at a time
+default_block_size = 1000000
+
+
+def _is_fits(path):
+    return path.lower().endswith((".fit", ".fits", ".fts"))
+
+
+def count_rows(source):
+    """
+    Number of rows of an input of classify_out_of_core.
+    """
+    if isinstance(source, str):
+        if _is_fits(source):
+            return table_layout(source)[1]
+        column = os.path.join(source, mpa_jhu.input_columns[0] + ".npy")
+        return len(np.load(column, mmap_mode="r"))
+    return len(source[mpa_jhu.input_columns[0]])
+
+
+def read_rows(source, start, stop):
+    """
+    Input line columns of the rows start:stop.
+    Input:
+      source - gal_line FITS file, directory with one .npy file per input
+               column or mapping of arrays (e.g. memory maps)
+    Returns a structured array (FITS) or a dictionary of arrays in memory.
+    """
+    if isinstance(source, str):
+        if _is_fits(source):
+            return mpa_jhu.read_gal_line(source, start=start, stop=stop)
+        return {
+            name: np.array(
+                np.load(os.path.join(source, name + ".npy"), mmap_mode="r")[start:stop]
+            )
+            for name in mpa_jhu.input_columns
+        }
+    return {name: np.array(source[name][start:stop]) for name in mpa_jhu.input_columns}
+
+
+def allocate_files(path, columns, n):
+    """
+    Create one .npy file of n elements per column (list of (name, type)) in
+    the directory 'path', with the manifest of the columns.
+    """
+    os.makedirs(path)
+    for name, dtype in columns:
+        np.lib.format.open_memmap(
+            os.path.join(path, name + ".npy"), mode="w+", dtype=dtype, shape=(n,)
+        )
+    with open(os.path.join(path, manifest_name), "w") as f:
+        json.dump([name for name, dtype in columns], f)
+
+
+def classify_out_of_core(
+    source,
+    path,
+    block_size=default_block_size,
+    sigma=3.0,
+    ew_method=1,
+    use_limits=True,
+    dtype=None,
+):
+    """
+    Apply classify_columns to an input that does not fit in memory, writing
+    the derived columns into .npy files.
+    Input:
+      source - gal_line FITS file, directory with one .npy file per input
+               column or mapping of arrays (see read_rows)
+      path - output directory; it is written as path + ".tmp" and replaces
+             'path' once complete
+      block_size - rows classified at a time
+      sigma, ew_method, use_limits, dtype - as in classify_columns
+    Returns the derived columns as read-only memory maps (see
+    incremental.load_classification).
+    """
+    n = count_rows(source)
+    columns = mpa_jhu.output_columns(read_rows(source, 0, 0), dtype)
+    tmp = path.rstrip(os.sep) + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    allocate_files(tmp, columns, n)
+    buffers = {}
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        block = read_rows(source, start, stop)
+        maps = [
+            np.load(os.path.join(tmp, name + ".npy"), mmap_mode="r+")
+            for name, _ in columns
+        ]
+        out = {name: m[start:stop] for (name, _), m in zip(columns, maps)}
+        mpa_jhu.classify_columns(
+            block,
+            sigma=sigma,
+            ew_method=ew_method,
+            use_limits=use_limits,
+            dtype=dtype,
+            out=out,
+            buffers=buffers,
+        )
+        for m in maps:
+            m.flush()
+        del maps, out
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp, path)
+    return load_classification(path)
@@ -0,0 +1,108 @@
+"""
+Compact container of the classification of a catalogue.
+The codes of the diagrams, the final classification and the class TO of
+each galaxy fit in 4 bits and the applied flags in 1 bit, so they are
+packed into a single 32-bit record per galaxy instead of ten int32
+columns. The columns are decoded on access, the slices are views of the
+records and the records can be saved and memory-mapped back from disk.
+"""
+__author__ = "jsm"
+import numpy as np
+
+# Packed columns: [name, first bit, number of bits]
+fields = [
+    ["nii_Sabater2012", 0, 4],
+    ["sii_Sabater2012", 4, 4],
+    ["oi_Sabater2012", 8, 4],
+    ["class_Sabater2012", 12, 4],
+    ["class_to_Sabater2012", 16, 4],
+    ["whan_CidFernandes2011", 20, 4],
+    ["c_nii_Sabater2012", 24, 1],
+    ["c_sii_Sabater2012", 25, 1],
+    ["c_oi_Sabater2012", 26, 1],
+    ["c_whan_CidFernandes2011", 27, 1],
+]
+record_type = np.dtype(np.uint32)
+
+
+def pack(columns, out=None):
+    """
+    Pack the classification columns (e.g. the output of classify_columns
+    or a classified dataframe) into records.
+    Raises ValueError if a code does not fit in its bits.
+    """
+    n = len(np.asarray(columns[fields[0][0]]))
+    if out is None:
+        out = np.empty(n, dtype=record_type)
+    out.fill(0)
+    for name, shift, bits in fields:
+        values = np.asarray(columns[name])
+        if len(values) and (values.min() < 0 or values.max() >= 2**bits):
+            raise ValueError("{} does not fit in {} bits".format(name, bits))
+        out |= values.astype(record_type) << record_type.type(shift)
+    return out
+
+
+class PackedClassification:
+    """
+    Classification of a catalogue packed in one record per galaxy.
+    Indexing with a column name returns the decoded column; any other index
+    returns a PackedClassification of the selected records (a view for
+    slices).
+    """
+
+    def __init__(self, records):
+        # Keep the memory maps
+        self.records = records if isinstance(records, np.ndarray) else np.array(records)
+        if self.records.dtype != record_type:
+            raise ValueError("The records must be of type " + str(record_type))
+
+    @classmethod
+    def from_columns(cls, columns):
+        """
+        Pack the classification columns.
+        """
+        return cls(pack(columns))
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """
+        Open the records saved with save, memory-mapped by default.
+        """
+        return cls(np.load(path, mmap_mode=mmap_mode))
+
+    def save(self, path):
+        """
+        Save the records as a .npy file.
+        """
+        np.save(path, self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.column(key)
+        return PackedClassification(self.records[key])
+
+    @property
+    def nbytes(self):
+        return self.records.nbytes
+
+    def column(self, name, dtype=np.uint8):
+        """
+        Decoded column.
+        """
+        for field, shift, bits in fields:
+            if field == name:
+                values = self.records >> record_type.type(shift)
+                values &= record_type.type(2**bits - 1)
+                return values.astype(dtype)
+        raise KeyError(name)
+
+    def columns(self, dtype="i"):
+        """
+        Dictionary with all the decoded columns, of the type of the output of
+        the diagnostics by default.
+        """
+        return {name: self.column(name, dtype) for name, shift, bits in fields}
@@ -0,0 +1,115 @@
+"""
+Parallel classification of MPA-JHU catalogues with a pool of processes.
+The catalogue is split in shards of rows that are classified by the
+workers with mpa_jhu.classify. The input line columns are placed once in
+shared memory, so they are not pickled to every worker; only the derived
+columns are sent back.
+"""
+__author__ = "jsm"
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from .mpa_jhu import classify, input_columns
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+
+def classify_parallel(
+    df, n_workers=None, shard_size=None, sigma=3.0, ew_method=1, use_limits=True
+):
+    """
+    Parallel version of mpa_jhu.classify.
+    Input:
+      df - pandas dataframe with the MPA-JHU line columns
+      n_workers - number of processes (default: number of CPUs)
+      shard_size - rows per shard (default: four shards per worker)
+      sigma, ew_method, use_limits - passed to the pipeline
+    The derived columns are added to the dataframe in the same order and with
+    the same values as classify. With one worker, a single shard or without
+    shared memory support (Python < 3.8), the shards are classified serially
+    in this process, so the output never depends on the number of workers.
+    """
+    n = len(df)
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    serial = n_workers == 1 or shared_memory is None
+    if shard_size is None:
+        shard_size = max(1, n if serial else -(-n // (4 * n_workers)))
+    kwargs = dict(sigma=sigma, ew_method=ew_method, use_limits=use_limits)
+    bounds = [(start, min(start + shard_size, n)) for start in range(0, n, shard_size)]
+    if serial or len(bounds) <= 1:
+        results = [
+            _classify_columns(
+                {c: df[c].to_numpy()[start:stop] for c in input_columns}, kwargs
+            )
+            for start, stop in bounds
+        ]
+    else:
+        results = _classify_shared(df, bounds, n_workers, kwargs)
+    if results:
+        import pandas as pd
+
+        derived = pd.concat(results, ignore_index=True)
+        for column in derived.columns:
+            df[column] = derived[column].to_numpy()
+    return df
+
+
+def _classify_shared(df, bounds, n_workers, kwargs):
+    """
+    Classify the shards in a process pool reading the input columns from a
+    shared memory block.
+    """
+    n = len(df)
+    layout = []
+    offset = 0
+    for column in input_columns:
+        dtype = df[column].dtype
+        layout.append((column, dtype.str, offset))
+        offset += -(-n * dtype.itemsize // 8) * 8  # Keep the columns aligned
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    try:
+        for column, dtype, start in layout:
+            view = np.ndarray(n, dtype=dtype, buffer=shm.buf, offset=start)
+            view[:] = df[column].to_numpy()
+            del view
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = [
+                pool.submit(_classify_shard, shm.name, layout, n, start, stop, kwargs)
+                for start, stop in bounds
+            ]
+            return [f.result() for f in futures]
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _classify_shard(shm_name, layout, n, start, stop, kwargs):
+    """
+    Worker: classify the rows start:stop of the columns in shared memory.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        columns = {
+            column: np.ndarray(n, dtype=dtype, buffer=shm.buf, offset=offset)[
+                start:stop
+            ].copy()
+            for column, dtype, offset in layout
+        }
+    finally:
+        shm.close()
+    return _classify_columns(columns, kwargs)
+
+
+def _classify_columns(columns, kwargs):
+    """
+    Classify a shard given as a dictionary of input columns and return only
+    the derived columns.
+    """
+    import pandas as pd
+
+    df = classify(pd.DataFrame(columns), **kwargs)
+    return df.drop(columns=list(columns))
@@ -0,0 +1,149 @@
+"""
+Declarative configuration of the pipeline compiled into execution plans.
+A configuration holds the correction factors of the lines, the cleaning
+parameters and the requested outputs instead of the module globals of
+mpa_jhu, so several configurations (e.g. the correction factors of two data
+releases) can be run in the same process. Its plan only cleans the lines
+(and their equivalent widths) and computes the ratios and diagrams that
+the outputs depend on. The plans are cached per configuration.
+
+Usage:
+    config = make_config(outputs=["nii_Sabater2012"])
+    columns = run(config, data)
+"""
+__author__ = "jsm"
+import functools
+from collections import namedtuple
+import numpy as np
+from . import mpa_jhu
+
+Config = namedtuple(
+    "Config", ["factors", "sigma", "ew_method", "use_limits", "outputs", "dtype"]
+)
+Plan = namedtuple("Plan", ["config", "lines", "ratios", "diagrams", "steps"])
+
+# Outputs that can be requested and the diagrams they need ("whan" is the
+# diagram of Cid-Fernandes et al. 2011)
+dict_outputs = {
+    "nii_Sabater2012": ["nii"],
+    "sii_Sabater2012": ["sii"],
+    "oi_Sabater2012": ["oi"],
+    "class_Sabater2012": ["nii", "sii", "oi"],
+    "whan_CidFernandes2011": ["whan"],
+}
+# Lines of the combined SII flux
+sii_lines = ["SII_6717", "SII_6731"]
+
+
+def make_config(
+    factors=None, sigma=3.0, ew_method=1, use_limits=True, outputs=None, dtype=None
+):
+    """
+    Configuration of the pipeline.
+    Input:
+      factors - dictionary with the correction factor of the errors of each
+                line (default: mpa_jhu.cor_factor)
+      sigma, ew_method, use_limits, dtype - as in classify_columns
+      outputs - classification columns required (default: all of
+                dict_outputs); their applied flags and the intermediate
+                columns are also returned; an empty list raises ValueError
+    """
+    if factors is None:
+        factors = dict(zip(mpa_jhu.name_lines, mpa_jhu.cor_factor))
+    if outputs is None:
+        outputs = list(dict_outputs)
+    if len(outputs) == 0:
+        raise ValueError("No outputs requested")
+    for name in outputs:
+        if name not in dict_outputs:
+            raise ValueError("Unknown output: " + name)
+    return Config(
+        tuple((line, float(factors[line])) for line in mpa_jhu.name_lines),
+        float(sigma),
+        ew_method,
+        bool(use_limits),
+        tuple(name for name in dict_outputs if name in outputs),
+        None if dtype is None else np.dtype(dtype).str,
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def compile_plan(config):
+    """
+    Execution plan of a configuration: the lines, ratios and diagrams needed
+    by the outputs and the list of steps as (function, keyword arguments).
+    The tables of mpa_jhu (lines, correction factors, ratio definitions and
+    axes of the diagrams) are resolved here and passed to the steps.
+    """
+    diagrams = []
+    for name in config.outputs:
+        diagrams += [d for d in dict_outputs[name] if d not in diagrams]
+    ratios = []
+    for diagram in diagrams:
+        needed = (
+            ["nii_h_alpha"] if diagram == "whan" else mpa_jhu.dict_diagnostic[diagram]
+        )
+        ratios += [r for r in needed if r not in ratios]
+    # Lines whose EW are used by the diagram of Cid-Fernandes et al. 2011
+    ew_lines = ["H_ALPHA", "NII_6584"]
+    lines = set(ew_lines if "whan" in diagrams else [])
+    for ratio in ratios:
+        for line in mpa_jhu.dict_ratios[ratio]:
+            lines.update(sii_lines if line == "SII" else [line])
+    lines = [line for line in mpa_jhu.name_lines if line in lines]
+    factors = dict(config.factors)
+    steps = [
+        (
+            mpa_jhu.clean_columns,
+            {
+                "sigma": config.sigma,
+                "ew_method": config.ew_method,
+                "dtype": config.dtype,
+                "lines": lines,
+                "factors": [factors[line] for line in lines],
+                # Only the diagram of Cid-Fernandes et al. 2011 uses EW
+                "equivalent_widths": ew_lines if "whan" in diagrams else [],
+            },
+        )
+    ]
+    if "SII_6717" in lines:
+        steps.append((mpa_jhu.combine_sii_columns, {}))
+    steps.append(
+        (
+            mpa_jhu.ratio_columns,
+            {
+                "ratios": ratios,
+                "definitions": {r: mpa_jhu.dict_ratios[r] for r in ratios},
+            },
+        )
+    )
+    sabater = [d for d in diagrams if d != "whan"]
+    if sabater:
+        steps.append(
+            (
+                mpa_jhu.diag_Sabater2012_columns,
+                {
+                    "use_limits": config.use_limits,
+                    "diagrams": sabater,
+                    "axes": {d: mpa_jhu.dict_diagnostic[d] for d in sabater},
+                },
+            )
+        )
+    if "whan" in diagrams:
+        steps.append((mpa_jhu.diag_CidFernandes2011_columns, {}))
+    return Plan(config, lines, ratios, diagrams, steps)
+
+
+def run(config, data, out=None):
+    """
+    Apply the plan of a configuration to the data (any source accepted by
+    classify_columns). Returns the dictionary with the derived columns.
+    """
+    plan = compile_plan(config)
+    if out is None:
+        out = {}
+    source = data
+    for function, kwargs in plan.steps:
+        function(source, out=out, **kwargs)
+        source = out
+    return out
@@ -0,0 +1,173 @@
+"""
+Parameter sweeps of the pipeline over sigma and use_limits.
+The raw line columns are read and their errors corrected once. The lines
+are cleaned for all the values of sigma in one pass of clean_kernel (each
+sigma is a group of columns with its own threshold). The ratios and the
+Cid-Fernandes et al. 2011 diagram, which do not depend on use_limits, are
+computed once per sigma, and so is the region of each galaxy in the
+Sabater et al. 2012 diagrams, which is shared by the values of use_limits
+(see lineclass.diag_Sabater2012_sweep).
+
+Usage:
+    result = sweep(data, sigmas=[2.0, 3.0, 5.0], use_limits=[True, False])
+    classes = result.columns[3.0, True]["class_Sabater2012"]
+    frame = to_frame(result)
+"""
+__author__ = "jsm"
+import time
+from collections import namedtuple
+import numpy as np
+from . import mpa_jhu
+from .lineclass import diag_class_Sabater2012, diag_Sabater2012_sweep
+
+Sweep = namedtuple("Sweep", ["parameters", "columns", "timings"])
+
+# Stages of the sweep timed in Sweep.timings
+stages = ["load", "clean", "ratios", "diagrams"]
+
+
+def clean_sweep(data, sigmas, dtype=None, block_size=None, timings=None):
+    """
+    Clean the lines for several values of sigma at once.
+    Input:
+      data - raw line columns (as in clean_columns)
+      sigmas - values of sigma
+      dtype - as in clean_columns
+      block_size - rows cleaned at a time (default: those of clean_columns
+                   divided by the number of sigmas, so that the blocks have
+                   the same size)
+      timings - dictionary where the time of the "load" and "clean" stages
+                is accumulated
+    Returns a list with the cleaned columns of each sigma, equal to those of
+    clean_columns with that sigma.
+    """
+    if timings is None:
+        timings = dict.fromkeys(stages, 0.0)
+    if block_size is None:
+        block_size = max(32768 // len(sigmas), 1)
+    lines = mpa_jhu.name_lines
+    n_lines = len(lines)
+    inputs = [
+        [np.asarray(data[line + p]) for line in lines] for p in mpa_jhu.name_params
+    ]
+    if dtype is None:
+        dtype = np.result_type(*[c for columns in inputs for c in columns], np.float16)
+    n = len(inputs[0][0])
+    width = n_lines * len(sigmas)
+    factors = np.asarray(mpa_jhu.cor_factor, dtype=dtype)
+    thresholds = np.repeat(np.asarray(sigmas, dtype=dtype), n_lines)
+    names = ["flux", "e_flux", "c_flux", "ew", "e_ew", "c_ew"]
+    clean = {
+        name: np.empty((n, width), dtype if name[0] != "c" else np.int8, order="F")
+        for name in names
+    }
+    scratch = {}
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        t0 = time.perf_counter()
+        # Raw columns read and errors corrected once for all the sigmas, in
+        # the type that clean_kernel uses for the correction
+        stacks = []
+        for i, columns in enumerate(inputs):
+            raw_type = np.result_type(*columns)
+            if i % 2:  # Errors
+                raw_type = np.result_type(raw_type, dtype)
+            raw = mpa_jhu._buffer(
+                scratch, "raw" + str(i), (stop - start, n_lines), raw_type
+            )
+            for j, column in enumerate(columns):
+                raw[:, j] = column[start:stop]
+            if i % 2:
+                raw *= factors
+            stack = mpa_jhu._buffer(
+                scratch, "stack" + str(i), (stop - start, width), raw_type
+            )
+            for k in range(len(sigmas)):
+                stack[:, k * n_lines : (k + 1) * n_lines] = raw
+            stacks.append(stack)
+        t1 = time.perf_counter()
+        mpa_jhu.clean_kernel(
+            *stacks,
+            sigma=thresholds,
+            factors=np.ones(width, dtype=dtype),
+            dtype=dtype,
+            out={name: a[start:stop] for name, a in clean.items()},
+            scratch=scratch
+        )
+        timings["load"] += t1 - t0
+        timings["clean"] += time.perf_counter() - t1
+    return [
+        {
+            name + "_" + line: clean[name][:, k * n_lines + i]
+            for i, line in enumerate(lines)
+            for name in names
+        }
+        for k in range(len(sigmas))
+    ]
+
+
+def sweep(data, sigmas=(2.0, 3.0, 5.0), use_limits=(True, False), dtype=None):
+    """
+    Classify the data with every combination of sigma and use_limits.
+    Input:
+      data - raw line columns (as in classify_columns)
+      sigmas - values of sigma of the cleaning
+      use_limits - values of use_limits of the Sabater et al. 2012 diagrams
+      dtype - as in classify_columns
+    Output (Sweep):
+      parameters - list of the parameter sets (sigma, use_limits)
+      columns - dictionary with the classification columns of each parameter
+                set (the diagrams of Sabater et al. 2012, their final class
+                and the diagram of Cid-Fernandes et al. 2011), equal to those
+                of classify_columns with the same parameters
+      timings - seconds spent in each stage and "saved", a lower bound of
+                the time that repeating the shared stages for each parameter
+                set would have taken
+    """
+    timings = dict.fromkeys(stages, 0.0)
+    cleaned = clean_sweep(data, sigmas, dtype=dtype, timings=timings)
+    columns = {}
+    for sigma, out in zip(sigmas, cleaned):
+        t0 = time.perf_counter()
+        mpa_jhu.combine_sii_columns(out, out=out)
+        mpa_jhu.ratio_columns(out, out=out)
+        whan = mpa_jhu.diag_CidFernandes2011_columns(out)
+        t1 = time.perf_counter()
+        classes = {u: {} for u in use_limits}
+        for name in ["nii", "sii", "oi"]:
+            results = diag_Sabater2012_sweep(
+                name, *mpa_jhu.get_diag_ratios(out, name), use_limits=use_limits
+            )
+            for u, (diag, c_diag) in zip(use_limits, results):
+                classes[u][name + "_Sabater2012"] = diag
+                classes[u]["c_" + name + "_Sabater2012"] = c_diag
+        for u in use_limits:
+            final, final_to = diag_class_Sabater2012(
+                *[classes[u][name + "_Sabater2012"] for name in ["nii", "sii", "oi"]]
+            )
+            classes[u]["class_Sabater2012"] = final
+            classes[u]["class_to_Sabater2012"] = final_to
+            classes[u].update(whan)
+            columns[float(sigma), bool(u)] = classes[u]
+        timings["ratios"] += t1 - t0
+        timings["diagrams"] += time.perf_counter() - t1
+    n_sets = len(columns)
+    per_sigma = timings["ratios"] / max(len(sigmas), 1)
+    timings["saved"] = timings["load"] * (n_sets - 1) + per_sigma * (
+        n_sets - len(sigmas)
+    )
+    return Sweep(list(columns), columns, timings)
+
+
+def to_frame(result):
+    """
+    Tidy pandas dataframe of a sweep with one row per galaxy and parameter
+    set, indexed by (sigma, use_limits, row).
+    """
+    import pandas as pd
+
+    return pd.concat(
+        [pd.DataFrame(result.columns[p]) for p in result.parameters],
+        keys=result.parameters,
+        names=["sigma", "use_limits", "row"],
+    )
@@ -0,0 +1,48 @@
+"""
+Synthetic MPA-JHU-like line catalogues for testing and benchmarking.
+"""
+import numpy as np
+from .mpa_jhu import name_lines
+
+# Typical flux of each line relative to H_ALPHA for star forming galaxies
+_relative_flux = {
+    "H_BETA": 0.3,
+    "OIII_5007": 0.3,
+    "OI_6300": 0.05,
+    "H_ALPHA": 1.0,
+    "NII_6584": 0.4,
+    "SII_6717": 0.2,
+    "SII_6731": 0.15,
+}
+
+
+def mpa_jhu_catalogue(n, seed=0, bad_fraction=0.02):
+    """
+    Generate the line columns (*_FLUX, *_FLUX_ERR, *_CONT, *_CONT_ERR) of a
+    synthetic MPA-JHU catalogue with n rows.
+    The catalogue mixes star forming and AGN-like line ratios, faint galaxies
+    with lines below the detection limit, negative fluxes and a fraction of
+    flagged lines (non positive errors).
+    Returns a dictionary of numpy arrays.
+    """
+    rng = np.random.default_rng(seed)
+    h_alpha = 10 ** rng.normal(2.0, 0.8, n)
+    # Excitation of the forbidden lines: star forming, TO and AGN
+    excitation = 10 ** rng.choice([0.0, 0.3, 0.6], n, p=[0.6, 0.15, 0.25])
+    noise = 10 ** rng.normal(0.5, 0.3, n)
+    data = {}
+    for line in name_lines:
+        flux = h_alpha * _relative_flux[line]
+        if line not in ["H_ALPHA", "H_BETA"]:
+            flux = flux * excitation * 10 ** rng.normal(0.0, 0.15, n)
+        e_flux = noise * rng.uniform(0.5, 1.5, n)
+        flux = flux + rng.normal(0.0, 1.0, n) * e_flux
+        e_flux[rng.random(n) < bad_fraction] = rng.choice([0.0, -1.0])
+        cont = 10 ** rng.normal(1.0, 0.5, n)
+        e_cont = cont * rng.uniform(0.01, 0.5, n)
+        e_cont[rng.random(n) < bad_fraction / 2] = 0.0
+        data[line + "_FLUX"] = flux
+        data[line + "_FLUX_ERR"] = e_flux
+        data[line + "_CONT"] = cont
+        data[line + "_CONT_ERR"] = e_cont
+    return data
@@ -0,0 +1,49 @@
+"""
+Comparison of the pandas dataframe pipeline (mpa_jhu.classify) with the
+columnar numpy pipeline (mpa_jhu.classify_columns).
+
+Usage: python benchmarks/bench_columns.py [n_rows ...]
+"""
+
+import sys
+import time
+import tracemalloc
+import warnings
+import numpy as np
+from agndiag import mpa_jhu
+from agndiag.synthetic import mpa_jhu_catalogue
+
+
+def measure(function, *args):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    function(*args)
+    elapsed = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main(sizes):
+    print("{:>10} {:>12} {:>10} {:>10}".format("rows", "path", "time", "peak"))
+    for n in sizes:
+        data = mpa_jhu_catalogue(n)
+        records = np.rec.fromarrays(list(data.values()), names=list(data))
+        cases = [("dict", mpa_jhu.classify_columns, data)]
+        cases.append(("records", mpa_jhu.classify_columns, records))
+        try:
+            import pandas as pd
+
+            cases.append(("dataframe", mpa_jhu.classify, pd.DataFrame(data)))
+        except ImportError:
+            pass
+        for name, function, arg in cases:
+            t, peak = measure(function, arg)
+            print(
+                "{:>10d} {:>12} {:>9.2f}s {:>8.1f}MB".format(n, name, t, peak / 2**20)
+            )
+
+
+if __name__ == "__main__":
+    warnings.simplefilter("ignore")
+    main([int(float(a)) for a in sys.argv[1:]] or [10**5, 10**6])
@@ -0,0 +1,39 @@
+"""
+Speed-up of the process-pool classification of agndiag.parallel with
+respect to the serial pipeline.
+
+Usage: python benchmarks/bench_parallel.py [n_rows [n_workers ...]]
+"""
+
+import os
+import sys
+import time
+import warnings
+import pandas as pd
+from agndiag.mpa_jhu import classify
+from agndiag.parallel import classify_parallel
+from agndiag.synthetic import mpa_jhu_catalogue
+
+
+def timed(function, *args, **kwargs):
+    t0 = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - t0
+
+
+def main(n, workers):
+    data = mpa_jhu_catalogue(n)
+    t_serial = timed(classify, pd.DataFrame(data))
+    print("{:>8} {:>10} {:>8}".format("workers", "time", "speed-up"))
+    print("{:>8} {:>9.2f}s {:>8.2f}".format("serial", t_serial, 1.0))
+    for n_workers in workers:
+        t = timed(classify_parallel, pd.DataFrame(data), n_workers=n_workers)
+        print("{:>8d} {:>9.2f}s {:>8.2f}".format(n_workers, t, t_serial / t))
+
+
+if __name__ == "__main__":
+    warnings.simplefilter("ignore")
+    n = int(float(sys.argv[1])) if len(sys.argv) > 1 else 10**6
+    cpus = os.cpu_count() or 1
+    workers = [int(w) for w in sys.argv[2:]] or sorted({1, 2, 4, 8, cpus})
+    main(n, workers)
@@ -0,0 +1,72 @@
+"""
+Benchmark of the evaluation of the rules of the diagnostic diagrams.
+Compares the materialisation of all the masks followed by apply_conditions
+with the blocked evaluation of evaluate_rules.
+
+Usage: python benchmarks/bench_rules.py [n_rows ...]
+"""
+
+import sys
+import time
+import tracemalloc
+import numpy as np
+from agndiag import lineclass
+
+
+def random_diagram(n, seed=0):
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(-2.0, 1.0, n)
+    y = rng.uniform(-1.5, 1.5, n)
+    c_x = rng.choice([0, 0, 0, 1, 2, 3, -1], n)
+    c_y = rng.choice([0, 0, 0, 1, 2, 3, -1], n)
+    return x, y, c_x, c_y
+
+
+def materialised(cond_init, rules, *arrays):
+    conditions = [[rule(*arrays), code] for rule, code in rules]
+    return lineclass.apply_conditions(cond_init(*arrays), conditions)
+
+
+def measure(function, *args):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    function(*args)
+    elapsed = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main(sizes):
+    cases = [
+        ("nii", lineclass.only_detections, lineclass.rules_nii_Sabater2012),
+        (
+            "nii limits",
+            lineclass.detections_and_limits,
+            lineclass._rules_nii_Sabater2012_limits,
+        ),
+        (
+            "sii limits",
+            lineclass.detections_and_limits,
+            lineclass._rules_sii_Sabater2012_limits,
+        ),
+    ]
+    print(
+        "{:>10} {:>12} {:>12} {:>12} {:>12} {:>12}".format(
+            "rows", "rules", "old time", "old peak", "new time", "new peak"
+        )
+    )
+    for n in sizes:
+        arrays = random_diagram(n)
+        for name, cond_init, rules in cases:
+            t_old, m_old = measure(materialised, cond_init, rules, *arrays)
+            t_new, m_new = measure(lineclass.evaluate_rules, cond_init, rules, *arrays)
+            print(
+                "{:>10d} {:>12} {:>11.3f}s {:>10.1f}MB {:>11.3f}s {:>10.1f}MB".format(
+                    n, name, t_old, m_old / 2**20, t_new, m_new / 2**20
+                )
+            )
+
+
+if __name__ == "__main__":
+    main([int(float(a)) for a in sys.argv[1:]] or [10**6, 10**7])
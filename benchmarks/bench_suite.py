@@ -0,0 +1,197 @@
+"""
+Benchmark suite of the diagnostic diagrams, the final classification
+tables, the cleaning of the data and the full pipeline.
+Synthetic MPA-JHU-like catalogues (agndiag.synthetic) with a fixed seed are
+used, so the inputs are the same in every run. Each case is timed as the
+best of several repetitions and the results are written as JSON, so the
+runs of two versions can be compared with --compare.
+
+Usage: python benchmarks/bench_suite.py [-n 1e4 1e5 1e6] [-r 3] [-o out.json]
+           [--memory] [--compare baseline.json]
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import warnings
+from functools import partial
+import numpy as np
+import agndiag
+from agndiag import lineclass, mpa_jhu
+from agndiag.synthetic import mpa_jhu_catalogue
+
+
+def cases(data, use_limits):
+    """
+    Cases to benchmark for a catalogue as (name, function) pairs.
+    The inputs of the diagrams and the tables are derived beforehand, so
+    only the function itself is timed.
+    """
+    derived = mpa_jhu.classify_columns(data, use_limits=use_limits)
+    diagrams = {
+        name: mpa_jhu.get_diag_ratios(derived, name) for name in ["nii", "sii", "oi"]
+    }
+    classes = [derived[name + "_Sabater2012"] for name in ["nii", "sii", "oi"]]
+    whan = [
+        derived[c]
+        for c in [
+            "nii_h_alpha",
+            "c_nii_h_alpha",
+            "ew_H_ALPHA",
+            "c_ew_H_ALPHA",
+            "ew_NII_6584",
+            "c_ew_NII_6584",
+        ]
+    ]
+    result = []
+    for name, args in diagrams.items():
+        function = getattr(lineclass, "diag_{}_Sabater2012".format(name))
+        result.append(
+            (function.__name__, partial(function, *args, use_limits=use_limits))
+        )
+    result.append(
+        (
+            "diag_CidFernandes2011",
+            partial(lineclass.diag_CidFernandes2011, *whan, use_limits=use_limits),
+        )
+    )
+    if use_limits:  # The tables and the cleaning do not depend on use_limits
+        for name in [
+            "diag_class_Sabater2012",
+            "diag_class_OiSiiNii",
+            "diag_class_OiSiiNiiMine",
+            "diag_class_general",
+        ]:
+            result.append((name, partial(getattr(lineclass, name), *classes)))
+        result.append(("clean_columns", partial(mpa_jhu.clean_columns, data)))
+        try:
+            import pandas as pd
+
+            df = pd.DataFrame(data)
+            # Includes the copy of the input, so the columns are added anew
+            result.append(("clean_data", lambda: mpa_jhu.clean_data(df.copy())))
+        except ImportError:
+            pass
+    result.append(
+        (
+            "classify_columns",
+            partial(mpa_jhu.classify_columns, data, use_limits=use_limits),
+        )
+    )
+    return result
+
+
+def measure(function, repeat, memory):
+    """
+    Best time of 'repeat' runs and, optionally, the peak of the memory
+    allocated in an additional run.
+    """
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - t0)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def run(sizes, repeat=3, memory=False, seed=0):
+    results = []
+    for n in sizes:
+        data = mpa_jhu_catalogue(n, seed=seed)
+        for use_limits in [True, False]:
+            for name, function in cases(data, use_limits):
+                seconds, peak = measure(function, repeat, memory)
+                results.append(
+                    {
+                        "name": name,
+                        "rows": n,
+                        "use_limits": use_limits,
+                        "seconds": seconds,
+                        "rows_per_second": n / seconds if seconds > 0 else None,
+                        "peak_bytes": peak,
+                    }
+                )
+                print(
+                    "{:>24} {:>9d} {:>6} {:>10.4f}s".format(
+                        name, n, str(use_limits), seconds
+                    ),
+                    file=sys.stderr,
+                )
+    return {
+        "meta": {
+            "agndiag": agndiag.__version__,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "seed": seed,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def _key(result):
+    return result["name"], result["rows"], result["use_limits"]
+
+
+def compare(report, baseline):
+    """
+    Print the ratio of the times of the report to those of the baseline.
+    """
+    old = {_key(r): r["seconds"] for r in baseline["results"]}
+    print(
+        "{:>24} {:>9} {:>6} {:>10} {:>10} {:>7}".format(
+            "name", "rows", "limits", "old", "new", "ratio"
+        )
+    )
+    for r in report["results"]:
+        if _key(r) in old:
+            print(
+                "{:>24} {:>9d} {:>6} {:>9.4f}s {:>9.4f}s {:>7.2f}".format(
+                    r["name"],
+                    r["rows"],
+                    str(r["use_limits"]),
+                    old[_key(r)],
+                    r["seconds"],
+                    r["seconds"] / old[_key(r)],
+                )
+            )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "-n", "--sizes", nargs="+", default=["1e4", "1e5", "1e6"], help="rows"
+    )
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    parser.add_argument("-o", "--output", help="JSON file with the results")
+    parser.add_argument("--memory", action="store_true", help="measure peak memory")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    args = parser.parse_args(argv)
+    report = run(
+        [int(float(n)) for n in args.sizes], repeat=args.repeat, memory=args.memory
+    )
+    text = json.dumps(report, indent=1)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    warnings.simplefilter("ignore")
+    main()
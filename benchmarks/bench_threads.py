@@ -0,0 +1,130 @@
+"""
+Scaling of the threaded evaluation of the diagnostic diagrams with the
+number of threads (the n_threads option of the diag functions).
+A synthetic MPA-JHU-like catalogue with a fixed seed is classified with
+each number of threads; the times and the speed-up relative to one thread
+are written as JSON.
+
+Usage: python benchmarks/bench_threads.py [-n 1e7] [-t 1 2 4 8 16 32 64]
+           [-r 3] [-o out.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import warnings
+from functools import partial
+import numpy as np
+import agndiag
+from agndiag import lineclass, mpa_jhu
+from agndiag.synthetic import mpa_jhu_catalogue
+from bench_suite import measure
+
+
+def cases(data, use_limits, n_threads):
+    """
+    Diagrams to benchmark with a number of threads as (name, function).
+    """
+    derived = mpa_jhu.classify_columns(data, use_limits=use_limits)
+    result = []
+    for name in ["nii", "sii", "oi"]:
+        function = getattr(lineclass, "diag_{}_Sabater2012".format(name))
+        args = mpa_jhu.get_diag_ratios(derived, name)
+        result.append(
+            (
+                function.__name__,
+                partial(function, *args, use_limits=use_limits, n_threads=n_threads),
+            )
+        )
+    whan = [
+        derived[c]
+        for c in [
+            "nii_h_alpha",
+            "c_nii_h_alpha",
+            "ew_H_ALPHA",
+            "c_ew_H_ALPHA",
+            "ew_NII_6584",
+            "c_ew_NII_6584",
+        ]
+    ]
+    result.append(
+        (
+            "diag_CidFernandes2011",
+            partial(
+                lineclass.diag_CidFernandes2011,
+                *whan,
+                use_limits=use_limits,
+                n_threads=n_threads
+            ),
+        )
+    )
+    return result
+
+
+def run(n, threads, repeat=3, seed=0):
+    data = mpa_jhu_catalogue(n, seed=seed)
+    results = []
+    single = {}
+    for n_threads in threads:
+        for use_limits in [True, False]:
+            for name, function in cases(data, use_limits, n_threads):
+                seconds = measure(function, repeat, False)[0]
+                single.setdefault((name, use_limits), seconds)
+                results.append(
+                    {
+                        "name": name,
+                        "rows": n,
+                        "use_limits": use_limits,
+                        "n_threads": n_threads,
+                        "seconds": seconds,
+                        "speedup": single[(name, use_limits)] / seconds,
+                    }
+                )
+                print(
+                    "{:>24} {:>6} {:>3d} {:>9.4f}s {:>6.2f}".format(
+                        name,
+                        str(use_limits),
+                        n_threads,
+                        seconds,
+                        results[-1]["speedup"],
+                    ),
+                    file=sys.stderr,
+                )
+    return {
+        "meta": {
+            "agndiag": agndiag.__version__,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "seed": seed,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-n", "--rows", default="1e7", help="rows")
+    parser.add_argument(
+        "-t", "--threads", nargs="+", type=int, default=[1, 2, 4, 8, 16, 32, 64]
+    )
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    parser.add_argument("-o", "--output", help="JSON file with the results")
+    args = parser.parse_args(argv)
+    report = run(int(float(args.rows)), args.threads, repeat=args.repeat)
+    text = json.dumps(report, indent=1)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    warnings.simplefilter("ignore")
+    main()
@@ -1,5 +1,25 @@
+import json
+import itertools
+import os
+import tempfile
+import tracemalloc
 import unittest
+import numpy as np
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+try:
+    import dask
+    import dask.array as da
+except ImportError:
+    dask = None
 from agndiag import __version__
+from agndiag import backend, batch, cache, cli, fits, incremental, instrument, lazy
+from agndiag import lineclass, montecarlo, mpa_jhu, outofcore, packed, parallel
+from agndiag import plan, sweep
+from agndiag.synthetic import mpa_jhu_catalogue
 from agndiag.mpa_jhu import diag_nii_Sabater2012, diag_oi_Sabater2012, diag_sii_Sabater2012
 
 
@@ -249,5 +269,1165 @@ class TestSabater2012(unittest.TestCase):
             self.assertEqual(diag[0], t[4])
 
 
+class TestClassTables(unittest.TestCase):
+    """
+    Test the compiled tables of the final classification against the
+    row by row application of the tables.
+    """
+
+    def setUp(self):
+        codes = np.arange(-2, 13)
+        grid = np.meshgrid(codes, codes, codes, indexing="ij")
+        self.classes = [g.ravel().astype("i") for g in grid]
+
+    def check(self, function, reference):
+        for classes in [self.classes, [c.astype(float) for c in self.classes]]:
+            out = function(*classes)
+            expected = reference(*classes)
+            self.assertEqual(out.dtype, expected.dtype)
+            np.testing.assert_array_equal(out, expected)
+
+    def test_sabater2012(self):
+        def reference(class_nii, class_sii, class_oi):
+            sii_oi = lineclass.apply_table(
+                lineclass.table_Sabater2012_sii_oi, class_sii, class_oi
+            )
+            s_sii_oi = lineclass.apply_table(
+                lineclass.table_Sabater2012_sim, class_sii, class_oi
+            )
+            return [
+                lineclass.apply_table(t, class_nii, sii_oi, s_sii_oi)
+                for t in [
+                    lineclass.table_Sabater2012_class,
+                    lineclass.table_Sabater2012_class_to,
+                ]
+            ]
+
+        self.check(
+            lambda *c: lineclass.diag_class_Sabater2012(*c)[0],
+            lambda *c: reference(*c)[0],
+        )
+        self.check(
+            lambda *c: lineclass.diag_class_Sabater2012(*c)[1],
+            lambda *c: reference(*c)[1],
+        )
+
+    def test_three_diagrams(self):
+        for function, table in [
+            (lineclass.diag_class_OiSiiNii, lineclass.table_OiSiiNii),
+            (lineclass.diag_class_OiSiiNiiMine, lineclass.table_OiSiiNiiMine),
+            (lineclass.diag_class_general, lineclass.table_general),
+        ]:
+            self.check(function, lambda *c: lineclass.apply_table(table, *c))
+
+    def test_non_integer_codes(self):
+        class_nii = np.array([1.0, 1.5, np.nan, 5.0])
+        class_sii = np.array([1.0, 1.0, 1.0, 2.0])
+        class_oi = np.array([1.0, 1.0, 1.0, 2.0])
+        final, final_to = lineclass.diag_class_Sabater2012(
+            class_nii, class_sii, class_oi
+        )
+        np.testing.assert_array_equal(final, [1.0, 0.0, 0.0, 2.0])
+
+
+class TestEvaluateRules(unittest.TestCase):
+    """
+    Test the blocked evaluation of the rules against apply_conditions.
+    """
+
+    def test_same_as_apply_conditions(self):
+        rng = np.random.default_rng(0)
+        x = rng.uniform(-2.0, 1.0, 1000)
+        y = rng.uniform(-1.5, 1.5, 1000)
+        c_x = rng.integers(-2, 4, 1000)
+        c_y = rng.integers(-2, 4, 1000)
+        rules = lineclass._rules_nii_Sabater2012_limits
+        cond_init = lineclass.detections_and_limits
+        expected = lineclass.apply_conditions(
+            cond_init(x, y, c_x, c_y),
+            [[rule(x, y, c_x, c_y), code] for rule, code in rules],
+        )
+        for block_size in [1, 7, 1000, 5000]:
+            diag, c_diag = lineclass.evaluate_rules(
+                cond_init, rules, x, y, c_x, c_y, block_size=block_size
+            )
+            np.testing.assert_array_equal(diag, expected[0])
+            np.testing.assert_array_equal(c_diag, expected[1])
+
+    def test_last_rule_wins(self):
+        rules = [[lambda a: a > 0, 1], [lambda a: a > 1, 0], [lambda a: a > 2, 3]]
+        diag, c_diag = lineclass.evaluate_rules(
+            lambda a: a < 4, rules, np.arange(6), block_size=4
+        )
+        np.testing.assert_array_equal(diag, [0, 1, 0, 3, 0, 0])
+        np.testing.assert_array_equal(c_diag, [0, 1, 1, 1, 0, 0])
+
+    def test_memory(self):
+        # The memory besides the outputs does not grow with the elements
+        rng = np.random.default_rng(1)
+        extra = []
+        for n in [100000, 400000]:
+            x, y = rng.uniform(-2.0, 1.0, (2, n))
+            c_x, c_y = rng.integers(0, 3, (2, n))
+            for use_limits in [False, True]:
+                tracemalloc.start()
+                out = diag_nii_Sabater2012(
+                    x, y, c_x, c_y, use_limits=use_limits, block_size=4096
+                )
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                extra.append(peak - out[0].nbytes - out[1].nbytes)
+                np.testing.assert_array_equal(
+                    out[0], diag_nii_Sabater2012(x, y, c_x, c_y, use_limits)[0]
+                )
+        self.assertLess(max(extra), 2**20)
+
+    def test_cidfernandes2011_limits(self):
+        diag, c_diag = lineclass.diag_CidFernandes2011(
+            [-0.5, 0.0, 0.0],
+            [1, 2, 0],
+            [4.0, 7.0, 1.0],
+            [0, 0, 0],
+            [1.0] * 3,
+            [0] * 3,
+            use_limits=True,
+        )
+        np.testing.assert_array_equal(diag, [1, 2, 6])
+        np.testing.assert_array_equal(c_diag, [1, 1, 1])
+
+
+class TestRegions(unittest.TestCase):
+    """
+    Test the region classification of the Sabater et al. 2012 diagrams
+    against the rules, including points on the demarcation curves.
+    """
+
+    def setUp(self):
+        rng = np.random.default_rng(8)
+        n = 200000
+        special = [0.0, 0.8, 0.05, 0.47, 1.3, 1.19, 0.32, -0.59, 1.33, -0.76]
+        special += [np.nan, np.inf, -np.inf]
+        x = rng.uniform(-4.0, 3.0, n)
+        y = rng.uniform(-3.0, 3.0, n)
+        for v in [x, y]:
+            mask = rng.random(n) < 0.05
+            v[mask] = rng.choice(special, np.count_nonzero(mask))
+        x[:10000] = 0.05 + 0.61 / (y[:10000] - 1.3)
+        x[10000:20000] = 0.32 + 0.72 / (y[10000:20000] - 1.3)
+        y[20000:30000] = 1.18 * x[20000:30000] + 1.3
+        self.x, self.y = x, y
+        self.c_x = rng.choice([0, 0, 0, 1, 2, 3, -1], n)
+        self.c_y = rng.choice([0, 0, 0, 1, 2, 3, -1], n)
+
+    def test_diagrams(self):
+        for name in ["nii", "sii", "oi"]:
+            rules = getattr(lineclass, "rules_{}_Sabater2012".format(name))
+            function = getattr(lineclass, "diag_{}_Sabater2012".format(name))
+            for dtype in [np.float64, np.float32]:
+                x, y = self.x.astype(dtype), self.y.astype(dtype)
+                arrays = [x, y, self.c_x, self.c_y]
+                with np.errstate(invalid="ignore"):
+                    expected = lineclass.evaluate_rules(
+                        lineclass.only_detections, rules, *arrays
+                    )
+                    out = function(*arrays)
+                np.testing.assert_array_equal(out[0], expected[0])
+                np.testing.assert_array_equal(out[1], expected[1])
+
+    def test_threads(self):
+        e = np.full(len(self.x), 0.1)
+        for name in ["nii", "sii", "oi"]:
+            function = getattr(lineclass, "diag_{}_Sabater2012".format(name))
+            for use_limits in [False, True]:
+                arrays = [self.x, self.y, self.c_x, self.c_y]
+                with np.errstate(invalid="ignore"):
+                    expected = function(*arrays, use_limits=use_limits, e_x=e, e_y=e)
+                    out = function(
+                        *arrays, use_limits=use_limits, e_x=e, e_y=e, n_threads=3
+                    )
+                for a, b in zip(out, expected):
+                    np.testing.assert_array_equal(a, b)
+
+    def test_grid(self):
+        for name in ["nii", "sii", "oi"]:
+            terms = getattr(lineclass, "terms_{}_Sabater2012".format(name))
+            grid = getattr(lineclass, "_regions_{}_Sabater2012".format(name))["grid"]
+            for dtype in [np.float64, np.float32]:
+                x, y = self.x.astype(dtype), self.y.astype(dtype)
+                with np.errstate(invalid="ignore"):
+                    np.testing.assert_array_equal(
+                        lineclass.region_ids(terms, x, y, grid=grid),
+                        lineclass.region_ids(terms, x, y),
+                    )
+
+    def test_limits(self):
+        # Every combination of detection codes in every point
+        codes = np.array([-2, -1, 0, 1, 2, 3, 4])
+        c_x, c_y = [c.ravel() for c in np.meshgrid(codes, codes)]
+        index = np.r_[0:30000:10, 30000 : len(self.x) : 20]
+        for name in ["nii", "sii", "oi"]:
+            rules = getattr(lineclass, "_rules_{}_Sabater2012_limits".format(name))
+            function = getattr(lineclass, "diag_{}_Sabater2012".format(name))
+            for dtype in [np.float64, np.float32]:
+                x = np.repeat(self.x[index].astype(dtype), len(c_x))
+                y = np.repeat(self.y[index].astype(dtype), len(c_y))
+                arrays = [x, y, np.tile(c_x, len(index)), np.tile(c_y, len(index))]
+                with np.errstate(invalid="ignore"):
+                    expected = lineclass.evaluate_rules(
+                        lineclass.detections_and_limits, rules, *arrays
+                    )
+                    out = function(*arrays, use_limits=True)
+                np.testing.assert_array_equal(out[0], expected[0])
+                np.testing.assert_array_equal(out[1], expected[1])
+        # Float codes with NaN
+        arrays[2] = np.where(arrays[2] == 4, np.nan, arrays[2])
+        with np.errstate(invalid="ignore"):
+            expected = lineclass.evaluate_rules(
+                lineclass.detections_and_limits, rules, *arrays
+            )
+            out = function(*arrays, use_limits=True)
+        np.testing.assert_array_equal(out[0], expected[0])
+
+    def test_limit_tables(self):
+        # Every cell (codes, region) of the decision tables against the rules
+        # on one point of the region, the test points first
+        codes = [-2.0, -1.0, 0.0, 1.0, 2.0, 3.0, 4.0, np.nan]
+        n_slots = lineclass.n_detection_slots
+        for name in ["nii", "sii", "oi"]:
+            for use_limits, compiled in lineclass._code_regions_Sabater2012[
+                name
+            ].items():
+                terms = compiled["regions"]["terms"]
+                samples = compiled["regions"]["samples"]
+                x = np.concatenate([self.x, samples[0]])
+                y = np.concatenate([self.y, samples[1]])
+                with np.errstate(invalid="ignore"):
+                    region = lineclass.region_ids(terms, x, y).astype(np.intp)
+                region, first = np.unique(region, return_index=True)
+                table = compiled["table"].reshape(n_slots**2, -1)
+                checked = np.zeros(table.shape, dtype=bool)
+                for c_x, c_y in itertools.product(codes, codes):
+                    c = np.full(len(first), c_x), np.full(len(first), c_y)
+                    with np.errstate(invalid="ignore"):
+                        diag, c_diag = lineclass.evaluate_rules(
+                            compiled["cond_init"],
+                            compiled["rules"],
+                            x[first],
+                            y[first],
+                            *c
+                        )
+                    slot = lineclass.detection_slots([c_x], n_slots)[0]
+                    slot += lineclass.detection_slots([c_y])[0]
+                    cells = table[slot, region]
+                    known = cells >= 0
+                    np.testing.assert_array_equal(
+                        cells[known], (2 * diag + c_diag)[known]
+                    )
+                    checked[slot, region] = True
+                self.assertFalse((table[~checked] >= 0).any())
+
+    def test_limits_CidFernandes2011(self):
+        special = [-0.4, 0.5, 3.0, 6.0, -1.0, 0.0, 1.0, 4.0, 8.0, np.nan, np.inf]
+        values = [v.ravel() for v in np.meshgrid(special, special, special)]
+        codes = [-2, -1, 0, 1, 2, 3, 4]
+        codes = [c.ravel() for c in np.meshgrid(codes, codes, codes)]
+        n = len(codes[0])
+        x, ew_ha, ew_nii = [np.repeat(v, n) for v in values]
+        c_x, c_ew_ha, c_ew_nii = [np.tile(c, len(values[0])) for c in codes]
+        arrays = [x, c_x, ew_ha, c_ew_ha, ew_nii, c_ew_nii]
+        with np.errstate(invalid="ignore"):
+            expected = lineclass.evaluate_rules(
+                lambda x, c_x, ew_ha, c_ew_ha, ew_nii, c_ew_nii: (
+                    (c_x >= 0) & (c_ew_ha >= 0) & (c_ew_nii >= 0)
+                ),
+                lineclass.rules_CidFernandes2011
+                + lineclass.rules_CidFernandes2011_limits,
+                *arrays
+            )
+            out = lineclass.diag_CidFernandes2011(*arrays, use_limits=True)
+        np.testing.assert_array_equal(out[0], expected[0])
+        np.testing.assert_array_equal(out[1], expected[1])
+
+    def test_wrong_terms(self):
+        terms = lineclass.terms_nii_Sabater2012[:3]
+        with self.assertRaises(ValueError):
+            lineclass.compile_regions(terms, lineclass.rules_nii_Sabater2012)
+
+
+class TestDistances(unittest.TestCase):
+    """
+    Test the distances to the demarcation curves.
+    """
+
+    def test_kauffmann(self):
+        # Nearest point of the Kauffmann et al. 2003 curve by brute force
+        x, y = np.array([-0.5, -1.0]), np.array([0.0, -0.5])
+        e = np.array([0.1, 0.1])
+        c = np.zeros(2, dtype=int)
+        diag, c_diag, distance = lineclass.diag_nii_Sabater2012(
+            x, y, c, c, e_x=e, e_y=e
+        )
+        xs = np.linspace(-10.0, 0.0499, 2000001)
+        ys = 1.3 + 0.61 / (xs - 0.05)
+        for i in range(2):
+            expected = np.hypot((xs - x[i]) / e[i], (ys - y[i]) / e[i]).min()
+            self.assertAlmostEqual(distance[i], expected, places=4)
+
+    def test_corners(self):
+        # Nearest change of class by brute force on a polar grid: the AGN
+        # corner of the [NII] diagram (three curves crossed) and an [OI]
+        # galaxy far from the SFN curve. The distance is a lower bound, loose
+        # where the nearest point of the other class is a corner
+        cases = [
+            ("nii", 0.295, 1.043, 0.07, 0.1, 0.05),
+            ("nii", 0.1, 0.9, 0.05, 0.05, 0.05),
+            ("nii", 0.05, 0.85, 0.06, 0.06, 0.05),
+            ("nii", 0.6, 1.5, 0.1, 0.1, 7.0),
+            ("oi", -1.135, 1.488, 0.07, 0.083, 0.05),
+        ]
+        radius, angle = np.meshgrid(
+            np.arange(0.01, 16.0, 0.01), np.radians(np.arange(0.0, 360.0, 0.25))
+        )
+        radius, angle = radius.ravel(), angle.ravel()
+        zeros = np.zeros(len(radius), dtype=int)
+        for name, x, y, e_x, e_y, loose in cases:
+            function = getattr(lineclass, "diag_{}_Sabater2012".format(name))
+            diag, c_diag, distance = function([x], [y], [0], [0], e_x=[e_x], e_y=[e_y])
+            others = function(
+                x + radius * e_x * np.cos(angle),
+                y + radius * e_y * np.sin(angle),
+                zeros,
+                zeros,
+            )[0]
+            expected = radius[others != diag[0]].min()
+            self.assertLessEqual(abs(distance[0]), expected)
+            self.assertGreater(abs(distance[0]), expected - loose)
+
+    def test_straight_lines(self):
+        # SFN: nearest is the EW of [NII] (1.5 sigma), not x (2) or EW(Ha) (4)
+        out = lineclass.diag_CidFernandes2011(
+            [-0.6, -0.6],
+            [0, 1],
+            [10.0, 10.0],
+            [0, 0],
+            [2.0, 2.0],
+            [0, 0],
+            e_x=[0.1, 0.1],
+            e_ew_ha=[1.0, 1.0],
+            e_ew_nii=[1.0, 1.0],
+        )
+        np.testing.assert_array_equal(out[0], [1, 0])
+        np.testing.assert_allclose(out[2], [1.5, np.nan])
+        # Sign: high side of the line 1.89 x - y = -0.76
+        d = lineclass.diag_sii_Sabater2012(
+            [0.5], [0.4], [0], [0], e_x=[0.1], e_y=[0.2]
+        )[2]
+        self.assertAlmostEqual(d[0], (1.89 * 0.5 - 0.4 + 0.76) / np.hypot(0.189, 0.2))
+
+    def test_probability(self):
+        p = lineclass.misclassification_probability([0.0, 1.0, -2.0, np.inf, np.nan])
+        np.testing.assert_allclose(
+            p, [0.5, 0.158655254, 0.022750132, 0.0, np.nan], atol=2e-7
+        )
+
+    def test_columns(self):
+        derived = mpa_jhu.classify_columns(mpa_jhu_catalogue(2000, seed=4))
+        out = mpa_jhu.diag_Sabater2012_columns(derived, distances=True)
+        out = mpa_jhu.diag_CidFernandes2011_columns(derived, distances=True, out=out)
+        for name in ["nii", "sii", "oi"]:
+            np.testing.assert_array_equal(
+                out[name + "_Sabater2012"], derived[name + "_Sabater2012"]
+            )
+        for name in ["nii_Sabater2012", "whan_CidFernandes2011"]:
+            p = out["p_" + name]
+            classified = out["c_" + name] == 1
+            self.assertTrue(np.isnan(out["d_" + name][~classified]).all())
+            self.assertTrue(np.isfinite(out["d_" + name][classified]).all())
+            self.assertTrue(((p[classified] >= 0) & (p[classified] <= 0.5)).all())
+
+
+class TestMonteCarlo(unittest.TestCase):
+    """
+    Test the Monte-Carlo class probabilities.
+    """
+
+    def setUp(self):
+        self.out = mpa_jhu.classify_columns(mpa_jhu_catalogue(500, seed=9))
+
+    def test_no_errors(self):
+        data = dict(self.out)
+        for name in montecarlo.input_columns():
+            if name.startswith("e_"):
+                data[name] = np.zeros_like(data[name])
+        p = montecarlo.class_probabilities(data, n_samples=20)
+        for name, values in p.items():
+            self.assertEqual(values.shape, (500, 11))
+            np.testing.assert_array_equal(values.argmax(axis=1), self.out[name])
+            np.testing.assert_array_equal(values.max(axis=1), 1.0)
+
+    def test_workers_and_chunks(self):
+        kwargs = dict(n_samples=50, seed=3, chunk_samples=5000)
+        p1 = montecarlo.class_probabilities(self.out, **kwargs)
+        p2 = montecarlo.class_probabilities(self.out, n_workers=2, **kwargs)
+        for name, values in p1.items():
+            np.testing.assert_allclose(values.sum(axis=1), 1.0, rtol=1e-6)
+            np.testing.assert_array_equal(values, p2[name])
+
+    def test_circles(self):
+        # Same result as the classification of every realisation
+        n, n_samples = len(self.out["oiii_h_beta"]), 200
+        data = dict(self.out)
+        data["e_oiii_h_beta"] = data["e_oiii_h_beta"] * 0.3
+        p = montecarlo.class_probabilities(data, n_samples=n_samples, seed=5)
+        rng = np.random.default_rng(np.random.SeedSequence(5).spawn(1)[0])
+        names = ["oiii_h_beta"] + [
+            mpa_jhu.dict_diagnostic[d][0] for d in "nii sii oi".split()
+        ]
+        samples = {}
+        for name in names:
+            z = rng.standard_normal((n, n_samples), dtype=np.float32)
+            error = np.where(np.isfinite(data["e_" + name]), data["e_" + name], 0)
+            z *= error.astype(np.float32)[:, None]
+            z += np.asarray(data[name], dtype=np.float32)[:, None]
+            samples[name] = z.ravel()
+        classes = []
+        for (name, function), x_name in zip(montecarlo.diagrams, names[1:]):
+            with np.errstate(invalid="ignore"):
+                diag, c_diag = function(
+                    samples[x_name],
+                    samples["oiii_h_beta"],
+                    data["c_" + x_name].repeat(n_samples),
+                    data["c_oiii_h_beta"].repeat(n_samples),
+                    use_limits=True,
+                )
+            classes.append(diag)
+        final, final_to = lineclass.diag_class_Sabater2012(*classes)
+        for name, codes in zip(p, classes + [final]):
+            counts = np.zeros((n, 11))
+            np.add.at(
+                counts, (np.arange(n).repeat(n_samples), np.clip(codes, 0, 10)), 1
+            )
+            counts = (counts / n_samples).astype(np.float32)
+            np.testing.assert_array_equal(p[name], counts)
+
+    def test_boundary(self):
+        # On the Seyfert/LINER line of the [SII] diagram, far from the SFN curve
+        data = {}
+        for ratio, value, error in [
+            ("sii_h_alpha", 0.5, 0.0),
+            ("oiii_h_beta", 1.89 * 0.5 + 0.76, 0.1),
+            ("nii_h_alpha", 0.5, 0.0),
+            ("oi_h_alpha", 0.5, 0.0),
+        ]:
+            data[ratio] = np.array([value])
+            data["e_" + ratio] = np.array([error])
+            data["c_" + ratio] = np.array([0])
+        p = montecarlo.class_probabilities(data, n_samples=4000)["sii_Sabater2012"]
+        self.assertAlmostEqual(p[0, 2], 0.5, delta=0.05)
+        self.assertAlmostEqual(p[0, 2] + p[0, 3], 1.0, places=5)
+
+
+class TestPacked(unittest.TestCase):
+    """
+    Test the packed classification container.
+    """
+
+    def setUp(self):
+        self.columns = mpa_jhu.classify_columns(mpa_jhu_catalogue(3000, seed=5))
+        self.packed = packed.PackedClassification.from_columns(self.columns)
+
+    def test_roundtrip(self):
+        self.assertEqual(self.packed.nbytes, 4 * len(self.packed))
+        for name, values in self.packed.columns().items():
+            np.testing.assert_array_equal(values, self.columns[name])
+            self.assertEqual(values.dtype, self.columns[name].dtype)
+
+    def test_slices(self):
+        part = self.packed[100:200]
+        self.assertTrue(np.shares_memory(part.records, self.packed.records))
+        np.testing.assert_array_equal(
+            part["class_Sabater2012"], self.columns["class_Sabater2012"][100:200]
+        )
+        with self.assertRaises(KeyError):
+            self.packed["ew_H_ALPHA"]
+
+    def test_save(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "classes.npy")
+            self.packed.save(path)
+            loaded = packed.PackedClassification.load(path)
+            self.assertIsInstance(loaded.records, np.memmap)
+            np.testing.assert_array_equal(
+                loaded[::7]["whan_CidFernandes2011"],
+                self.columns["whan_CidFernandes2011"][::7],
+            )
+            del loaded
+
+    def test_overflow(self):
+        columns = dict(self.columns)
+        columns["nii_Sabater2012"] = np.full(len(self.packed), 16)
+        with self.assertRaises(ValueError):
+            packed.pack(columns)
+
+
+class TestPlan(unittest.TestCase):
+    """
+    Test the configurations and their execution plans.
+    """
+
+    def setUp(self):
+        self.data = mpa_jhu_catalogue(3000, seed=6)
+
+    def test_default(self):
+        expected = mpa_jhu.classify_columns(self.data)
+        out = plan.run(plan.make_config(), self.data)
+        # The EW only of the lines of the diagram of Cid-Fernandes et al. 2011
+        skipped = [
+            name
+            for name in expected
+            if "ew_" in name and not name.endswith(("H_ALPHA", "NII_6584"))
+        ]
+        self.assertEqual(len(skipped), 3 * 5)
+        self.assertEqual(sorted(out), sorted(set(expected) - set(skipped)))
+        for name, values in out.items():
+            np.testing.assert_array_equal(values, expected[name])
+
+    def test_subset(self):
+        config = plan.make_config(outputs=["nii_Sabater2012"], use_limits=False)
+        compiled = plan.compile_plan(config)
+        self.assertIs(
+            compiled,
+            plan.compile_plan(
+                plan.make_config(outputs=["nii_Sabater2012"], use_limits=False)
+            ),
+        )
+        self.assertEqual(compiled.lines, ["H_BETA", "OIII_5007", "H_ALPHA", "NII_6584"])
+        self.assertFalse(compiled.steps[0][1]["equivalent_widths"])
+        steps = dict(compiled.steps)
+        self.assertEqual(
+            list(steps[mpa_jhu.ratio_columns]["definitions"]), compiled.ratios
+        )
+        self.assertEqual(list(steps[mpa_jhu.diag_Sabater2012_columns]["axes"]), ["nii"])
+        out = plan.run(config, self.data)
+        self.assertNotIn("flux_OI_6300", out)
+        self.assertFalse([name for name in out if "ew_" in name])
+        with self.assertRaises(ValueError):
+            plan.make_config(outputs=[])
+        with self.assertRaises(ValueError):
+            mpa_jhu.clean_columns(self.data, lines=[])
+        self.assertNotIn("class_Sabater2012", out)
+        expected = mpa_jhu.classify_columns(self.data, use_limits=False)
+        np.testing.assert_array_equal(
+            out["nii_Sabater2012"], expected["nii_Sabater2012"]
+        )
+
+    def test_factors(self):
+        factors = dict(zip(mpa_jhu.name_lines, mpa_jhu.cor_factor))
+        factors["H_ALPHA"] = 1.0
+        config = plan.make_config(factors=factors, outputs=["whan_CidFernandes2011"])
+        out = plan.run(config, self.data)
+        default = plan.run(plan.make_config(), self.data)
+        np.testing.assert_allclose(
+            out["e_flux_H_ALPHA"] * mpa_jhu.cor_factor[3], default["e_flux_H_ALPHA"]
+        )
+        np.testing.assert_array_equal(
+            out["e_flux_NII_6584"], default["e_flux_NII_6584"]
+        )
+        with self.assertRaises(ValueError):
+            plan.make_config(outputs=["bpt"])
+
+
+class TestLazy(unittest.TestCase):
+    """
+    Test the lazy frame of derived columns.
+    """
+
+    def setUp(self):
+        self.data = mpa_jhu_catalogue(3000, seed=7)
+
+    def test_columns(self):
+        expected = mpa_jhu.classify_columns(self.data)
+        frame = lazy.LazyFrame(self.data)
+        self.assertEqual(sorted(frame), sorted(expected))
+        for name, values in expected.items():
+            np.testing.assert_array_equal(frame[name], values)
+
+    def test_on_demand(self):
+        frame = lazy.LazyFrame(self.data)
+        frame["class_Sabater2012"]
+        self.assertNotIn("ew_H_ALPHA", frame.computed)
+        self.assertNotIn("whan_CidFernandes2011", frame.computed)
+        self.assertIn("ew_H_ALPHA", frame)
+        self.assertFalse([n for n in frame.computed if "ew_" in n])
+        for name in lazy.dependencies("class_Sabater2012"):
+            self.assertIn(name, frame.computed)
+        frame.release()
+        self.assertEqual(frame.computed, {})
+        np.testing.assert_array_equal(frame["H_ALPHA_FLUX"], self.data["H_ALPHA_FLUX"])
+
+
+class TestCleanKernel(unittest.TestCase):
+    """
+    Test the cleaning of all the lines at once.
+    """
+
+    def setUp(self):
+        self.data = mpa_jhu_catalogue(1000, seed=2)
+        self.expected = mpa_jhu.clean_columns(self.data)
+
+    def test_blocks_and_buffers(self):
+        buffers = {}
+        for block_size in [1, 333, 5000]:
+            out = mpa_jhu.clean_columns(
+                self.data, block_size=block_size, buffers=buffers
+            )
+            self.assertEqual(list(out), list(self.expected))
+            for name, values in out.items():
+                np.testing.assert_array_equal(values, self.expected[name])
+        self.assertIs(out["flux_H_BETA"].base, buffers["flux"])
+
+    def test_codes(self):
+        for name, values in self.expected.items():
+            if name.startswith("c_"):
+                self.assertEqual(values.dtype, np.int8)
+        c_flux = self.expected["c_flux_H_ALPHA"]
+        e_flux = self.data["H_ALPHA_FLUX_ERR"]
+        np.testing.assert_array_equal(c_flux == -1, e_flux <= 0.0)
+
+    def test_float32(self):
+        out = mpa_jhu.clean_columns(self.data, dtype=np.float32)
+        for name, values in out.items():
+            if name.startswith("c_"):
+                np.testing.assert_array_equal(values, self.expected[name])
+            else:
+                self.assertEqual(values.dtype, np.float32)
+                np.testing.assert_allclose(values, self.expected[name], rtol=1e-6)
+
+
+class TestCache(unittest.TestCase):
+    """
+    Test the on-disk cache of the cleaned columns.
+    """
+
+    def setUp(self):
+        self.data = mpa_jhu_catalogue(1000, seed=3)
+        self.expected = mpa_jhu.classify_columns(self.data)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_classify_cached(self):
+        for _ in range(2):  # Miss and hit
+            out = cache.classify_cached(self.data, self.tmp.name)
+            self.assertEqual(set(out), set(self.expected))
+            for name, values in out.items():
+                np.testing.assert_array_equal(values, self.expected[name])
+        self.assertEqual(len(os.listdir(self.tmp.name)), 1)
+        self.assertIsInstance(out["flux_H_ALPHA"], np.memmap)
+
+    def test_key(self):
+        key = cache.cache_key(self.data)
+        self.assertNotEqual(key, cache.cache_key(self.data, sigma=2.0))
+        data = dict(self.data)
+        data["H_ALPHA_FLUX"] = data["H_ALPHA_FLUX"].copy()
+        self.assertEqual(key, cache.cache_key(data))
+        data["H_ALPHA_FLUX"][0] += 1.0
+        self.assertNotEqual(key, cache.cache_key(data))
+
+
+class TestFits(unittest.TestCase):
+    """
+    Test the FITS binary table reader with a synthetic gal_line file.
+    """
+
+    def setUp(self):
+        self.data = mpa_jhu_catalogue(1000, seed=4)
+        self.data["H_ALPHA_FLUX"] = self.data["H_ALPHA_FLUX"].astype(np.float32)
+        columns = {"SPECOBJID": np.arange(1000).astype("S19")}
+        columns["PLATEID"] = np.arange(1000, dtype=np.int16)
+        columns.update(self.data)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "gal_line.fit")
+        fits.write_table(self.path, columns)
+
+    def test_read_table(self):
+        table = fits.read_table(self.path, ["plateid", "H_ALPHA_FLUX"], 10, 20)
+        np.testing.assert_array_equal(table["plateid"], np.arange(10, 20))
+        self.assertEqual(table["H_ALPHA_FLUX"].dtype, np.float32)
+        np.testing.assert_array_equal(
+            table["H_ALPHA_FLUX"], self.data["H_ALPHA_FLUX"][10:20]
+        )
+        self.assertEqual(fits.read_table(self.path, start=990)["SPECOBJID"][-1], b"999")
+        with self.assertRaises(KeyError):
+            fits.read_table(self.path, ["Z"])
+
+    def test_null(self):
+        # Integer columns with a null value are read as float with NaN
+        columns = {"PLATEID": np.arange(1000, dtype=np.int16) % 7}
+        columns["FIBERID"] = np.arange(1000, dtype=np.int32)
+        fits.write_table(self.path, columns, nulls={"PLATEID": 3})
+        table = fits.read_table(self.path, start=5, stop=15)
+        self.assertEqual(table["PLATEID"].dtype, np.float64)
+        expected = (np.arange(5, 15) % 7).astype(float)
+        expected[expected == 3] = np.nan
+        np.testing.assert_array_equal(table["PLATEID"], expected)
+        self.assertEqual(table["FIBERID"].dtype, np.int32)
+
+    def test_read_gal_line(self):
+        table = mpa_jhu.read_gal_line(self.path)
+        self.assertEqual(list(table.dtype.names), mpa_jhu.input_columns)
+        for name in mpa_jhu.input_columns:
+            np.testing.assert_array_equal(table[name], self.data[name])
+        chunks = list(mpa_jhu.iter_gal_line(self.path, 300))
+        self.assertEqual([len(chunk) for chunk in chunks], [300, 300, 300, 100])
+        np.testing.assert_array_equal(np.concatenate(chunks), table)
+
+
+class TestCli(unittest.TestCase):
+    """
+    Test the batch classification command on a synthetic gal_line file.
+    """
+
+    def setUp(self):
+        self.data = mpa_jhu_catalogue(1000, seed=5)
+        self.expected = mpa_jhu.classify_columns(self.data)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.input = os.path.join(tmp.name, "gal_line.fit")
+        self.output = os.path.join(tmp.name, "out.csv")
+        fits.write_table(self.input, self.data)
+
+    def test_run(self):
+        for n_workers in [1, 2]:
+            report = cli.run(
+                self.input, self.output, chunk_size=300, n_workers=n_workers
+            )
+            self.assertEqual(report["rows"], 1000)
+            self.assertEqual(list(report["stages"]), cli.stages)
+            out = np.genfromtxt(self.output, delimiter=",", names=True)
+            self.assertEqual(list(out.dtype.names), list(self.expected))
+            for name, values in self.expected.items():
+                np.testing.assert_array_equal(out[name], values)
+
+    def test_csv_input(self):
+        # The CSV values are read back exactly
+        path = self.output.replace("out.csv", "gal_line.csv")
+        columns = {c: self.data[c] for c in mpa_jhu.input_columns}
+        with open(path, "w") as f:
+            f.write(",".join(columns) + "\n")
+            for row in zip(*columns.values()):
+                f.write(",".join(repr(float(v)) for v in row) + "\n")
+        chunks = list(cli.iter_input(path, 300))
+        self.assertEqual(len(chunks), 4)
+        for name, values in columns.items():
+            read = np.concatenate([chunk[name] for chunk in chunks])
+            np.testing.assert_array_equal(read, values)
+
+    @unittest.skipUnless(cli.reset_peak_rss(), "the peak memory can not be reset")
+    def test_measure(self):
+        # The peak of a step that allocates 100 MB is not carried to the next
+        size = 100 * 1048576
+        big = cli.measure(lambda: np.ones(size // 8).sum())[2]
+        small = cli.measure(lambda: np.ones(10).sum())[2]
+        self.assertGreater(big - small, 0.9 * size)
+        report = cli.run(self.input, self.output, chunk_size=300, n_workers=2)
+        self.assertIn("worker", cli.format_report(report))
+
+    def test_columns(self):
+        columns = ["H_ALPHA_FLUX", "class_Sabater2012"]
+        cli.main([self.input, self.output, "--columns", ",".join(columns)])
+        out = np.genfromtxt(self.output, delimiter=",", names=True)
+        self.assertEqual(list(out.dtype.names), columns)
+        np.testing.assert_array_equal(out["H_ALPHA_FLUX"], self.data["H_ALPHA_FLUX"])
+        with self.assertRaises(KeyError):
+            cli.run(self.input, self.output, columns=["Z"])
+
+
+class TestOutOfCore(unittest.TestCase):
+    """
+    Test the out-of-core classification into .npy files.
+    """
+
+    def setUp(self):
+        self.data = mpa_jhu_catalogue(1000, seed=10)
+        self.expected = mpa_jhu.classify_columns(self.data)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.fits = os.path.join(tmp.name, "gal_line.fit")
+        fits.write_table(self.fits, self.data)
+        self.npy = os.path.join(tmp.name, "lines")
+        os.makedirs(self.npy)
+        for name, values in self.data.items():
+            np.save(os.path.join(self.npy, name + ".npy"), values)
+
+    def check(self, out):
+        self.assertEqual(list(out), list(self.expected))
+        for name, values in self.expected.items():
+            self.assertIsInstance(out[name], np.memmap)
+            self.assertEqual(out[name].dtype, values.dtype)
+            np.testing.assert_array_equal(out[name], values)
+
+    def test_sources(self):
+        path = os.path.join(self.tmp, "out")
+        for source in [self.fits, self.npy, self.data]:
+            self.assertEqual(outofcore.count_rows(source), 1000)
+            self.check(outofcore.classify_out_of_core(source, path, block_size=300))
+        self.assertEqual(sorted(os.listdir(self.tmp)), ["gal_line.fit", "lines", "out"])
+
+    def test_cli(self):
+        path = os.path.join(self.tmp, "out")
+        cli.main([self.npy, path, "--npy", "--chunk-size", "400"])
+        self.check(incremental.load_classification(path))
+
+
+class TestBatch(unittest.TestCase):
+    """
+    Test the resumption of interrupted batch jobs.
+    """
+
+    def setUp(self):
+        self.data = mpa_jhu_catalogue(1000, seed=11)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+
+    def run_job(self, path, task, interrupt=None, **parameters):
+        calls = []
+
+        def function(chunk, number, **parameters):
+            calls.append(number)
+            if number == interrupt:
+                raise RuntimeError("Pre-empted")
+            return batch.tasks[task](chunk, number, **parameters)
+
+        return (
+            batch.run_batch(
+                self.data, path, task=function, chunk_size=300, **parameters
+            ),
+            calls,
+        )
+
+    def test_resume(self):
+        for task, parameters in [
+            ["classify", {"sigma": 2.0}],
+            ["probabilities", {"n_samples": 20, "seed": 5}],
+        ]:
+            path = os.path.join(self.tmp, task)
+            with self.assertRaises(RuntimeError):
+                self.run_job(path, task, interrupt=2, **parameters)
+            self.assertEqual(batch.read_manifest(path)["completed"], [0, 1])
+            out, calls = self.run_job(path, task, **parameters)
+            self.assertEqual(calls, [2, 3])
+            expected, calls = self.run_job(path + "-full", task, **parameters)
+            self.assertEqual(calls, [0, 1, 2, 3])
+            self.assertEqual(list(out), list(expected))
+            for name, values in expected.items():
+                self.assertIsInstance(out[name], np.memmap)
+                np.testing.assert_array_equal(out[name], values)
+            self.assertEqual(sorted(os.listdir(path)), ["manifest.json", "merged"])
+            # A finished job is not run again
+            self.assertEqual(self.run_job(path, task, **parameters)[1], [])
+        # Named task
+        path = os.path.join(self.tmp, "named")
+        out = batch.run_batch(self.data, path, "classify", 300, sigma=2.0)
+        for name, values in mpa_jhu.classify_columns(self.data, sigma=2.0).items():
+            np.testing.assert_array_equal(out[name], values)
+
+    def test_parameters(self):
+        path = os.path.join(self.tmp, "job")
+        batch.run_batch(self.data, path, chunk_size=400)
+        with self.assertRaises(ValueError):
+            batch.run_batch(self.data, path, chunk_size=400, sigma=2.0)
+        # Another input with the same number of rows
+        other = dict(self.data)
+        other["H_ALPHA_FLUX"] = other["H_ALPHA_FLUX"][::-1]
+        with self.assertRaises(ValueError):
+            batch.run_batch(other, path, chunk_size=400)
+        columns = os.path.join(self.tmp, "columns")
+        os.makedirs(columns)
+        for name in mpa_jhu.input_columns:
+            np.save(os.path.join(columns, name + ".npy"), self.data[name])
+        path = os.path.join(self.tmp, "files")
+        batch.run_batch(columns, path, chunk_size=400)
+        batch.run_batch(columns, path, chunk_size=400)
+        np.save(os.path.join(columns, "H_ALPHA_FLUX.npy"), other["H_ALPHA_FLUX"])
+        os.utime(os.path.join(columns, "H_ALPHA_FLUX.npy"), ns=(0, 0))
+        with self.assertRaises(ValueError):
+            batch.run_batch(columns, path, chunk_size=400)
+
+
+class TestSweep(unittest.TestCase):
+    """
+    Test the sweeps over sigma and use_limits against separate runs.
+    """
+
+    def setUp(self):
+        self.data = mpa_jhu_catalogue(2000, seed=12)
+
+    def test_sweep(self):
+        for dtype in [None, np.float32]:
+            result = sweep.sweep(self.data, sigmas=[2.0, 3.0, 5.0], dtype=dtype)
+            self.assertEqual(len(result.parameters), 6)
+            self.assertEqual(list(result.timings), sweep.stages + ["saved"])
+            for sigma, use_limits in result.parameters:
+                expected = mpa_jhu.classify_columns(
+                    self.data, sigma=sigma, use_limits=use_limits, dtype=dtype
+                )
+                columns = result.columns[sigma, use_limits]
+                for name, values in columns.items():
+                    self.assertEqual(values.dtype, expected[name].dtype)
+                    np.testing.assert_array_equal(values, expected[name])
+
+    def test_diagrams(self):
+        ratios = mpa_jhu.classify_columns(self.data)
+        for name in ["nii", "sii", "oi"]:
+            args = mpa_jhu.get_diag_ratios(ratios, name)
+            function = getattr(lineclass, "diag_{}_Sabater2012".format(name))
+            results = lineclass.diag_Sabater2012_sweep(
+                name, *args, use_limits=[False, True]
+            )
+            for use_limits, result in zip([False, True], results):
+                for a, b in zip(result, function(*args, use_limits=use_limits)):
+                    np.testing.assert_array_equal(a, b)
+
+    @unittest.skipIf(pd is None, "pandas is not installed")
+    def test_frame(self):
+        result = sweep.sweep(self.data, sigmas=[3.0], use_limits=[True, False])
+        frame = sweep.to_frame(result)
+        self.assertEqual(len(frame), 4000)
+        self.assertEqual(frame.index.names, ["sigma", "use_limits", "row"])
+        np.testing.assert_array_equal(
+            frame.loc[(3.0, False), "class_Sabater2012"],
+            result.columns[3.0, False]["class_Sabater2012"],
+        )
+
+
+class TestBackend(unittest.TestCase):
+    """
+    Test the kernels with NumPy and Dask arrays.
+    """
+
+    def setUp(self):
+        self.data = mpa_jhu_catalogue(5000, seed=13)
+        self.columns = mpa_jhu.classify_columns(self.data)
+        self.stacks = [
+            np.stack([self.data[line + p] for line in mpa_jhu.name_lines], axis=1)
+            for p in mpa_jhu.name_params
+        ]
+
+    def test_numpy(self):
+        x = np.zeros(3)
+        self.assertIs(backend.array_namespace(x, [1.0], 2), np)
+        out = lineclass.diag_nii_Sabater2012(x, x, [0, 0, 1], [0, 0, 0])
+        self.assertIsInstance(out[0], np.ndarray)
+
+    @unittest.skipIf(dask is None, "dask is not installed")
+    def test_dask(self):
+        self.assertIs(backend.array_namespace(np.zeros(3), da.zeros(3)), da)
+        lazy = lambda a, chunks=1500: da.from_array(np.asarray(a), chunks=chunks)
+        for name in ["nii", "sii", "oi"]:
+            function = getattr(lineclass, "diag_{}_Sabater2012".format(name))
+            args = mpa_jhu.get_diag_ratios(self.columns, name)
+            e = np.full(len(args[0]), 0.1)
+            for use_limits in [False, True]:
+                expected = function(*args, use_limits=use_limits, e_x=e, e_y=e)
+                out = function(
+                    *[lazy(a) for a in args],
+                    use_limits=use_limits,
+                    e_x=lazy(e, 1000),
+                    e_y=lazy(e, 2000)
+                )
+                self.assertIsInstance(out[0], da.Array)
+                for a, b in zip(dask.compute(*out), expected):
+                    self.assertEqual(a.dtype, b.dtype)
+                    np.testing.assert_array_equal(a, b)
+                # Dask ratios with NumPy codes and errors
+                out = function(
+                    lazy(args[0], 3000),
+                    lazy(args[1], 700),
+                    *args[2:],
+                    use_limits=use_limits,
+                    e_x=e,
+                    e_y=e
+                )
+                for a, b in zip(dask.compute(*out), expected):
+                    np.testing.assert_array_equal(a, b)
+        classes = [self.columns[n + "_Sabater2012"] for n in ["nii", "sii", "oi"]]
+        for function in [
+            lineclass.diag_class_Sabater2012,
+            lineclass.diag_class_OiSiiNii,
+            lineclass.diag_class_OiSiiNiiMine,
+            lineclass.diag_class_general,
+        ]:
+            expected = function(*classes)
+            out = dask.compute(function(*[lazy(c) for c in classes]))[0]
+            np.testing.assert_equal(out, expected)
+            out = function(lazy(classes[0]), *classes[1:])
+            np.testing.assert_equal(dask.compute(out)[0], expected)
+        whan = [
+            self.columns[name]
+            for name in ["nii_h_alpha", "c_nii_h_alpha", "ew_H_ALPHA"]
+            + ["c_ew_H_ALPHA", "ew_NII_6584", "c_ew_NII_6584"]
+        ]
+        for use_limits in [False, True]:
+            out = lineclass.diag_CidFernandes2011(
+                *[lazy(a) for a in whan], use_limits=use_limits
+            )
+            expected = lineclass.diag_CidFernandes2011(*whan, use_limits=use_limits)
+            for a, b in zip(dask.compute(*out), expected):
+                np.testing.assert_array_equal(a, b)
+
+    @unittest.skipIf(dask is None, "dask is not installed")
+    def test_clean_kernel(self):
+        expected = mpa_jhu.clean_kernel(*self.stacks, sigma=2.0)
+        stacks = [da.from_array(s, chunks=(1200, 7)) for s in self.stacks]
+        out = mpa_jhu.clean_kernel(*stacks, sigma=2.0)
+        self.assertEqual(list(out), list(expected))
+        for name, values in dask.compute(out)[0].items():
+            self.assertEqual(values.dtype, expected[name].dtype)
+            np.testing.assert_array_equal(values, expected[name])
+        with self.assertRaises(ValueError):
+            mpa_jhu.clean_kernel(*stacks, out={})
+        # One threshold and factor per column with as many rows as columns
+        sigma = np.linspace(1.0, 3.0, 7)
+        stacks = [s[:7] for s in self.stacks]
+        expected = mpa_jhu.clean_kernel(*stacks, sigma=sigma)
+        out = mpa_jhu.clean_kernel(da.from_array(stacks[0]), *stacks[1:], sigma=sigma)
+        for name, values in dask.compute(out)[0].items():
+            np.testing.assert_array_equal(values, expected[name])
+
+
+class TestInstrument(unittest.TestCase):
+    """
+    Test the instrumentation of the pipeline.
+    """
+
+    def setUp(self):
+        self.data = mpa_jhu_catalogue(500, seed=6)
+
+    def test_recorder(self):
+        with instrument.Recorder(memory=True) as recorder:
+            mpa_jhu.classify_columns(self.data)
+        self.assertEqual(instrument._hooks, [])
+        records = {r["name"]: r for r in recorder.records}
+        for name in ["clean_columns", "diag_nii_Sabater2012", "diag_class_Sabater2012"]:
+            self.assertEqual(records[name]["rows"], 500)
+            self.assertGreater(records[name]["peak_bytes"], 0)
+        self.assertEqual(records["classify_columns"]["depth"], 0)
+        self.assertEqual(records["diag_nii_Sabater2012"]["depth"], 2)
+        outer = records["classify_columns"]
+        self.assertGreaterEqual(outer["wall"], records["clean_columns"]["wall"])
+        self.assertGreaterEqual(
+            outer["peak_bytes"], records["clean_columns"]["peak_bytes"]
+        )
+        summary = json.loads(recorder.to_json())["summary"]
+        self.assertEqual(summary["diag_class_Sabater2012"]["calls"], 1)
+
+    def test_disabled(self):
+        recorder = instrument.Recorder()
+        mpa_jhu.classify_columns(self.data)
+        self.assertEqual(recorder.records, [])
+
+
+class TestIncremental(unittest.TestCase):
+    """
+    Test the incremental classification keyed on the galaxy identifiers.
+    """
+
+    def setUp(self):
+        self.data = mpa_jhu_catalogue(1200, seed=7)
+        self.data["SPECOBJID"] = np.arange(1200) * 7 + 3
+        self.first = {name: values[:1000] for name, values in self.data.items()}
+
+    def test_update(self):
+        stored, changed = incremental.classify_incremental(self.first)
+        self.assertTrue(changed.all())
+        # Corrected measurements and new galaxies
+        self.data["H_ALPHA_FLUX"][[5, 500]] *= 3.0
+        self.data["OI_6300_FLUX_ERR"][7] = -1.0
+        stored, changed = incremental.classify_incremental(self.data, stored)
+        self.assertEqual(list(np.flatnonzero(changed[:1000])), [5, 7, 500])
+        self.assertTrue(changed[1000:].all())
+        expected = mpa_jhu.classify_columns(self.data)
+        np.testing.assert_array_equal(stored["SPECOBJID"], self.data["SPECOBJID"])
+        for name, values in expected.items():
+            self.assertEqual(stored[name].dtype, values.dtype)
+            np.testing.assert_array_equal(stored[name], values)
+        # Batch with only some of the galaxies in a different order
+        batch = {name: values[[900, 3]] for name, values in self.data.items()}
+        batch["NII_6584_FLUX"] = batch["NII_6584_FLUX"] + 1.0
+        updated, changed = incremental.classify_incremental(batch, stored)
+        self.assertTrue(changed.all())
+        self.assertEqual(len(updated["SPECOBJID"]), 1200)
+        np.testing.assert_array_equal(
+            updated["flux_NII_6584"][[3, 900]],
+            mpa_jhu.classify_columns(batch)["flux_NII_6584"][::-1],
+        )
+        self.assertFalse(incremental.classify_incremental(self.data, stored)[1].any())
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "classification")
+            self.assertIsNone(incremental.load_classification(path))
+            for data in [self.first, self.data]:
+                stored = incremental.load_classification(path)
+                stored, changed = incremental.classify_incremental(data, stored)
+                incremental.save_classification(stored, path)
+            self.assertEqual(np.count_nonzero(changed), 200)
+            loaded = incremental.load_classification(path)
+            self.assertEqual(list(loaded), list(stored))
+            for name, values in stored.items():
+                np.testing.assert_array_equal(loaded[name], values)
+            self.assertEqual(os.listdir(tmp), ["classification"])
+            # Save stopped between the renames: the previous version is used
+            os.rename(path, path + ".old")
+            os.makedirs(path + ".tmp")
+            loaded = incremental.load_classification(path)
+            np.testing.assert_array_equal(loaded["SPECOBJID"], stored["SPECOBJID"])
+            # Save stopped while removing the previous version
+            os.makedirs(path + ".old")
+            incremental.save_classification(stored, path)
+            self.assertEqual(os.listdir(tmp), ["classification"])
+
+
+@unittest.skipIf(pd is None, "pandas is not installed")
+class TestPipeline(unittest.TestCase):
+    """
+    Test the alternative ways of running the MPA-JHU pipeline against the
+    monolithic run on a dataframe.
+    """
+
+    def setUp(self):
+        self.data = mpa_jhu_catalogue(2000, seed=1)
+        self.expected = mpa_jhu.classify(pd.DataFrame(self.data))
+
+    def test_chunks_dataframe(self):
+        chunks = mpa_jhu.iter_chunks(pd.DataFrame(self.data), 300)
+        out = pd.concat(mpa_jhu.classify_chunks(chunks))
+        pd.testing.assert_frame_equal(out, self.expected, check_exact=True)
+
+    def test_chunks_records(self):
+        records = np.rec.fromarrays(list(self.data.values()), names=list(self.data))
+        out = pd.concat(mpa_jhu.classify_chunks(mpa_jhu.iter_chunks(records, 300)))
+        pd.testing.assert_frame_equal(out, self.expected, check_exact=True)
+
+    def test_columns(self):
+        records = np.rec.fromarrays(list(self.data.values()), names=list(self.data))
+        for data in [self.data, records]:
+            out = mpa_jhu.classify_columns(data)
+            self.assertEqual(list(out), list(self.expected.columns[len(self.data) :]))
+            for name, values in out.items():
+                self.assertEqual(values.dtype, self.expected[name].dtype)
+                np.testing.assert_array_equal(values, self.expected[name])
+
+    def test_parallel(self):
+        for n_workers in [1, 2]:
+            out = parallel.classify_parallel(
+                pd.DataFrame(self.data), n_workers=n_workers, shard_size=700
+            )
+            pd.testing.assert_frame_equal(out, self.expected, check_exact=True)
+
+
 if __name__ == "__main__":
     unittest.main()